@@ -0,0 +1,121 @@
+# benchmarks/bench_batch_api.py
+"""
+Subida y descarga de muchos ficheros pequeños contra un uvicorn local: una
+petición por fichero (como hacían main.py y la GUI) frente a los endpoints por
+lotes (POST /add-batch y GET /download-batch).
+
+Uso:
+    python -m benchmarks.bench_batch_api [--files 5000] [--size 4096] [--batch 200]
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import start_server  # noqa: E402
+
+
+def make_files(directory, count, size, prefix):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{prefix}_{i}.bin")
+        with open(path, "wb") as f:
+            f.write(i.to_bytes(4, "little") + os.urandom(size - 4))
+        paths.append(path)
+    return paths
+
+
+def upload_each(http, url, paths, tag):
+    for path in paths:
+        with open(path, "rb") as f:
+            http.post(f"{url}/add", files={"file": (os.path.basename(path), f)}, data={"tags": tag}).raise_for_status()
+
+
+def upload_batches(http, url, paths, tag, batch):
+    for start in range(0, len(paths), batch):
+        with contextlib.ExitStack() as stack:
+            parts = [("files", (os.path.basename(p), stack.enter_context(open(p, "rb"))))
+                     for p in paths[start:start + batch]]
+            http.post(f"{url}/add-batch", files=parts, data={"tags": tag}).raise_for_status()
+
+
+def download_each(http, url, tag):
+    names, cursor = [], 0
+    while cursor is not None:
+        page = http.get(f"{url}/list", params={"q": tag, "limit": 1000, "cursor": cursor}).json()
+        names.extend(f["name"] for f in page["files"])
+        cursor = page["next_cursor"]
+    total = 0
+    for name in names:
+        total += len(http.get(f"{url}/download/{name}").content)
+    return len(names), total
+
+
+def download_batch(http, url, tag):
+    with http.get(f"{url}/download-batch", params={"q": tag}, stream=True) as r:
+        r.raise_for_status()
+        count = total = 0
+        with tarfile.open(fileobj=r.raw, mode="r|") as tar:
+            for member in tar:
+                total += len(tar.extractfile(member).read())
+                count += 1
+    return count, total
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_batch_")
+    src = os.path.join(workdir, "src")
+    os.makedirs(src)
+    proc, url = start_server(workdir, args.port)
+    results = []
+    try:
+        plain = requests  # sin sesión: una conexión nueva por petición
+        session = requests.Session()
+        for label, http, batched in (("por fichero", plain, False),
+                                     ("por fichero + sesión", session, False),
+                                     ("por lotes", session, True)):
+            tag = label.replace(" ", "_").replace("+", "")
+            paths = make_files(src, args.files, args.size, tag)
+            if batched:
+                up, _ = timed(lambda: upload_batches(http, url, paths, tag, args.batch))
+                down, (count, _) = timed(lambda: download_batch(http, url, tag))
+            else:
+                up, _ = timed(lambda: upload_each(http, url, paths, tag))
+                down, (count, _) = timed(lambda: download_each(http, url, tag))
+            if count != args.files:
+                print(f"[WARNING] {label}: se descargaron {count} de {args.files} ficheros")
+            results.append((label, up, down))
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    mb = args.files * args.size / 2 ** 20
+    print(f"{'modo':<22} {'subida s':>9} {'fich/s':>8} {'MB/s':>7} {'descarga s':>11} {'fich/s':>8}")
+    for label, up, down in results:
+        print(f"{label:<22} {up:>9.2f} {args.files / up:>8.0f} {mb / up:>7.1f} {down:>11.2f} {args.files / down:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
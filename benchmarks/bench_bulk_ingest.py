@@ -0,0 +1,63 @@
+# benchmarks/bench_bulk_ingest.py
+"""
+Compara add_files (sentencias sueltas por fichero y etiqueta) con
+add_files_bulk (etiquetas resueltas una vez, lotes transaccionales).
+
+Uso:
+    python -m benchmarks.bench_bulk_ingest [--files 20000] [--size 1024] [--batch-size 1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import database, manager  # noqa: E402
+
+
+def make_corpus(directory, n_files, size):
+    os.makedirs(directory, exist_ok=True)
+    payload = os.urandom(size)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(directory, f"doc_{i:07d}.bin")
+        with open(path, "wb") as f:
+            f.write(payload)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20_000)
+    parser.add_argument("--size", type=int, default=1024, help="bytes por fichero")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_bulk_")
+    paths = make_corpus(os.path.join(workdir, "corpus"), args.files, args.size)
+    tags = ["bench", "bulk", "2024"]
+
+    rows = []
+    for label in ("add_files", "add_files_bulk"):
+        manager.STORAGE_DIR = os.path.join(workdir, f"storage_{label}")
+        db_path = os.path.join(workdir, f"{label}.db")
+        database.init_db(db_path)
+        start = time.perf_counter()
+        if label == "add_files":
+            manager.add_files(paths, tags, db_path=db_path)
+        else:
+            manager.add_files_bulk(paths, tags, db_path=db_path, batch_size=args.batch_size)
+        seconds = time.perf_counter() - start
+        rows.append((label, seconds))
+
+    mb = args.files * args.size / (1024 * 1024)
+    print(f"{'modo':<16} {'s':>8} {'ficheros/s':>12} {'MB/s':>8}")
+    for label, seconds in rows:
+        print(f"{label:<16} {seconds:>8.2f} {args.files / seconds:>12.1f} {mb / seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# benchmarks/bench_cli.py
+"""
+Tiempo de reloj de `python main.py add <directorio> <etiquetas> --jobs N`
+contra un uvicorn local, para un directorio de --files ficheros pequeños y
+varios valores de --jobs. Cada ejecución sube un directorio distinto.
+
+Uso:
+    python -m benchmarks.bench_cli [--files 10000] [--size 4096] [--jobs 1,4,8]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import ROOT, start_server  # noqa: E402
+
+
+def make_dir(directory, count, size, prefix):
+    os.makedirs(directory)
+    for i in range(count):
+        with open(os.path.join(directory, f"{prefix}_{i}.bin"), "wb") as f:
+            f.write(i.to_bytes(4, "little") + os.urandom(size - 4))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--jobs", default="1,4,8")
+    parser.add_argument("--port", type=int, default=8768)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_cli_")
+    proc, url = start_server(workdir, args.port)
+    results = []
+    try:
+        for jobs in (int(j) for j in args.jobs.split(",")):
+            directory = os.path.join(workdir, f"src_{jobs}")
+            make_dir(directory, args.files, args.size, f"j{jobs}")
+            start = time.perf_counter()
+            done = subprocess.run(
+                [sys.executable, os.path.join(ROOT, "main.py"), "add", directory, f"cli_{jobs}", "--jobs", str(jobs)],
+                env=dict(os.environ, API_URL=url), capture_output=True, text=True,
+            )
+            seconds = time.perf_counter() - start
+            last = done.stdout.strip().splitlines()[-1] if done.stdout.strip() else done.stderr.strip()
+            results.append((jobs, seconds, last))
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'jobs':>5} {'segundos':>9} {'archivos/s':>11}  salida")
+    for jobs, seconds, last in results:
+        print(f"{jobs:>5} {seconds:>9.2f} {args.files / seconds:>11.0f}  {last}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# benchmarks/bench_compression.py
+"""
+Compresión de blobs (TBFS_COMPRESSION, core/storage.py) sobre corpus mixtos.
+
+Para cada corpus (logs de texto, JSON, binario incompresible tipo JPEG/zip y
+una mezcla de los tres) y cada codec (identity, gzip) mide:
+- disco ocupado en storage/ frente al tamaño original;
+- ingesta con add_files_bulk (ficheros/s y MB/s de contenido original);
+- latencia de GET /download en un uvicorn local, pidiendo gzip (se envía tal
+  cual) e identity (el servidor descomprime al vuelo).
+
+Uso:
+    python -m benchmarks.bench_compression [--files 2000] [--size 65536] [--downloads 200] [--corpus mixto]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import start_server  # noqa: E402
+from core import database, manager, storage  # noqa: E402
+
+CORPORA = ("logs", "json", "binario", "mixto")
+LEVELS = ("INFO", "INFO", "INFO", "DEBUG", "WARNING", "ERROR")
+
+
+def make_content(kind, size, rng):
+    """Contenido de unos size bytes del tipo indicado."""
+    if kind == "binario":
+        return rng.randbytes(size)
+    parts, total = [], 0
+    while total < size:
+        if kind == "logs":
+            line = (f"2024-05-{rng.randint(1, 31):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                    f"{rng.randint(0, 59):02d} {rng.choice(LEVELS)} worker-{rng.randint(1, 16)} "
+                    f"petición {rng.getrandbits(32):08x} atendida en {rng.random() * 200:.1f} ms\n")
+        else:
+            line = json.dumps({"id": rng.getrandbits(40), "user": f"u{rng.randint(1, 5000)}",
+                               "tags": rng.sample(["foto", "video", "2024", "viaje", "trabajo"], 2),
+                               "score": round(rng.random(), 4), "ok": rng.random() > 0.1}) + "\n"
+        parts.append(line)
+        total += len(line)
+    return "".join(parts).encode()[:size]
+
+
+def generate(directory, corpus, files, size, seed):
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths, total = [], 0
+    for i in range(files):
+        kind = CORPORA[i % 3] if corpus == "mixto" else corpus
+        content = make_content(kind, max(int(rng.lognormvariate(0, 0.5) * size), 1), rng)
+        path = os.path.join(directory, f"{kind}_{i:06d}")
+        with open(path, "wb") as f:
+            f.write(content)
+        paths.append(path)
+        total += len(content)
+    return paths, total
+
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names)
+
+
+def download_latency(url, names, encoding, rng):
+    session = requests.Session()
+    samples = []
+    for name in rng.sample(names, len(names)):
+        start = time.perf_counter()
+        with session.get(f"{url}/download/{name}", headers={"Accept-Encoding": encoding}, stream=True) as r:
+            r.raise_for_status()
+            for _ in r.raw.stream(1024 * 1024, decode_content=False):
+                pass
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(workdir, corpus, codec, args, port):
+    server_dir = os.path.join(workdir, f"{corpus}_{codec}")
+    db_path = os.path.join(server_dir, "database", "db.db")
+    manager.STORAGE_DIR = os.path.join(server_dir, "storage")
+    storage.COMPRESSION = codec
+    paths, total = generate(os.path.join(workdir, f"src_{corpus}"), corpus, args.files, args.size, args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        database.init_db(db_path)
+        stats = manager.add_files_bulk(paths, ["bench"], db_path)
+    database.close_pool()
+    used = disk_usage(manager.STORAGE_DIR)
+
+    names = [os.path.basename(p) for p in paths][:args.downloads]
+    proc, url = start_server(server_dir, port, quiet=True)
+    try:
+        rng = random.Random(args.seed)
+        gzip_ms = download_latency(url, names, "gzip", rng)
+        identity_ms = download_latency(url, names, "identity", rng)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return total, used, stats, gzip_ms, identity_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=64 * 1024, help="tamaño mediano de los ficheros")
+    parser.add_argument("--downloads", type=int, default=200)
+    parser.add_argument("--corpus", choices=CORPORA, action="append")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=8795)
+    args = parser.parse_args()
+
+    print(f"{'corpus':<8} {'codec':<9} {'original':>10} {'disco':>10} {'ratio':>6} {'fich/s':>8} {'MB/s':>7} "
+          f"{'GET gzip':>9} {'GET ident':>10}")
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_compression_")
+    try:
+        for corpus in args.corpus or CORPORA:
+            for codec in (storage.IDENTITY, storage.GZIP):
+                total, used, stats, gzip_ms, identity_ms = run(workdir, corpus, codec, args, args.port)
+                print(f"{corpus:<8} {codec:<9} {total / 2 ** 20:>8.1f}MB {used / 2 ** 20:>8.1f}MB "
+                      f"{used / total:>6.2f} {stats['files_per_sec']:>8.0f} {stats['mb_per_sec']:>7.1f} "
+                      f"{gzip_ms:>7.2f}ms {identity_ms:>8.2f}ms")
+    finally:
+        database.close_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/bench_copy_pipeline.py
+"""
+Ingesta con el pipeline de copia en paralelo: tiempo y MB/s según el número
+de hilos de copia, para muchos ficheros pequeños y pocos ficheros grandes.
+
+Uso:
+    python -m benchmarks.bench_copy_pipeline [--workers 1,2,4,8]
+        [--small-files 5000] [--small-size 4096] [--large-files 8] [--large-size 67108864]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import database, manager  # noqa: E402
+from benchmarks.bench_bulk_ingest import make_corpus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--small-files", type=int, default=5000)
+    parser.add_argument("--small-size", type=int, default=4096)
+    parser.add_argument("--large-files", type=int, default=8)
+    parser.add_argument("--large-size", type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_copy_")
+    workloads = {
+        "pequeños": (make_corpus(os.path.join(workdir, "small"), args.small_files, args.small_size),
+                     args.small_files * args.small_size),
+        "grandes": (make_corpus(os.path.join(workdir, "large"), args.large_files, args.large_size),
+                    args.large_files * args.large_size),
+    }
+
+    print(f"{'carga':<10} {'hilos':>6} {'s':>8} {'ficheros/s':>12} {'MB/s':>9}")
+    for label, (paths, total_bytes) in workloads.items():
+        for workers in (int(w) for w in args.workers.split(",")):
+            run_dir = os.path.join(workdir, f"run_{label}_{workers}")
+            manager.STORAGE_DIR = os.path.join(run_dir, "storage")
+            db_path = os.path.join(run_dir, "db.db")
+            database.init_db(db_path)
+            start = time.perf_counter()
+            manager.add_files_bulk(paths, ["bench"], db_path=db_path, workers=workers)
+            seconds = time.perf_counter() - start
+            print(f"{label:<10} {workers:>6} {seconds:>8.2f} {len(paths) / seconds:>12.1f} "
+                  f"{total_bytes / (1024 * 1024) / seconds:>9.1f}")
+            database.close_pool()
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
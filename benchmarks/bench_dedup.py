@@ -0,0 +1,71 @@
+# benchmarks/bench_dedup.py
+"""
+Almacenamiento direccionado por contenido: ratio de deduplicación y ahorro de
+tiempo de ingesta con un corpus con duplicados frente a otro del mismo tamaño
+con todo el contenido distinto.
+
+Uso:
+    python -m benchmarks.bench_dedup [--unique 1000] [--copies 4] [--size 262144]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import database, manager  # noqa: E402
+
+
+def make_corpus(directory, n_unique, copies, size, duplicated):
+    """n_unique * copies ficheros; si duplicated, cada contenido se repite copies veces."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(n_unique):
+        payload = os.urandom(size)
+        for c in range(copies):
+            if not duplicated and c:
+                payload = os.urandom(size)
+            path = os.path.join(directory, f"doc_{i:06d}_{c}.bin")
+            with open(path, "wb") as f:
+                f.write(payload)
+            paths.append(path)
+    return paths
+
+
+def du(directory):
+    total = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--unique", type=int, default=1000)
+    parser.add_argument("--copies", type=int, default=4)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_dedup_")
+    print(f"{'corpus':<14} {'lógico MB':>10} {'en disco MB':>12} {'ratio':>7} {'s':>7} {'MB/s':>8}")
+    for label, duplicated in (("sin duplicados", False), ("con duplicados", True)):
+        paths = make_corpus(os.path.join(workdir, label), args.unique, args.copies, args.size, duplicated)
+        manager.STORAGE_DIR = os.path.join(workdir, f"storage_{duplicated}")
+        db_path = os.path.join(workdir, f"{duplicated}.db")
+        database.init_db(db_path)
+        start = time.perf_counter()
+        stats = manager.add_files_bulk(paths, ["bench"], db_path=db_path)
+        seconds = time.perf_counter() - start
+        logical = stats["bytes"] / (1024 * 1024)
+        on_disk = du(manager.STORAGE_DIR) / (1024 * 1024)
+        print(f"{label:<14} {logical:>10.1f} {on_disk:>12.1f} {logical / on_disk:>6.2f}x "
+              f"{seconds:>7.2f} {logical / seconds:>8.1f}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# benchmarks/bench_index.py
+"""
+Compara los motores de query_files ("sql" frente a "index") en consultas AND
+sobre un catálogo sintético (por defecto 1M ficheros y 10k etiquetas con
+popularidad Zipf).
+
+Uso:
+    python -m benchmarks.bench_index [--files 1000000] [--tags 10000] [--tags-per-file 5]
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import database, index, manager  # noqa: E402
+
+
+def build_catalogue(db_path, n_files, n_tags, tags_per_file, seed=42, schema_version=None):
+    """
+    Inserta n_files ficheros con etiquetas elegidas según una Zipf (s=1).
+    schema_version: migrar sólo hasta esa versión (por defecto, todas).
+    """
+    rng = random.Random(seed)
+    database.migrate(db_path, target=schema_version)
+    conn, cursor = database.get_connection(db_path)
+    cursor.executemany("INSERT INTO tags (id, tag) VALUES (?, ?)",
+                       [(i + 1, f"tag{i}") for i in range(n_tags)])
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(n_tags)))
+    tag_ids = range(1, n_tags + 1)
+    batch_files, batch_links = [], []
+    for fid in range(1, n_files + 1):
+        batch_files.append((fid, f"file_{fid}", f"/dev/null/{fid}"))
+        for tag_id in set(rng.choices(tag_ids, cum_weights=cum_weights, k=tags_per_file)):
+            batch_links.append((fid, tag_id))
+        if len(batch_files) >= 50_000:
+            cursor.executemany("INSERT INTO files (id, name, path) VALUES (?, ?, ?)", batch_files)
+            cursor.executemany("INSERT INTO file_tags (file_id, tag_id) VALUES (?, ?)", batch_links)
+            batch_files, batch_links = [], []
+    cursor.executemany("INSERT INTO files (id, name, path) VALUES (?, ?, ?)", batch_files)
+    cursor.executemany("INSERT INTO file_tags (file_id, tag_id) VALUES (?, ?)", batch_links)
+    conn.commit()
+    database.close_connection(conn)
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=10_000)
+    parser.add_argument("--tags-per-file", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="tbfs_bench_index_"), "db.db")
+    start = time.perf_counter()
+    build_catalogue(db_path, args.files, args.tags, args.tags_per_file)
+    print(f"[INFO] Catálogo: {args.files} ficheros, {args.tags} etiquetas ({time.perf_counter() - start:.1f}s)")
+
+    start = time.perf_counter()
+    index.get_index(db_path)
+    print(f"[INFO] Índice construido en {time.perf_counter() - start:.2f}s")
+
+    queries = {
+        "popular+popular": ["tag0", "tag1"],
+        "popular+media": ["tag0", "tag50"],
+        "popular+rara": ["tag0", f"tag{args.tags - 1}"],
+        "3 populares": ["tag0", "tag1", "tag2"],
+    }
+    print(f"{'consulta':<18} {'resultados':>10} {'sql (ms)':>10} {'index (ms)':>11} {'mejora':>8}")
+    for label, tags in queries.items():
+        t_sql, rows_sql = timed(lambda: manager.query_files(tags, db_path, engine="sql"), args.repeat)
+        t_idx, rows_idx = timed(lambda: manager.query_files(tags, db_path, engine="index"), args.repeat)
+        assert [r[0] for r in rows_sql] == [r[0] for r in rows_idx], label
+        print(f"{label:<18} {len(rows_sql):>10} {t_sql * 1000:>10.1f} {t_idx * 1000:>11.1f} {t_sql / t_idx:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
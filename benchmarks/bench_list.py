@@ -0,0 +1,83 @@
+# benchmarks/bench_list.py
+"""
+Tamaño de respuesta y latencia de GET /list sobre un catálogo sintético
+(por defecto 1M ficheros): la lista completa de antes frente a páginas por
+cursor (primera, profunda, filtrada, con total) y la exportación NDJSON.
+
+Las peticiones se hacen en proceso con el TestClient de Starlette contra
+server.api, con la base de datos en un directorio temporal.
+
+Uso:
+    python -m benchmarks.bench_list [--files 1000000] [--tags 10000] [--limit 100]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_index import build_catalogue  # noqa: E402
+
+
+def measure(fn, repeat):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_list_")
+    os.makedirs(os.path.join(workdir, "database"))
+    os.chdir(workdir)
+    start = time.perf_counter()
+    build_catalogue("database/db.db", args.files, args.tags, 5)
+    print(f"[INFO] Catálogo: {args.files} ficheros ({time.perf_counter() - start:.1f}s)")
+
+    from starlette.testclient import TestClient
+    from core import manager
+    from server.api import app
+    client = TestClient(app)
+
+    def get(path, **params):
+        def run():
+            r = client.get(path, params=params)
+            r.raise_for_status()
+            return len(r.content)
+        return run
+
+    def full_list():
+        # Lo que devolvía /list antes: todas las filas con path en un único JSON
+        rows = manager.query_files([])
+        return len(json.dumps({"files": [{"id": i, "name": n, "tags": t, "path": p} for i, n, t, p in rows]}))
+
+    cases = [
+        ("lista completa (antes)", full_list, 1),
+        ("primera página", get("/list", limit=args.limit), args.repeat),
+        ("primera página + total", get("/list", limit=args.limit, count="true"), args.repeat),
+        ("página profunda", get("/list", limit=args.limit, cursor=args.files - 10 * args.limit), args.repeat),
+        ("página con path", get("/list", limit=args.limit, fields="id,name,tags,path"), args.repeat),
+        ("filtrada tag0 AND tag1", get("/list", limit=args.limit, q="tag0 AND tag1"), args.repeat),
+        ("filtrada rara", get("/list", limit=args.limit, q=f"tag{args.tags - 1}"), args.repeat),
+        ("exportación NDJSON", get("/list/export"), 1),
+    ]
+    print(f"{'caso':<24} {'bytes':>12} {'ms':>10}")
+    for label, fn, repeat in cases:
+        seconds, size = measure(fn, repeat)
+        print(f"{label:<24} {size:>12} {seconds * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/bench_metrics.py
+"""
+Coste de las métricas (core/metrics.py): ejecuta la suite (benchmarks/suite.py)
+dos veces en procesos nuevos, con TBFS_METRICS=0 y con TBFS_METRICS=1, y
+compara las medianas de cada escenario (la variable se lee al importar).
+Con --rounds N se alternan N pasadas de cada una y se queda la mejor mediana,
+para que el orden de ejecución no pese en máquinas pequeñas.
+
+Uso:
+    python -m benchmarks.bench_metrics [--files 5000] [--repeat 20] [--rounds 2] [--only REGEX] [--no-http]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import ROOT  # noqa: E402
+from benchmarks.suite import compare_results  # noqa: E402
+
+
+def run_suite(enabled, out, args):
+    cmd = [sys.executable, "-m", "benchmarks.suite", "run", "--out", out,
+           "--files", str(args.files), "--repeat", str(args.repeat)]
+    if args.only:
+        cmd += ["--only", args.only]
+    if args.no_http:
+        cmd.append("--no-http")
+    env = dict(os.environ, TBFS_METRICS="1" if enabled else "0", TBFS_LOG_LEVEL="WARNING")
+    subprocess.run(cmd, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(out) as f:
+        return json.load(f)["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--only")
+    parser.add_argument("--no-http", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tbfs_bench_metrics_") as workdir:
+        off, on = {}, {}
+        for r in range(args.rounds):
+            for enabled, best in ((False, off), (True, on)):
+                results = run_suite(enabled, os.path.join(workdir, f"{enabled}_{r}.json"), args)
+                for name, result in results.items():
+                    if name not in best or result["median_ms"] < best[name]["median_ms"]:
+                        best[name] = result
+
+    print(f"{'escenario':<32} {'sin ms':>9} {'con ms':>9} {'coste':>8}")
+    rows = compare_results(off, on, threshold=float("inf"), min_ms=0)
+    for name, old, cur, change, _ in rows:
+        print(f"{name:<32} {old:>9.2f} {cur:>9.2f} {change:>+8.1%}")
+    total_off = sum(row[1] for row in rows)
+    total_on = sum(row[2] for row in rows)
+    print(f"[INFO] Suma de medianas: {total_off:.1f} ms sin métricas, {total_on:.1f} ms con métricas "
+          f"({(total_on - total_off) / total_off:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# benchmarks/bench_packs.py
+"""
+Packs para objetos pequeños (TBFS_PACK_THRESHOLD, core/packs.py) frente a un
+fichero por blob, con muchos ficheros diminutos.
+
+Para cada modo (sueltos: umbral 0; packs: --threshold) mide:
+- ingesta con manager.add_uploads en lotes de --batch (BlobWriter alimentado
+  desde memoria, sin ficheros de origen en disco);
+- ficheros bajo storage/, bloques ocupados y lo que tarda recorrerlo (os.walk);
+- lecturas aleatorias en proceso (get_file_info + storage.open_blob), por segundo;
+- GET /download aleatorios en un uvicorn local, por segundo (un cliente);
+- borrado de storage/ (lo que hace reset_db).
+Las lecturas son con la caché de páginas caliente: miden el coste por fichero
+(open, stat, inodos), no el del disco.
+
+Uso:
+    python -m benchmarks.bench_packs [--files 1000000] [--size 1024] [--reads 20000] [--http-reads 2000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import start_server  # noqa: E402
+from core import database, manager, packs, storage  # noqa: E402
+
+MODES = ("sueltos", "packs")
+
+
+def contents(files, size, seed):
+    """(nombre, contenido) distintos (sin deduplicación), tamaños alrededor de size."""
+    rng = random.Random(seed)
+    for i in range(files):
+        yield f"f{i:07d}", rng.randbytes(max(int(rng.lognormvariate(0, 0.5) * size), 1))
+
+
+def ingest(args, db_path, storage_dir):
+    start = time.perf_counter()
+    batch = []
+    for name, data in contents(args.files, args.size, args.seed):
+        writer = storage.BlobWriter(storage_dir)
+        writer.write(data)
+        batch.append((name, writer))
+        if len(batch) == args.batch:
+            manager.add_uploads(batch, ["bench"], db_path)
+            batch = []
+    if batch:
+        manager.add_uploads(batch, ["bench"], db_path)
+    return args.files / (time.perf_counter() - start)
+
+
+def walk(storage_dir):
+    """(ficheros, bytes en bloques ocupados, segundos en recorrerlo)."""
+    start = time.perf_counter()
+    files = blocks = 0
+    for root, _, names in os.walk(storage_dir):
+        for name in names:
+            files += 1
+            blocks += os.lstat(os.path.join(root, name)).st_blocks
+    return files, blocks * 512, time.perf_counter() - start
+
+
+def random_reads(names, db_path):
+    start = time.perf_counter()
+    for name in names:
+        info = manager.get_file_info(name, db_path)
+        with storage.open_blob(info["path"], info["codec"], info["offset"], info["length"]) as f:
+            f.read()
+    return len(names) / (time.perf_counter() - start)
+
+
+def http_reads(url, names):
+    session = requests.Session()
+    start = time.perf_counter()
+    for name in names:
+        session.get(f"{url}/download/{name}").raise_for_status()
+    return len(names) / (time.perf_counter() - start)
+
+
+def run(workdir, mode, args, port):
+    server_dir = os.path.join(workdir, mode)
+    db_path = os.path.join(server_dir, "database", "db.db")
+    storage_dir = os.path.join(server_dir, "storage")
+    manager.STORAGE_DIR = storage_dir
+    packs.THRESHOLD = args.threshold if mode == "packs" else 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        database.init_db(db_path)
+        files_per_sec = ingest(args, db_path, storage_dir)
+    files, disk, walk_seconds = walk(storage_dir)
+
+    rng = random.Random(args.seed)
+    names = [f"f{rng.randrange(args.files):07d}" for _ in range(args.reads)]
+    reads_per_sec = random_reads(names, db_path)
+    database.close_pool()
+    packs.close()
+
+    proc, url = start_server(server_dir, port, quiet=True,
+                             extra_env={"TBFS_PACK_THRESHOLD": str(packs.THRESHOLD), "TBFS_LOG_LEVEL": "WARNING"})
+    try:
+        http_per_sec = http_reads(url, names[:args.http_reads])
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    start = time.perf_counter()
+    shutil.rmtree(storage_dir)
+    return files_per_sec, files, disk, walk_seconds, reads_per_sec, http_per_sec, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--size", type=int, default=1024, help="tamaño mediano de los ficheros")
+    parser.add_argument("--threshold", type=int, default=64 * 1024, help="TBFS_PACK_THRESHOLD del modo packs")
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--http-reads", type=int, default=2000)
+    parser.add_argument("--mode", choices=MODES, action="append")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=8796)
+    args = parser.parse_args()
+
+    print(f"{'modo':<8} {'ingesta/s':>10} {'ficheros':>9} {'disco':>9} {'os.walk':>8} "
+          f"{'lect/s':>8} {'GET/s':>7} {'borrado':>8}")
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_packs_")
+    try:
+        for mode in args.mode or MODES:
+            ingest_rate, files, disk, walk_s, reads, gets, rm_s = run(workdir, mode, args, args.port)
+            print(f"{mode:<8} {ingest_rate:>10.0f} {files:>9} {disk / 2 ** 20:>7.0f}MB {walk_s:>7.2f}s "
+                  f"{reads:>8.0f} {gets:>7.0f} {rm_s:>7.2f}s")
+    finally:
+        database.close_pool()
+        packs.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
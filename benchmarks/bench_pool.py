@@ -0,0 +1,91 @@
+# benchmarks/bench_pool.py
+"""
+Compara peticiones/segundo de /list y /download con el pool de conexiones
+desactivado (una conexión por llamada) y activado.
+
+Uso:
+    python -m benchmarks.bench_pool [--files 2000] [--requests 2000]
+
+Se ejecuta en un directorio temporal: la base de datos y los ficheros de
+prueba no tocan database/ ni storage/ del proyecto.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import database  # noqa: E402
+
+
+def populate(workdir, n_files):
+    """Crea n_files ficheros pequeños y sus registros (3 etiquetas cada uno)."""
+    db_path = os.path.join(workdir, "database", "db.db")
+    database.init_db(db_path)
+    conn, cursor = database.get_connection(db_path)
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    tags = [f"tag{i}" for i in range(50)]
+    cursor.executemany("INSERT OR IGNORE INTO tags (tag) VALUES (?)", [(t,) for t in tags])
+    for i in range(n_files):
+        name = f"file_{i}.txt"
+        path = os.path.join(data_dir, name)
+        with open(path, "w") as f:
+            f.write("x" * 512)
+        cursor.execute("INSERT INTO files (name, path) VALUES (?, ?)", (name, path))
+        file_id = cursor.lastrowid
+        for j in (i % 50, (i * 7) % 50, (i * 13) % 50):
+            cursor.execute(
+                "INSERT OR IGNORE INTO file_tags (file_id, tag_id) SELECT ?, id FROM tags WHERE tag = ?",
+                (file_id, tags[j]),
+            )
+    conn.commit()
+    database.close_connection(conn)
+    return db_path
+
+
+def run(client, n_requests, n_files):
+    results = {}
+    start = time.perf_counter()
+    for i in range(n_requests):
+        client.get("/list", params={"tags": f"tag{i % 50}"}).raise_for_status()
+    results["list"] = n_requests / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(n_requests):
+        client.get(f"/download/file_{i % n_files}.txt").raise_for_status()
+    results["download"] = n_requests / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_pool_")
+    os.chdir(workdir)  # server.api usa rutas relativas (database/db.db)
+    populate(workdir, args.files)
+
+    from fastapi.testclient import TestClient
+    from server import api
+
+    rows = []
+    for label, enabled in (("sin pool", False), ("con pool", True)):
+        database.configure_pool(enabled=enabled)
+        with TestClient(api.app) as client:
+            client.get("/list", params={"tags": "tag0"})  # calentamiento
+            rows.append((label, run(client, args.requests, args.files)))
+
+    print(f"{'modo':<10} {'/list req/s':>14} {'/download req/s':>16}")
+    for label, r in rows:
+        print(f"{label:<10} {r['list']:>14.1f} {r['download']:>16.1f}")
+    base, pooled = rows[0][1], rows[1][1]
+    print(f"mejora: /list x{pooled['list'] / base['list']:.2f}, /download x{pooled['download'] / base['download']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
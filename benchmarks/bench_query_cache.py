@@ -0,0 +1,90 @@
+# benchmarks/bench_query_cache.py
+"""
+Latencia p50/p99 de GET /list con la caché de consultas activada y desactivada.
+
+Carga: --requests peticiones filtradas elegidas (con sesgo Zipf) entre --queries
+expresiones distintas, como la página de Streamlit que repite el filtro en cada
+rerun. Cada --write-every peticiones se hace un add_tags sobre una etiqueta
+rara, que sólo invalida las consultas que comparten ficheros con ella.
+
+Uso:
+    python -m benchmarks.bench_query_cache [--files 200000] [--tags 5000] [--requests 2000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_index import build_catalogue  # noqa: E402
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def make_queries(n_tags, n_queries, rng):
+    queries = []
+    for i in range(n_queries):
+        a, b, c = (rng.randrange(n_tags // 10 + 1) for _ in range(3))
+        form = i % 3
+        if form == 0:
+            queries.append(f"tag{a} AND tag{b}")
+        elif form == 1:
+            queries.append(f"(tag{a} OR tag{b}) AND NOT tag{c}")
+        else:
+            queries.append(f"tag{a}")
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--tags", type=int, default=5_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2_000)
+    parser.add_argument("--write-every", type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_cache_")
+    os.makedirs(os.path.join(workdir, "database"))
+    os.chdir(workdir)
+    build_catalogue("database/db.db", args.files, args.tags, 5)
+
+    from starlette.testclient import TestClient
+    from core import cache, manager
+    from server.api import app
+    client = TestClient(app)
+
+    rng = random.Random(7)
+    queries = make_queries(args.tags, args.queries, rng)
+    weights = [1.0 / (rank + 1) for rank in range(len(queries))]
+    workload = rng.choices(queries, weights=weights, k=args.requests)
+    rare = f"tag{args.tags - 1}"
+
+    print(f"{'caché':<6} {'p50 ms':>8} {'p99 ms':>8} {'media ms':>9} {'aciertos':>9} {'fallos':>7} "
+          f"{'expuls.':>8} {'invalid.':>9}")
+    for enabled in (False, True):
+        cache.set_enabled(enabled)
+        before = cache.stats()
+        samples = []
+        for i, q in enumerate(workload):
+            if args.write_every and i % args.write_every == args.write_every - 1:
+                manager.add_tags([rare], [f"extra{i}"])
+            start = time.perf_counter()
+            client.get("/list", params={"q": q, "count": "true"}).raise_for_status()
+            samples.append((time.perf_counter() - start) * 1000)
+        after = cache.stats()
+        delta = {k: after[k] - before[k] for k in ("hits", "misses", "evictions", "invalidations")}
+        print(f"{'sí' if enabled else 'no':<6} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f} "
+              f"{statistics.mean(samples):>9.2f} {delta['hits']:>9} {delta['misses']:>7} "
+              f"{delta['evictions']:>8} {delta['invalidations']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/bench_query_planner.py
+"""
+Calidad del planificador de consultas booleanas: compara el plan ordenado por
+cardinalidad con la evaluación ingenua de izquierda a derecha (filas de
+postings leídas y tiempo), con los motores "sql" e "index".
+
+Uso:
+    python -m benchmarks.bench_query_planner [--files 200000] [--tags 10000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import index, manager  # noqa: E402
+from benchmarks.bench_index import build_catalogue  # noqa: E402
+
+
+def run(expression, db_path, engine, naive, repeat):
+    best, stats, ids = float("inf"), None, None
+    for _ in range(repeat):
+        stats = {}
+        start = time.perf_counter()
+        ids = manager.match_expression(expression, db_path, engine=engine, naive=naive, stats=stats)
+        best = min(best, time.perf_counter() - start)
+    return best, stats["rows"], ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--tags", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="tbfs_bench_planner_"), "db.db")
+    build_catalogue(db_path, args.files, args.tags, tags_per_file=5)
+    index.get_index(db_path)
+
+    rare = f"tag{args.tags - 1}"
+    expressions = [
+        f"tag0 AND tag1 AND {rare}",
+        f"(tag0 OR tag1) AND tag500 AND NOT tag2",
+        f"tag0 AND NOT tag3 AND tag7777",
+        f"tag1 AND (tag2 OR tag3) AND {rare}",
+    ]
+    print(f"{'expresión':<42} {'motor':<6} {'filas naive':>12} {'filas plan':>11} {'ms naive':>9} {'ms plan':>8}")
+    for expr in expressions:
+        for engine in ("sql", "index"):
+            t_naive, rows_naive, ids_naive = run(expr, db_path, engine, True, args.repeat)
+            t_plan, rows_plan, ids_plan = run(expr, db_path, engine, False, args.repeat)
+            assert ids_naive == ids_plan, expr
+            print(f"{expr:<42} {engine:<6} {rows_naive:>12} {rows_plan:>11} "
+                  f"{t_naive * 1000:>9.1f} {t_plan * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# benchmarks/bench_replicas.py
+"""
+Escalado de lecturas con seguidores (core/replication.py): arranca un líder,
+le sube --seed ficheros y, para 0..--max-followers seguidores, espera a que
+estén al día y lanza una carga de sólo lectura (/list y /download, la mezcla
+de benchmarks/load_test.py) repartida entre los seguidores (con 0, contra el
+líder).
+
+En una sola máquina todos los procesos comparten núcleos y disco: la cifra
+útil es cuánto deja de ser cuello de botella un único proceso.
+
+Uso:
+    python -m benchmarks.bench_replicas [--max-followers 3] [--concurrency 32] [--duration 15]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import start_server  # noqa: E402
+from benchmarks.load_test import download, list_page, parse_mix, upload  # noqa: E402
+
+
+def wait_caught_up(urls, head, timeout=120):
+    """Espera a que todos los seguidores hayan aplicado hasta head y sirvan lecturas."""
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            status = requests.get(f"{url}/replication/status").json()
+            if status["applied"] >= head and not status["stale"]:
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} no se puso al día")
+            time.sleep(0.2)
+
+
+async def read_load(urls, names, args):
+    samples, errors = {}, {}
+    mix = parse_mix(args.mix)
+    ops, weights = list(mix), list(mix.values())
+    limits = httpx.Limits(max_connections=args.concurrency)
+    # Como un cliente real, sigue las redirecciones al líder de un seguidor atrasado
+    clients = [httpx.AsyncClient(base_url=url, timeout=120, limits=limits, follow_redirects=True) for url in urls]
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(client, rng):
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights=weights)[0]
+            start = time.perf_counter()
+            try:
+                if op == "list":
+                    await list_page(client, rng)
+                else:
+                    await download(client, rng, names)
+            except httpx.HTTPError:
+                errors[op] = errors.get(op, 0) + 1
+                continue
+            samples.setdefault(op, []).append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[worker(clients[i % len(clients)], random.Random(i)) for i in range(args.concurrency)])
+    finally:
+        for client in clients:
+            await client.aclose()
+    return samples, errors, time.perf_counter() - start
+
+
+async def seed(url, args):
+    rng, counter = random.Random(1), [0]
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        return [await upload(client, rng, args.size, counter) for _ in range(args.seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-followers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    parser.add_argument("--seed", type=int, default=200)
+    parser.add_argument("--mix", default="list=7,download=3")
+    parser.add_argument("--port", type=int, default=8780)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_replicas_")
+    procs = []
+    try:
+        proc, leader = start_server(os.path.join(workdir, "leader"), args.port, extra_env={"TBFS_ROLE": "leader"})
+        procs.append(proc)
+        names = asyncio.run(seed(leader, args))
+        head = requests.get(f"{leader}/replication/status").json()["head"]
+
+        print(f"{'seguidores':>10} {'pet/s':>8} {'listados/s':>11} {'descargas/s':>12} {'errores':>8}")
+        followers = []
+        for count in range(args.max_followers + 1):
+            while len(followers) < count:
+                i = len(followers) + 1
+                proc, url = start_server(os.path.join(workdir, f"follower{i}"), args.port + i,
+                                         extra_env={"TBFS_ROLE": "follower", "TBFS_LEADER_URL": leader})
+                procs.append(proc)
+                followers.append(url)
+            wait_caught_up(followers, head)
+            samples, errors, seconds = asyncio.run(read_load(followers or [leader], names, args))
+            total = sum(len(v) for v in samples.values())
+            rate = {op: len(samples.get(op, [])) / seconds for op in ("list", "download")}
+            print(f"{count:>10} {total / seconds:>8.1f} {rate['list']:>11.1f} {rate['download']:>12.1f} "
+                  f"{sum(errors.values()):>8}")
+    finally:
+        # Seguidores antes que el líder
+        for proc in reversed(procs):
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
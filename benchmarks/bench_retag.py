@@ -0,0 +1,60 @@
+# benchmarks/bench_retag.py
+"""
+Reetiquetado masivo: add_tags y delete_tags sobre el 10%, 50% y 100% de un
+catálogo sintético (por defecto 200k ficheros).
+
+Uso:
+    python -m benchmarks.bench_retag [--files 200000] [--tags 5000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_index import build_catalogue  # noqa: E402
+from core import database, manager  # noqa: E402
+
+
+def mark_fraction(db_path, tag, every):
+    """Etiqueta con tag uno de cada `every` ficheros."""
+    conn, cursor = database.get_connection(db_path)
+    cursor.execute("INSERT INTO tags (tag) VALUES (?)", (tag,))
+    tag_id = cursor.lastrowid
+    cursor.execute("INSERT INTO file_tags (file_id, tag_id) SELECT id, ? FROM files WHERE id % ? = 0", (tag_id, every))
+    conn.commit()
+    database.close_connection(conn)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--tags", type=int, default=5_000)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="tbfs_bench_retag_"), "db.db")
+    build_catalogue(db_path, args.files, args.tags, 5)
+    for label, every in (("10%", 10), ("50%", 2), ("100%", 1)):
+        mark_fraction(db_path, f"sel{every}", every)
+
+    print(f"{'fracción':<9} {'ficheros':>9} {'add_tags s':>11} {'delete_tags s':>14}")
+    for label, every in (("10%", 10), ("50%", 2), ("100%", 1)):
+        query = [f"sel{every}"]
+        add = timed(lambda: manager.add_tags(query, ["retag_a", "retag_b"], db_path=db_path))
+        delete = timed(lambda: manager.delete_tags(query, ["retag_a", "retag_b"], db_path=db_path))
+        print(f"{label:<9} {args.files // every:>9} {add:>11.2f} {delete:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_schema.py
+"""
+Efecto de las migraciones de esquema (índice (tag_id, file_id), tag_counts,
+file_tags WITHOUT ROWID) sobre un catálogo sintético grande.
+
+Construye el catálogo con el esquema base (migración 1), mide query_files
+(motor "sql") y la lectura de la lista de una etiqueta, aplica el resto de
+migraciones (midiendo cuánto tardan) y repite las medidas.
+
+Uso:
+    python -m benchmarks.bench_schema [--files 1000000] [--tags 10000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_index import build_catalogue, timed  # noqa: E402
+from core import database, manager  # noqa: E402
+
+
+def posting(db_path, tag):
+    conn, cursor = database.get_connection(db_path)
+    cursor.execute("SELECT ft.file_id FROM file_tags ft JOIN tags t ON t.id = ft.tag_id WHERE t.tag = ?", (tag,))
+    rows = cursor.fetchall()
+    database.close_connection(conn)
+    return rows
+
+
+def db_size(db_path):
+    """Tamaño del fichero principal tras volcar el WAL."""
+    conn, _ = database.get_connection(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    database.close_connection(conn)
+    return os.path.getsize(db_path)
+
+
+def measure(db_path, queries, repeat):
+    out = {}
+    for label, tags in queries.items():
+        seconds, _ = timed(lambda: manager._query_files(tags, db_path, "sql"), repeat)
+        out[label] = seconds
+    seconds, _ = timed(lambda: posting(db_path, queries["popular+rara"][1]), repeat)
+    out["lista de etiqueta rara"] = seconds
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="tbfs_bench_schema_"), "db.db")
+    build_catalogue(db_path, args.files, args.tags, 5, schema_version=1)
+    queries = {
+        "popular+popular": ["tag0", "tag1"],
+        "popular+rara": ["tag0", f"tag{args.tags - 1}"],
+        "rara": [f"tag{args.tags - 2}"],
+    }
+    size_before = db_size(db_path)
+    before = measure(db_path, queries, args.repeat)
+
+    start = time.perf_counter()
+    database.migrate(db_path)
+    print(f"[INFO] Migraciones {database.schema_version(db_path)} aplicadas en {time.perf_counter() - start:.1f}s")
+    size_after = db_size(db_path)
+    after = measure(db_path, queries, args.repeat)
+
+    print(f"{'consulta':<24} {'base (ms)':>10} {'migrado (ms)':>13} {'mejora':>8}")
+    for label in before:
+        print(f"{label:<24} {before[label] * 1000:>10.1f} {after[label] * 1000:>13.1f} "
+              f"{before[label] / after[label]:>7.1f}x")
+    print(f"{'tamaño BD (MB)':<24} {size_before / 2 ** 20:>10.1f} {size_after / 2 ** 20:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
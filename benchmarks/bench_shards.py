@@ -0,0 +1,67 @@
+# benchmarks/bench_shards.py
+"""
+Escalado del modo shard: para 1..--max-nodes nodos arranca los server.api y el
+coordinador en local y lanza contra el coordinador la misma carga mixta que
+benchmarks/load_test.py (subidas, listados, descargas).
+
+En una sola máquina todos los nodos compiten por los mismos núcleos y el mismo
+disco; la cifra útil es cómo escala el hilo escritor y la E/S al repartirse.
+
+Uso:
+    python -m benchmarks.bench_shards [--max-nodes 4] [--concurrency 32] [--duration 15]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import start_server  # noqa: E402
+from benchmarks.load_test import run  # noqa: E402
+
+
+def run_cluster(nodes, args):
+    workdir = tempfile.mkdtemp(prefix=f"tbfs_shards{nodes}_")
+    procs = []
+    try:
+        urls = []
+        for i in range(nodes):
+            proc, url = start_server(os.path.join(workdir, f"node{i}"), args.port + 1 + i)
+            procs.append(proc)
+            urls.append(url)
+        proc, url = start_server(os.path.join(workdir, "coordinator"), args.port,
+                                 extra_env={"TBFS_SHARDS": ",".join(urls)}, app="server.coordinator:app")
+        procs.append(proc)
+        return asyncio.run(run(url, args))
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-nodes", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--size", type=int, default=256 * 1024)
+    parser.add_argument("--seed", type=int, default=20)
+    parser.add_argument("--mix", default="upload=3,list=5,download=2")
+    parser.add_argument("--port", type=int, default=8770)
+    args = parser.parse_args()
+
+    print(f"{'nodos':>5} {'pet/s':>8} {'subidas/s':>10} {'listados/s':>11} {'descargas/s':>12} {'errores':>8}")
+    for nodes in range(1, args.max_nodes + 1):
+        samples, errors, seconds = run_cluster(nodes, args)
+        total = sum(len(v) for v in samples.values())
+        rate = {op: len(samples.get(op, [])) / seconds for op in ("upload", "list", "download")}
+        print(f"{nodes:>5} {total / seconds:>8.1f} {rate['upload']:>10.1f} {rate['list']:>11.1f} "
+              f"{rate['download']:>12.1f} {sum(errors.values()):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_tag_column.py
+"""
+Listados con la lista de etiquetas desnormalizada (files.tags, migración 6)
+frente al GROUP_CONCAT sobre file_tags + tags que se usaba antes.
+
+Construye el catálogo con el esquema 5, mide las consultas antiguas, aplica la
+migración 6 (midiendo cuánto tarda el relleno) y mide las consultas nuevas:
+una página de /list, el listado completo y una consulta filtrada.
+
+Uso:
+    python -m benchmarks.bench_tag_column [--files 1000000] [--tags 10000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_index import build_catalogue, timed  # noqa: E402
+from benchmarks.bench_schema import db_size  # noqa: E402
+from core import database, manager  # noqa: E402
+
+OLD_PAGE = """
+    SELECT f.id, f.name,
+           (SELECT GROUP_CONCAT(t.tag) FROM file_tags ft JOIN tags t ON t.id = ft.tag_id
+            WHERE ft.file_id = f.id),
+           f.path
+    FROM files f WHERE f.id > ? ORDER BY f.id LIMIT ?
+"""
+OLD_ALL = """
+    SELECT f.id, f.name, GROUP_CONCAT(DISTINCT t.tag) as tags, f.path
+    FROM files f
+    LEFT JOIN file_tags ft ON f.id = ft.file_id
+    LEFT JOIN tags t ON ft.tag_id = t.id
+    GROUP BY f.id ORDER BY f.id
+"""
+OLD_FILTERED = """
+    SELECT f.id, f.name, GROUP_CONCAT(DISTINCT t.tag) as tags, f.path
+    FROM files f
+    LEFT JOIN file_tags ft ON f.id = ft.file_id
+    LEFT JOIN tags t ON ft.tag_id = t.id
+    WHERE f.id IN (SELECT ft.file_id FROM file_tags ft JOIN tags t ON t.id = ft.tag_id WHERE t.tag = ?)
+    GROUP BY f.id ORDER BY f.id
+"""
+NEW_ALL = "SELECT f.id, f.name, f.tags, f.path FROM files f ORDER BY f.id"
+NEW_FILTERED = """
+    SELECT f.id, f.name, f.tags, f.path FROM files f
+    WHERE f.id IN (SELECT ft.file_id FROM file_tags ft JOIN tags t ON t.id = ft.tag_id WHERE t.tag = ?)
+    ORDER BY f.id
+"""
+
+
+def fetch(db_path, sql, params=()):
+    conn, cursor = database.get_connection(db_path)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    database.close_connection(conn)
+    return rows
+
+
+def new_page(db_path, after, limit):
+    conn, cursor = database.get_connection(db_path)
+    rows = manager._fetch_after(cursor, after, limit)
+    database.close_connection(conn)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=10_000)
+    parser.add_argument("--page", type=int, default=manager.PAGE_LIMIT)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="tbfs_bench_tag_column_"), "db.db")
+    build_catalogue(db_path, args.files, args.tags, 5, schema_version=5)
+    middle = args.files // 2
+    tag = f"tag{args.tags // 2}"
+
+    before = {
+        "página (mitad)": timed(lambda: fetch(db_path, OLD_PAGE, (middle, args.page)), args.repeat)[0],
+        "listado completo": timed(lambda: fetch(db_path, OLD_ALL), args.repeat)[0],
+        "filtrado 1 etiqueta": timed(lambda: fetch(db_path, OLD_FILTERED, (tag,)), args.repeat)[0],
+    }
+    size_before = db_size(db_path)
+
+    start = time.perf_counter()
+    database.migrate(db_path)
+    print(f"[INFO] Migración a files.tags en {time.perf_counter() - start:.1f}s")
+    size_after = db_size(db_path)
+    if database.check_file_tags(db_path):
+        print("[ERROR] files.tags no coincide con file_tags tras la migración")
+
+    after = {
+        "página (mitad)": timed(lambda: new_page(db_path, middle, args.page), args.repeat)[0],
+        "listado completo": timed(lambda: fetch(db_path, NEW_ALL), args.repeat)[0],
+        "filtrado 1 etiqueta": timed(lambda: fetch(db_path, NEW_FILTERED, (tag,)), args.repeat)[0],
+    }
+
+    print(f"{'consulta':<22} {'GROUP_CONCAT ms':>16} {'files.tags ms':>14} {'mejora':>8}")
+    for label in before:
+        print(f"{label:<22} {before[label] * 1000:>16.1f} {after[label] * 1000:>14.1f} "
+              f"{before[label] / after[label]:>7.1f}x")
+    print(f"{'tamaño BD (MB)':<22} {size_before / 2 ** 20:>16.1f} {size_after / 2 ** 20:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_upload.py
+"""
+Memoria y rendimiento de subidas grandes y concurrentes contra un uvicorn local.
+
+Lanza el servidor en un directorio temporal, sube --concurrency ficheros de
+--size bytes a la vez (PUT /files/{nombre} en streaming, y POST /add multipart)
+y muestra el pico de memoria residente del servidor (VmHWM) y los MB/s.
+
+Uso:
+    python -m benchmarks.bench_upload [--size 2147483648] [--concurrency 4] [--port 8765]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CHUNK = 1024 * 1024
+
+
+def start_server(workdir, port, extra_env=None, app="server.api:app", quiet=False):
+    """
+    Arranca uvicorn con app (por defecto server.api) en workdir y espera a que responda.
+    quiet: descartar la salida del servidor.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=ROOT, TBFS_STORAGE_DIR=os.path.join(workdir, "storage"), **(extra_env or {}))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL if quiet else None,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=0.5)
+            return proc, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("El servidor no arrancó")
+
+
+def peak_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def generate(size, seed):
+    block = (seed.to_bytes(4, "little") + os.urandom(CHUNK - 4))
+    sent = 0
+    while sent < size:
+        n = min(CHUNK, size - sent)
+        yield block[:n]
+        sent += n
+
+
+def upload_put(url, i, size):
+    r = requests.put(f"{url}/files/put_{i}.bin", params={"tags": "bench"}, data=generate(size, i))
+    r.raise_for_status()
+
+
+def upload_multipart(url, path, i):
+    with open(path, "rb") as f:
+        r = requests.post(f"{url}/add", files={"file": (f"mp_{i}.bin", f)}, data={"tags": "bench"})
+    r.raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2 * 1024 ** 3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_upload_")
+    total_mb = args.size * args.concurrency / (1024 * 1024)
+    print(f"{'modo':<10} {'MB subidos':>10} {'s':>8} {'MB/s':>8} {'pico RSS servidor MB':>21}")
+    for mode in ("put", "multipart"):
+        proc, url = start_server(os.path.join(workdir, mode), args.port)
+        try:
+            sources = []
+            if mode == "multipart":
+                for i in range(args.concurrency):
+                    path = os.path.join(workdir, f"src_{i}.bin")
+                    with open(path, "wb") as f:
+                        for chunk in generate(args.size, i):
+                            f.write(chunk)
+                    sources.append(path)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                if mode == "put":
+                    futures = [pool.submit(upload_put, url, i, args.size) for i in range(args.concurrency)]
+                else:
+                    futures = [pool.submit(upload_multipart, url, p, i) for i, p in enumerate(sources)]
+                for fut in futures:
+                    fut.result()
+            seconds = time.perf_counter() - start
+            print(f"{mode:<10} {total_mb:>10.0f} {seconds:>8.2f} {total_mb / seconds:>8.1f} {peak_rss_mb(proc.pid):>21.1f}")
+            for path in sources:
+                os.remove(path)
+        finally:
+            proc.terminate()
+            proc.wait()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
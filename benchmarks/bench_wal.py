@@ -0,0 +1,110 @@
+# benchmarks/bench_wal.py
+"""
+Puesta al día incremental del índice invertido con el registro de cambios
+(core/wal.py) frente a reconstruirlo desde la base de datos.
+
+Construye un catálogo de --files ficheros, carga el índice, aplica --rounds
+rondas de escrituras reales de core.manager (altas, add_tags, delete_tags,
+bajas) con el registro activo y compara:
+- reconstrucción completa (TagIndex.load) contra catch_up desde el seq del índice;
+- cuánto ocupa el registro y cuánto tarda/ocupa tras compactarlo.
+
+Uso:
+    python -m benchmarks.bench_wal [--files 1000000] [--tags 10000] [--rounds 50]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_index import build_catalogue, timed  # noqa: E402
+from core import database, index, manager, wal  # noqa: E402
+
+
+def load_index(db_path):
+    idx = index.TagIndex()
+    conn, cursor = database.get_connection(db_path)
+    idx.load(cursor)
+    database.close_connection(conn)
+    return idx
+
+
+def write_round(db_path, src_dir, r, files_per_round):
+    """Una ronda: alta de files_per_round ficheros, reetiquetado, y baja de la ronda anterior."""
+    paths = []
+    for i in range(files_per_round):
+        path = os.path.join(src_dir, f"r{r}_{i}.bin")
+        with open(path, "wb") as f:
+            f.write(f"{r}-{i}".encode())
+        paths.append(path)
+    manager.add_files_bulk(paths, [f"ronda{r}", "tag1"], db_path)
+    manager.add_tags([f"ronda{r}"], ["revisar", f"tag{r % 100}"], db_path)
+    manager.delete_tags([f"ronda{r}"], ["tag1"], db_path)
+    if r:
+        manager.delete_files([f"ronda{r - 1}"], db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--tags", type=int, default=10_000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--files-per-round", type=int, default=100)
+    parser.add_argument("--segment-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_bench_wal_")
+    db_path = os.path.join(workdir, "db.db")
+    src_dir = os.path.join(workdir, "src")
+    os.makedirs(src_dir)
+    manager.STORAGE_DIR = os.path.join(workdir, "storage")
+    wal.ENABLED, wal.SEGMENT_BYTES, wal.COMPACT_SEGMENTS = True, args.segment_bytes, 0
+    try:
+        build_catalogue(db_path, args.files, args.tags, 5)
+        # La primera escritura empieza el registro con el catálogo (tramo compactado)
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_round(db_path, src_dir, 0, args.files_per_round)
+        full, idx = timed(lambda: load_index(db_path), args.repeat)
+        start_seq = idx.seq
+        seeded = wal.get_log(db_path).size()
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for r in range(1, args.rounds + 1):
+                write_round(db_path, src_dir, r, args.files_per_round)
+        writes = time.perf_counter() - start
+        log = wal.get_log(db_path)
+        records = log.head - start_seq
+
+        start = time.perf_counter()
+        applied = idx.catch_up(log)
+        incremental = time.perf_counter() - start
+        rebuilt = load_index(db_path)
+        assert idx.postings == rebuilt.postings, "catch_up no coincide con la reconstrucción"
+
+        size = log.size()
+        start = time.perf_counter()
+        log.compact()
+        compact_seconds = time.perf_counter() - start
+
+        print(f"Catálogo: {args.files} ficheros; {args.rounds} rondas de escrituras en {writes:.2f}s")
+        print(f"Registro: {records} registros, {(size - seeded) / 1024:.1f} KiB "
+              f"({(size - seeded) / max(records, 1):.0f} B/registro) tras un tramo inicial de {seeded / 1024:.1f} KiB")
+        print(f"Reconstrucción completa: {full * 1000:10.1f} ms")
+        print(f"catch_up ({applied} registros): {incremental * 1000:7.1f} ms  ({full / incremental:.0f}x)")
+        print(f"Compactación: {compact_seconds * 1000:.1f} ms, {size / 1024:.1f} -> {log.size() / 1024:.1f} KiB")
+    finally:
+        wal.close_logs()
+        database.close_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
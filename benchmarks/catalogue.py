@@ -0,0 +1,120 @@
+# benchmarks/catalogue.py
+"""
+Generador de catálogos sintéticos y reproducibles (misma semilla = mismos
+ficheros, tamaños y etiquetas) para benchmarks/suite.py.
+
+- Etiquetas t0, t1, ... con popularidad Zipf: la de rango r aparece con
+  probabilidad proporcional a 1 / (r + 1) ** zipf_s.
+- Tamaños log-normales alrededor de size_median, acotados a [1, max_size].
+
+Uso (sólo generar ficheros en un directorio):
+    python -m benchmarks.catalogue DIRECTORIO [--files 10000] [--tags 1000] [--size-median 16384]
+"""
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+from typing import List, NamedTuple, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core import database, manager  # noqa: E402
+
+
+class Spec(NamedTuple):
+    files: int = 10_000
+    tags: int = 1_000
+    tags_per_file: int = 3
+    zipf_s: float = 1.0
+    size_median: int = 16 * 1024
+    size_sigma: float = 1.0
+    max_size: int = 4 * 1024 * 1024
+    seed: int = 42
+
+
+DEFAULT = Spec()
+
+
+def tag_name(rank: int) -> str:
+    """Nombre de la etiqueta de rango rank (t0 es la más popular)."""
+    return f"t{rank}"
+
+
+def generate(directory: str, spec: Spec, prefix: str = "f") -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Escribe spec.files ficheros en directory y devuelve [(ruta, etiquetas)].
+    El contenido empieza por el nombre, así que no hay dos iguales (sin deduplicación).
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(spec.seed)
+    cum_weights = list(itertools.accumulate(1.0 / (r + 1) ** spec.zipf_s for r in range(spec.tags)))
+    ranks = range(spec.tags)
+    entries = []
+    for i in range(spec.files):
+        name = f"{prefix}{i:07d}.bin"
+        size = min(max(int(rng.lognormvariate(math.log(spec.size_median), spec.size_sigma)), 1), spec.max_size)
+        tags = tuple(tag_name(r) for r in sorted(set(rng.choices(ranks, cum_weights=cum_weights,
+                                                                  k=spec.tags_per_file))))
+        path = os.path.join(directory, name)
+        head = name.encode()
+        with open(path, "wb") as f:
+            f.write(head + rng.randbytes(max(size - len(head), 0)))
+        entries.append((path, tags))
+    return entries
+
+
+def load(db_path: str, entries: List[Tuple[str, Tuple[str, ...]]], base_tag: str = "bench") -> None:
+    """
+    Registra el catálogo: ingesta real (add_files_bulk, copia a storage/) con
+    base_tag, y después las etiquetas de cada fichero por SQL en un solo lote.
+    """
+    database.init_db(db_path)
+    manager.add_files_bulk([path for path, _ in entries], [base_tag], db_path)
+    conn, cursor = database.get_connection(db_path)
+    try:
+        tags = sorted({t for _, file_tags in entries for t in file_tags})
+        cursor.executemany("INSERT OR IGNORE INTO tags (tag) VALUES (?)", [(t,) for t in tags])
+        tag_ids = dict(cursor.execute("SELECT tag, id FROM tags").fetchall())
+        file_ids = dict(cursor.execute("SELECT name, id FROM files").fetchall())
+        cursor.executemany("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)", [
+            (file_ids[os.path.basename(path)], tag_ids[t]) for path, file_tags in entries for t in file_tags
+        ])
+        conn.commit()
+    finally:
+        database.close_connection(conn)
+
+
+def popularity(entries) -> List[Tuple[str, int]]:
+    """[(etiqueta, ficheros)] de más a menos popular."""
+    counts = {}
+    for _, tags in entries:
+        for t in tags:
+            counts[t] = counts.get(t, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--files", type=int, default=DEFAULT.files)
+    parser.add_argument("--tags", type=int, default=DEFAULT.tags)
+    parser.add_argument("--tags-per-file", type=int, default=DEFAULT.tags_per_file)
+    parser.add_argument("--zipf-s", type=float, default=DEFAULT.zipf_s)
+    parser.add_argument("--size-median", type=int, default=DEFAULT.size_median)
+    parser.add_argument("--size-sigma", type=float, default=DEFAULT.size_sigma)
+    parser.add_argument("--max-size", type=int, default=DEFAULT.max_size)
+    parser.add_argument("--seed", type=int, default=DEFAULT.seed)
+    args = parser.parse_args()
+    spec = Spec(args.files, args.tags, args.tags_per_file, args.zipf_s, args.size_median,
+                args.size_sigma, args.max_size, args.seed)
+    entries = generate(args.directory, spec)
+    total = sum(os.path.getsize(p) for p, _ in entries)
+    print(f"[INFO] {len(entries)} ficheros ({total / 1024 / 1024:.1f} MiB) en {args.directory}")
+    for tag, count in popularity(entries)[:5]:
+        print(f"  {tag}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/load_test.py
+"""
+Prueba de carga contra un uvicorn local: tráfico mixto de subidas, listados y
+descargas con --concurrency clientes concurrentes durante --duration segundos.
+
+Antes de medir se siembran --seed ficheros para tener algo que listar y
+descargar. Por operación muestra peticiones, errores, p50/p99 y peticiones/s.
+
+Uso:
+    python -m benchmarks.load_test [--concurrency 32] [--duration 20] [--size 4194304]
+                                   [--mix upload=1,list=6,download=3]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.bench_upload import start_server  # noqa: E402
+
+TAGS = ["fotos", "video", "docs", "2024", "2025", "borrador"]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+async def upload(client, rng, size, counter):
+    counter[0] += 1
+    name = f"carga_{os.getpid()}_{counter[0]}.bin"
+    tags = ",".join(rng.sample(TAGS, 2))
+    payload = rng.randbytes(size)
+    r = await client.put(f"/files/{name}", params={"tags": tags}, content=payload)
+    r.raise_for_status()
+    return name
+
+
+async def list_page(client, rng):
+    q = rng.choice(["fotos", "video AND 2024", "(docs OR fotos) AND NOT borrador", ""])
+    r = await client.get("/list", params={"q": q, "limit": 50})
+    r.raise_for_status()
+
+
+async def download(client, rng, names):
+    async with client.stream("GET", f"/download/{rng.choice(names)}") as r:
+        r.raise_for_status()
+        async for _ in r.aiter_bytes(1024 * 1024):
+            pass
+
+
+async def worker(client, rng, mix, size, names, samples, errors, counter, deadline):
+    ops, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, weights=weights)[0]
+        start = time.perf_counter()
+        try:
+            if op == "upload":
+                names.append(await upload(client, rng, size, counter))
+            elif op == "list":
+                await list_page(client, rng)
+            else:
+                await download(client, rng, names)
+        except httpx.HTTPError:
+            errors[op] = errors.get(op, 0) + 1
+            continue
+        samples.setdefault(op, []).append(time.perf_counter() - start)
+
+
+async def run(url, args):
+    rng = random.Random(1)
+    counter = [0]
+    names = []
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        for _ in range(args.seed):
+            names.append(await upload(client, rng, args.size, counter))
+        samples, errors = {}, {}
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            worker(client, random.Random(i), parse_mix(args.mix), args.size, names, samples, errors, counter, deadline)
+            for i in range(args.concurrency)
+        ])
+        return samples, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--seed", type=int, default=20)
+    parser.add_argument("--mix", default="upload=1,list=6,download=3")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tbfs_load_")
+    proc, url = start_server(workdir, args.port)
+    try:
+        samples, errors, seconds = asyncio.run(run(url, args))
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'operación':<10} {'peticiones':>10} {'errores':>8} {'p50 ms':>8} {'p99 ms':>8} {'pet/s':>8}")
+    total = 0
+    for op in sorted(set(samples) | set(errors)):
+        lat = sorted(samples.get(op, [0.0]))
+        total += len(samples.get(op, []))
+        p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+        print(f"{op:<10} {len(samples.get(op, [])):>10} {errors.get(op, 0):>8} "
+              f"{statistics.median(lat) * 1000:>8.1f} {p99 * 1000:>8.1f} {len(samples.get(op, [])) / seconds:>8.1f}")
+    print(f"{'total':<10} {total:>10} {sum(errors.values()):>8} {'':>8} {'':>8} {total / seconds:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# benchmarks/suite.py
+"""
+Suite de benchmarks reproducible de core.manager y de la API HTTP.
+
+run: genera un catálogo sintético (benchmarks/catalogue.py), lo carga en una
+base de datos nueva y mide cada escenario --repeat veces:
+- core.*: add_files, query_files (1..3 etiquetas, populares y selectivas, sin
+  caché), add_tags, delete_tags, delete_files y download_file.
+- http.*: los mismos casos contra server/api.py en un uvicorn local (POST /add,
+  GET /list, POST /add-tags, POST /delete-tags, DELETE /delete y
+  GET /download); /list pasa por la caché de consultas del servidor, como en
+  producción.
+Los resultados (ms: min, mediana, p95, media) y los datos del entorno se
+guardan en JSON.
+
+compare: compara dos JSON y marca como regresión todo escenario cuya mediana
+empeora más de --threshold (y más de --min-ms). Sale con código 1 si hay alguna.
+
+Uso:
+    python -m benchmarks.suite run [--out resultados.json] [--files 10000] [--tags 1000] [--repeat 20]
+                                   [--only REGEX] [--no-http]
+    python -m benchmarks.suite compare base.json nuevo.json [--threshold 0.10] [--min-ms 0.5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks import catalogue  # noqa: E402
+from benchmarks.bench_upload import ROOT, start_server  # noqa: E402
+from core import cache, database, manager  # noqa: E402
+
+# Ficheros por alta en add_files / POST /add
+ADD_BATCH = 20
+
+
+def summarize(samples):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "runs": len(ms),
+        "min_ms": round(ms[0], 3),
+        "median_ms": round(statistics.median(ms), 3),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(ms), 3),
+    }
+
+
+class Runner:
+    """Acumula las muestras de cada escenario (filtrados por --only)."""
+
+    def __init__(self, only=None):
+        self.only = re.compile(only) if only else None
+        self.samples = {}
+
+    def wants(self, name):
+        return self.only is None or bool(self.only.search(name))
+
+    def time(self, name, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        return result
+
+    def results(self):
+        return {name: summarize(samples) for name, samples in sorted(self.samples.items())}
+
+
+def query_sets(entries):
+    """{"popular_N"/"selective_N": etiquetas} a partir de la popularidad real del catálogo."""
+    ranked = [tag for tag, _ in catalogue.popularity(entries)]
+    middle = len(ranked) // 2
+    sets = {}
+    for n in (1, 2, 3):
+        sets[f"popular_{n}"] = ranked[:n]
+        sets[f"selective_{n}"] = ranked[middle:middle + n]
+    return sets
+
+
+def new_files(directory, spec, prefix):
+    """ADD_BATCH ficheros nuevos (otra semilla y otro prefijo que el catálogo)."""
+    small = spec._replace(files=ADD_BATCH, seed=zlib.crc32(prefix.encode()))
+    return [path for path, _ in catalogue.generate(directory, small, prefix=prefix)]
+
+
+def core_scenarios(runner, workdir, spec, entries, repeat):
+    db_path = os.path.join(workdir, "core", "db.db")
+    manager.STORAGE_DIR = os.path.join(workdir, "core", "storage")
+    catalogue.load(db_path, entries)
+    queries = query_sets(entries)
+    retag = queries["popular_1"][0]
+    names = [os.path.basename(path) for path, _ in entries]
+    rng = random.Random(spec.seed)
+    out_dir = os.path.join(workdir, "core", "downloads")
+    os.makedirs(out_dir)
+
+    for run in range(repeat):
+        if runner.wants("core.add_files") or runner.wants("core.delete_files"):
+            paths = new_files(os.path.join(workdir, "core", f"new{run}"), spec, f"c{run}_")
+            runner.time("core.add_files", manager.add_files, paths, ["nuevo", f"lote{run}"], db_path)
+            runner.time("core.delete_files", manager.delete_files, [f"lote{run}"], db_path)
+        for label, tags in queries.items():
+            name = f"core.query_files.{label}"
+            if runner.wants(name):
+                cache.clear()
+                runner.time(name, manager.query_files, tags, db_path)
+        if runner.wants("core.add_tags") or runner.wants("core.delete_tags"):
+            runner.time("core.add_tags", manager.add_tags, [retag], ["extra"], db_path)
+            runner.time("core.delete_tags", manager.delete_tags, [retag], ["extra"], db_path)
+        if runner.wants("core.download_file"):
+            name = rng.choice(names)
+            runner.time("core.download_file", manager.download_file, name, out_dir, db_path)
+            os.remove(os.path.join(out_dir, name))
+    database.close_pool()
+
+
+def http_scenarios(runner, workdir, spec, entries, repeat, port):
+    server_dir = os.path.join(workdir, "http")
+    manager.STORAGE_DIR = os.path.join(server_dir, "storage")
+    catalogue.load(os.path.join(server_dir, "database", "db.db"), entries)
+    database.close_pool()
+    queries = query_sets(entries)
+    retag = queries["popular_1"][0]
+    names = [os.path.basename(path) for path, _ in entries]
+    rng = random.Random(spec.seed)
+
+    proc, url = start_server(server_dir, port, quiet=True)
+    session = requests.Session()
+
+    def call(method, path, **kwargs):
+        r = session.request(method, url + path, **kwargs)
+        r.raise_for_status()
+        return r
+
+    def add(paths, tags):
+        for path in paths:
+            with open(path, "rb") as f:
+                call("POST", "/add", files={"file": (os.path.basename(path), f)}, data={"tags": tags})
+
+    def download(name):
+        with session.get(f"{url}/download/{name}", stream=True) as r:
+            r.raise_for_status()
+            for _ in r.iter_content(1024 * 1024):
+                pass
+
+    try:
+        for run in range(repeat):
+            if runner.wants("http.add") or runner.wants("http.delete"):
+                paths = new_files(os.path.join(workdir, "http_new", str(run)), spec, f"h{run}_")
+                runner.time("http.add", add, paths, f"nuevo,lote{run}")
+                runner.time("http.delete", call, "DELETE", "/delete", params={"tags": f"lote{run}"})
+            for label, tags in queries.items():
+                name = f"http.list.{label}"
+                if runner.wants(name):
+                    runner.time(name, call, "GET", "/list", params=[("tags", t) for t in tags])
+            if runner.wants("http.add-tags") or runner.wants("http.delete-tags"):
+                runner.time("http.add-tags", call, "POST", "/add-tags", params={"query": retag, "new_tags": "extra"})
+                runner.time("http.delete-tags", call, "POST", "/delete-tags",
+                            params={"query": retag, "del_tags": "extra"})
+            if runner.wants("http.download"):
+                runner.time("http.download", download, rng.choice(names))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def environment(spec, args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "catalogue": spec._asdict(),
+        "repeat": args.repeat,
+    }
+
+
+def run(args):
+    spec = catalogue.Spec(args.files, args.tags, args.tags_per_file, args.zipf_s, args.size_median,
+                          args.size_sigma, args.max_size, args.seed)
+    workdir = tempfile.mkdtemp(prefix="tbfs_suite_")
+    runner = Runner(args.only)
+    try:
+        entries = catalogue.generate(os.path.join(workdir, "catalogue"), spec)
+        with contextlib.redirect_stdout(io.StringIO()):
+            core_scenarios(runner, workdir, spec, entries, args.repeat)
+            if not args.no_http:
+                http_scenarios(runner, workdir, spec, entries, args.repeat, args.port)
+    finally:
+        database.close_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": environment(spec, args), "results": runner.results()}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{'escenario':<32} {'mediana':>9} {'p95':>9} {'min':>9}")
+    for name, r in report["results"].items():
+        print(f"{name:<32} {r['median_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['min_ms']:>9.2f}")
+    print(f"[INFO] Resultados guardados en {args.out}")
+
+
+def compare_results(base, new, threshold, min_ms):
+    """[(escenario, mediana base, mediana nueva, cambio relativo, estado)] de los escenarios comunes."""
+    rows = []
+    for name in sorted(set(base) & set(new)):
+        old, cur = base[name]["median_ms"], new[name]["median_ms"]
+        change = (cur - old) / old if old else 0.0
+        if change > threshold and cur - old > min_ms:
+            status = "REGRESIÓN"
+        elif change < -threshold and old - cur > min_ms:
+            status = "mejora"
+        else:
+            status = ""
+        rows.append((name, old, cur, change, status))
+    return rows
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    for key in ("commit", "cpus", "catalogue"):
+        if base["environment"].get(key) != new["environment"].get(key):
+            print(f"[WARNING] {key} distinto: {base['environment'].get(key)} -> {new['environment'].get(key)}")
+    rows = compare_results(base["results"], new["results"], args.threshold, args.min_ms)
+    print(f"{'escenario':<32} {'base ms':>9} {'nuevo ms':>9} {'cambio':>8}")
+    for name, old, cur, change, status in rows:
+        print(f"{name:<32} {old:>9.2f} {cur:>9.2f} {change:>+8.1%}  {status}")
+    only_one = set(base["results"]) ^ set(new["results"])
+    if only_one:
+        print(f"[WARNING] Escenarios sólo en uno de los dos: {', '.join(sorted(only_one))}")
+    regressions = [row for row in rows if row[4] == "REGRESIÓN"]
+    if regressions:
+        print(f"[ERROR] {len(regressions)} regresión(es) de más del {args.threshold:.0%}")
+        sys.exit(1)
+    print("[OK] Sin regresiones")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="ejecutar la suite y guardar los resultados en JSON")
+    p.add_argument("--out", default="bench-results.json")
+    p.add_argument("--files", type=int, default=catalogue.DEFAULT.files)
+    p.add_argument("--tags", type=int, default=catalogue.DEFAULT.tags)
+    p.add_argument("--tags-per-file", type=int, default=catalogue.DEFAULT.tags_per_file)
+    p.add_argument("--zipf-s", type=float, default=catalogue.DEFAULT.zipf_s)
+    p.add_argument("--size-median", type=int, default=catalogue.DEFAULT.size_median)
+    p.add_argument("--size-sigma", type=float, default=catalogue.DEFAULT.size_sigma)
+    p.add_argument("--max-size", type=int, default=catalogue.DEFAULT.max_size)
+    p.add_argument("--seed", type=int, default=catalogue.DEFAULT.seed)
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--only", help="expresión regular sobre los nombres de escenario")
+    p.add_argument("--no-http", action="store_true", help="sólo escenarios core.*")
+    p.add_argument("--port", type=int, default=8790)
+    p.set_defaults(func=run)
+
+    p = sub.add_parser("compare", help="comparar dos resultados y marcar regresiones")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10, help="empeoramiento relativo de la mediana")
+    p.add_argument("--min-ms", type=float, default=0.5, help="diferencia absoluta mínima para contar")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# core/aio.py
+"""
+Capa asíncrona sobre core.manager para el servidor.
+
+sqlite3 y las escrituras a disco son bloqueantes, así que nada de eso corre en
+el bucle de eventos:
+
+- Lecturas de la base de datos: un pool de TBFS_DB_READERS hilos; cada hilo
+  tiene su conexión del pool de core.database.
+- Escrituras de la base de datos: un único hilo escritor. SQLite admite un solo
+  escritor a la vez; serializarlas aquí evita esperas de busy_timeout y
+  reintentos entre hilos del servidor.
+- E/S de ficheros (volcado de subidas, stat, ...): un pool de TBFS_IO_WORKERS hilos.
+
+Las funciones tienen el mismo nombre y argumentos que en core.manager.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+from core import database
+from core import manager
+from core import storage
+
+DB_READERS = int(os.getenv("TBFS_DB_READERS", "4"))
+IO_WORKERS = int(os.getenv("TBFS_IO_WORKERS", "8"))
+
+_readers: Optional[ThreadPoolExecutor] = None
+_writer: Optional[ThreadPoolExecutor] = None
+_io: Optional[ThreadPoolExecutor] = None
+
+
+def start() -> None:
+    """Crea los ejecutores (se llama también de forma perezosa en el primer uso)."""
+    global _readers, _writer, _io
+    if _readers is None:
+        _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="tbfs-db-read")
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tbfs-db-write")
+        _io = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="tbfs-io")
+
+
+def shutdown() -> None:
+    """Espera a las tareas pendientes, cierra los ejecutores y las conexiones del pool."""
+    global _readers, _writer, _io
+    for executor in (_writer, _readers, _io):
+        if executor is not None:
+            executor.shutdown(wait=True)
+    _readers = _writer = _io = None
+    database.close_pool()
+
+
+async def _run(executor_name: str, fn, *args, **kwargs):
+    start()
+    executor = {"read": _readers, "write": _writer, "io": _io}[executor_name]
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_read(fn, *args, **kwargs):
+    return await _run("read", fn, *args, **kwargs)
+
+
+async def run_write(fn, *args, **kwargs):
+    return await _run("write", fn, *args, **kwargs)
+
+
+async def run_io(fn, *args, **kwargs):
+    return await _run("io", fn, *args, **kwargs)
+
+
+# --- Lecturas ---
+
+async def file_exists(file_name: str, db_path: str = "database/db.db") -> bool:
+    return await run_read(manager.file_exists, file_name, db_path)
+
+
+async def page_files(expression=None, query_tags=None, after: int = 0, limit: int = manager.PAGE_LIMIT,
+                     count: bool = False, db_path: str = "database/db.db"):
+    return await run_read(manager.page_files, expression, query_tags, after=after, limit=limit,
+                          count=count, db_path=db_path)
+
+
+async def get_file_info(file_name: str, db_path: str = "database/db.db") -> Optional[dict]:
+    return await run_read(manager.get_file_info, file_name, db_path)
+
+
+async def tag_stats(prefix: Optional[str] = None, limit: int = 50,
+                    db_path: str = "database/db.db") -> List[tuple]:
+    return await run_read(manager.tag_stats, prefix, limit, db_path)
+
+
+async def cooccurring_tags(expression=None, query_tags=None, limit: int = 10,
+                           db_path: str = "database/db.db") -> List[tuple]:
+    return await run_read(manager.cooccurring_tags, expression, query_tags, limit, db_path)
+
+
+async def iter_file_blocks(expression=None, query_tags=None, block: int = manager.MAX_PAGE_LIMIT,
+                           db_path: str = "database/db.db") -> AsyncIterator[List[tuple]]:
+    """Como manager.iter_files, pero entrega listas de hasta block filas leídas en el pool de lectura."""
+    rows = manager.iter_files(expression, query_tags, batch_size=block, db_path=db_path)
+
+    def next_block():
+        out = []
+        for row in rows:
+            out.append(row)
+            if len(out) >= block:
+                break
+        return out
+
+    while True:
+        chunk = await run_read(next_block)
+        if not chunk:
+            return
+        yield chunk
+
+
+# --- Escrituras (hilo escritor único) ---
+
+async def add_upload(file_name: str, writer: storage.BlobWriter, tag_list: List[str],
+                     db_path: str = "database/db.db") -> bool:
+    return await run_write(manager.add_upload, file_name, writer, tag_list, db_path)
+
+
+async def add_uploads(uploads: List[tuple], tag_list: List[str], db_path: str = "database/db.db") -> dict:
+    return await run_write(manager.add_uploads, uploads, tag_list, db_path)
+
+
+async def add_directory(directory: str, tag_list: List[str], db_path: str = "database/db.db",
+                        batch_size: int = 1000) -> dict:
+    return await run_write(manager.add_directory, directory, tag_list, db_path, batch_size)
+
+
+async def delete_files(query_tags: List[str], db_path: str = "database/db.db") -> bool:
+    return await run_write(manager.delete_files, query_tags, db_path)
+
+
+async def add_tags(query_tags: List[str], new_tags: List[str], db_path: str = "database/db.db") -> bool:
+    return await run_write(manager.add_tags, query_tags, new_tags, db_path)
+
+
+async def delete_tags(query_tags: List[str], del_tags: List[str], db_path: str = "database/db.db") -> bool:
+    return await run_write(manager.delete_tags, query_tags, del_tags, db_path)
+
+
+async def check_file_tags(repair: bool = False, db_path: str = "database/db.db") -> List[int]:
+    # Con repair reescribe files.tags: va al hilo escritor
+    if repair:
+        return await run_write(database.check_file_tags, db_path, repair=True)
+    return await run_read(database.check_file_tags, db_path)
+
+
+# --- Ficheros ---
+
+async def open_blob_writer(storage_dir: Optional[str] = None) -> storage.BlobWriter:
+    return await run_io(storage.BlobWriter, os.path.abspath(storage_dir or manager.STORAGE_DIR))
+
+
+async def write_chunks(writer: storage.BlobWriter, chunks) -> None:
+    """
+    Vuelca al writer los trozos de un iterador asíncrono. Cada escritura (y su
+    hash) va al pool de E/S; si algo falla se descarta lo escrito.
+    """
+    try:
+        async for chunk in chunks:
+            await run_io(writer.write, chunk)
+    except BaseException:
+        await run_io(writer.abort)
+        raise
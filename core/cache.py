@@ -0,0 +1,179 @@
+# core/cache.py
+"""
+Caché de resultados de consultas por etiquetas con invalidación por escritura.
+
+Cada base de datos tiene un contador de versión por etiqueta y uno global ("*").
+Una entrada guarda las versiones de las etiquetas de su consulta en el momento
+de calcularla y deja de valer en cuanto alguna cambia:
+
+- Al cambiar las etiquetas de un fichero (alta, baja, add_tags, delete_tags) se
+  incrementan las versiones de todas sus etiquetas, las de antes y las de
+  después: así caducan tanto las consultas que ganan o pierden el fichero como
+  las que lo devolvían con otra lista de etiquetas.
+- "*" se incrementa en cada escritura. Sólo dependen de él las consultas no
+  "ancladas" (listado completo, NOT a secas, "a OR NOT b"), que pueden devolver
+  ficheros sin ninguna de sus etiquetas.
+
+Expulsión LRU acotada por número de entradas y por filas totales.
+TBFS_QUERY_CACHE=0 la desactiva; TBFS_QUERY_CACHE_ENTRIES y TBFS_QUERY_CACHE_ROWS
+fijan los límites.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from core.database import file_identity
+from core.query import tags_in
+
+ALL = "*"
+
+ENABLED = os.getenv("TBFS_QUERY_CACHE", "1") != "0"
+MAX_ENTRIES = int(os.getenv("TBFS_QUERY_CACHE_ENTRIES", "1024"))
+MAX_ROWS = int(os.getenv("TBFS_QUERY_CACHE_ROWS", "2000000"))
+
+
+def normalize(node):
+    """Forma canónica (y hashable) de un árbol de consulta: AND/OR sin orden ni repetidos."""
+    if node is None:
+        return None
+    kind = node[0]
+    if kind == "tag":
+        return node
+    if kind == "not":
+        return ("not", normalize(node[1]))
+    return (kind, tuple(sorted(set(normalize(child) for child in node[1]), key=repr)))
+
+
+def anchored(node) -> bool:
+    """True si todo resultado tiene al menos una de las etiquetas de la consulta."""
+    if node is None:
+        return False
+    kind = node[0]
+    if kind == "tag":
+        return True
+    if kind == "not":
+        return False
+    if kind == "and":
+        return any(anchored(child) for child in node[1])
+    return all(anchored(child) for child in node[1])
+
+
+class QueryCache:
+    """Caché LRU de resultados con versiones por etiqueta (ver el docstring del módulo)."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_rows: int = MAX_ROWS):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.enabled = ENABLED
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # clave -> (resultado, dependencias, filas)
+        self._versions = {}             # (db, identidad) -> {etiqueta: versión}
+        self._rows = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _db(self, db_path):
+        key = os.path.abspath(db_path)
+        return key, file_identity(key)
+
+    def get_or_compute(self, db_path: str, kind: str, node, compute: Callable[[], list]) -> list:
+        """
+        Devuelve el resultado de la consulta (node ya normalizado) desde la caché o
+        llamando a compute(). kind separa tipos de resultado (filas, ids) de la misma consulta.
+        """
+        if not self.enabled:
+            return compute()
+        db = self._db(db_path)
+        key = (db, kind, node)
+        deps_tags = sorted(tags_in(node))
+        if not anchored(node):
+            deps_tags.append(ALL)
+        with self._lock:
+            versions = self._versions.setdefault(db, {})
+            entry = self._entries.get(key)
+            if entry is not None:
+                if all(versions.get(tag, 0) == v for tag, v in entry[1]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(entry[0])
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+            # Versiones antes de calcular: una escritura concurrente deja la entrada caducada
+            deps = tuple((tag, versions.get(tag, 0)) for tag in deps_tags)
+
+        result = compute()
+        rows = len(result)
+        if rows <= self.max_rows:
+            with self._lock:
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = (tuple(result), deps, rows)
+                self._rows += rows
+                while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return result
+
+    def _drop(self, key):
+        _, _, rows = self._entries.pop(key)
+        self._rows -= rows
+
+    def invalidate(self, db_path: str, tags: Iterable[str]) -> None:
+        """Marca como modificadas las etiquetas indicadas (y "*") de una base de datos."""
+        db = self._db(db_path)
+        with self._lock:
+            versions = self._versions.setdefault(db, {})
+            for tag in set(tags) | {ALL}:
+                versions[tag] = versions.get(tag, 0) + 1
+
+    def clear(self) -> None:
+        """Vacía las entradas; las versiones se conservan para no resucitar cálculos en curso."""
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache = QueryCache()
+
+
+def get_cache() -> QueryCache:
+    return _cache
+
+
+def cached(db_path: str, kind: str, node, compute: Callable[[], list]) -> list:
+    return _cache.get_or_compute(db_path, kind, normalize(node), compute)
+
+
+def invalidate(db_path: str, tags: Iterable[str]) -> None:
+    _cache.invalidate(db_path, tags)
+
+
+def clear() -> None:
+    _cache.clear()
+
+
+def stats() -> dict:
+    return _cache.stats()
+
+
+def set_enabled(enabled: bool, max_entries: Optional[int] = None, max_rows: Optional[int] = None) -> None:
+    """Activa o desactiva la caché (y ajusta sus límites); siempre la vacía."""
+    _cache.enabled = enabled
+    if max_entries is not None:
+        _cache.max_entries = max_entries
+    if max_rows is not None:
+        _cache.max_rows = max_rows
+    _cache.clear()
@@ -1,26 +1,189 @@
 import sqlite3
 import os
 import shutil
+import threading
+import time
+import weakref
+from typing import List
+
+from core import metrics
+from core import packs
 
 # Ruta por defecto de la base de datos
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "db.db")
 
-def get_connection(db_path="database/db.db"):
+# Configuración del pool de conexiones. Los PRAGMAs se aplican una única vez,
+# al abrir cada conexión, y la conexión se reutiliza durante toda la vida del hilo.
+_POOL_CONFIG = {
+    "enabled": True,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negativo = KiB (64 MiB)
+    "busy_timeout": 5000,
+}
+
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool_connections = []
+_pool_generation = 0
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor que registra la duración de execute/executemany en metrics.SQL_SECONDS."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.SQL_SECONDS.observe(time.perf_counter() - start, metrics.statement_label(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.SQL_SECONDS.observe(time.perf_counter() - start, metrics.statement_label(sql))
+
+
+class TimedConnection(sqlite3.Connection):
+    """Conexión cuyos cursores son TimedCursor si las métricas están activas."""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or (TimedCursor if metrics.ENABLED else sqlite3.Cursor))
+
+
+class PooledConnection(TimedConnection):
+    """
+    Conexión SQLite que sabe a qué entrada del pool pertenece.
+    `depth` cuenta los préstamos anidados dentro del mismo hilo y `owner` es
+    una referencia débil al hilo que la usa.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pooled = False
+        self.depth = 0
+        self.file_id = None
+        self.generation = 0
+        self.owner = None
+
+    def owner_alive(self) -> bool:
+        thread = self.owner() if self.owner is not None else None
+        return thread is not None and thread.is_alive()
+
+
+def configure_pool(enabled: bool = True, journal_mode: str = "WAL", synchronous: str = "NORMAL",
+                   mmap_size: int = 256 * 1024 * 1024, cache_size: int = -64 * 1024,
+                   busy_timeout: int = 5000) -> None:
     """
-    Abre una conexión a la base de datos y devuelve (conn, cursor).
+    Configura el pool de conexiones. Debe llamarse al arrancar (antes de init_db).
+    Cierra las conexiones abiertas para que la nueva configuración se aplique.
+    - enabled=False vuelve al comportamiento de abrir/cerrar una conexión por llamada.
+    """
+    close_pool()
+    _POOL_CONFIG.update(
+        enabled=enabled,
+        journal_mode=journal_mode,
+        synchronous=synchronous,
+        mmap_size=mmap_size,
+        cache_size=cache_size,
+        busy_timeout=busy_timeout,
+    )
+
+
+def file_identity(db_path):
+    """Identifica el fichero de la base de datos (dispositivo, inodo) o None si no existe."""
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def _open_connection(db_path, pooled=True):
+    """
+    Abre una conexión nueva. Las conexiones del pool reciben los PRAGMAs configurados.
     """
     # asegurarse de que existe la carpeta de la base de datos.
-    os.makedirs(os.path.dirname(db_path), exist_ok= True)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    return conn, cursor
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    metrics.DB_CONNECTIONS_OPENED.inc()
+    if not pooled:
+        return sqlite3.connect(db_path, factory=TimedConnection)
+    conn = sqlite3.connect(db_path, factory=PooledConnection, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {int(_POOL_CONFIG['busy_timeout'])}")
+    conn.execute(f"PRAGMA journal_mode = {_POOL_CONFIG['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {_POOL_CONFIG['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(_POOL_CONFIG['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(_POOL_CONFIG['cache_size'])}")
+    return conn
 
-def init_db(db_path="database/db.db"):
+
+def _discard(conn):
+    with _pool_lock:
+        if conn in _pool_connections:
+            _pool_connections.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def get_connection(db_path="database/db.db"):
     """
-    Inicializa la base de datos creando las tablas necesarias si no existen.
+    Devuelve (conn, cursor) para la base de datos indicada.
+    Con el pool activo la conexión es la del hilo actual y se reutiliza entre
+    llamadas; se devuelve al pool con close_connection.
     """
-    conn, cursor = get_connection(db_path)
+    if not _POOL_CONFIG["enabled"]:
+        conn = _open_connection(db_path, pooled=False)
+        return conn, conn.cursor()
+
+    key = os.path.abspath(db_path)
+    slots = getattr(_local, "slots", None)
+    if slots is None:
+        slots = _local.slots = {}
 
+    conn = slots.get(key)
+    if conn is not None and conn.depth == 0:
+        # Si el fichero fue borrado o reemplazado (p. ej. en pruebas), o el pool
+        # se reconfiguró, la conexión ya no es válida.
+        if conn.generation != _pool_generation or conn.file_id != file_identity(key):
+            _discard(conn)
+            conn = None
+
+    if conn is None:
+        conn = _open_connection(key)
+        conn.pooled = True
+        conn.file_id = file_identity(key)
+        conn.owner = weakref.ref(threading.current_thread())
+        with _pool_lock:
+            conn.generation = _pool_generation
+            # Las conexiones de hilos que ya terminaron no las usará nadie más
+            # (p. ej. hilos creados por petición): se cierran al entrar otra
+            orphans = [c for c in _pool_connections if not c.owner_alive()]
+            _pool_connections[:] = [c for c in _pool_connections if c.owner_alive()]
+            _pool_connections.append(conn)
+        slots[key] = conn
+        for orphan in orphans:
+            try:
+                orphan.close()
+            except sqlite3.Error:
+                pass
+
+    conn.depth += 1
+    return conn, conn.cursor()
+
+# --- Migraciones ---
+#
+# Cada cambio de esquema es un paso numerado de MIGRATIONS. La tabla
+# schema_version guarda los aplicados; init_db (al arrancar) aplica los que
+# falten, en orden y cada uno en su transacción. Los primeros pasos usan
+# IF NOT EXISTS para que las bases de datos anteriores a las migraciones
+# (que ya tienen esas tablas) se adopten sin cambios.
+
+def _m001_base(cursor):
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS files (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,7 +191,7 @@ def init_db(db_path="database/db.db"):
         path TEXT NOT NULL
     )
     """)
-    
+
     # Tabla de etiquetas (únicas)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS tags (
@@ -36,7 +199,7 @@ def init_db(db_path="database/db.db"):
             tag TEXT UNIQUE
         )
     """)
-    
+
     # Tabla intermedia archivo-etiqueta
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS file_tags (
@@ -47,15 +210,395 @@ def init_db(db_path="database/db.db"):
             FOREIGN KEY(tag_id) REFERENCES tags(id) ON DELETE CASCADE
         )
     """)
-    conn.commit()
-    conn.close()
+
+
+def _create_tag_count_triggers(cursor):
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_count_insert AFTER INSERT ON file_tags
+        BEGIN
+            INSERT INTO tag_counts (tag_id, count) VALUES (NEW.tag_id, 1)
+            ON CONFLICT(tag_id) DO UPDATE SET count = count + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_count_delete AFTER DELETE ON file_tags
+        BEGIN
+            UPDATE tag_counts SET count = count - 1 WHERE tag_id = OLD.tag_id;
+        END
+    """)
+
+
+def _m002_file_tags_by_tag(cursor):
+    # Índice (tag_id, file_id): las consultas por etiqueta lo recorren sin tocar
+    # la tabla (índice cubriente); sin él, cada etiqueta es un recorrido completo.
+    cursor.execute("CREATE INDEX IF NOT EXISTS file_tags_by_tag ON file_tags (tag_id, file_id)")
+
+
+def _m003_tag_counts(cursor):
+    # Número de ficheros por etiqueta (lo usa el planificador de consultas).
+    # Se mantiene con triggers, así que cualquier escritura sobre file_tags lo actualiza.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_counts'")
+    backfill = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            tag_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    _create_tag_count_triggers(cursor)
+    if backfill:
+        cursor.execute("""
+            INSERT OR REPLACE INTO tag_counts (tag_id, count)
+            SELECT tag_id, COUNT(*) FROM file_tags GROUP BY tag_id
+        """)
+
+
+def _m004_file_tags_without_rowid(cursor):
+    # file_tags sólo son dos enteros con clave primaria compuesta: como WITHOUT
+    # ROWID la tabla es el propio árbol de la clave (sin rowid ni índice aparte).
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'file_tags'")
+    if "WITHOUT ROWID" in cursor.fetchone()[0].upper():
+        return
+    cursor.execute("""
+        CREATE TABLE file_tags_new (
+            file_id INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL,
+            PRIMARY KEY(file_id, tag_id),
+            FOREIGN KEY(file_id) REFERENCES files(id) ON DELETE CASCADE,
+            FOREIGN KEY(tag_id) REFERENCES tags(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("INSERT INTO file_tags_new (file_id, tag_id) SELECT file_id, tag_id FROM file_tags")
+    # Al borrar la tabla se borran también su índice y sus triggers
+    cursor.execute("DROP TABLE file_tags")
+    cursor.execute("ALTER TABLE file_tags_new RENAME TO file_tags")
+    _m002_file_tags_by_tag(cursor)
+    _create_tag_count_triggers(cursor)
+
+
+def _m005_blobs(cursor):
+    # Contenido almacenado por hash, con cuenta de referencias desde files.blob
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("PRAGMA table_info(files)")
+    if "blob" not in {row[1] for row in cursor.fetchall()}:
+        # NULL en ficheros antiguos, guardados como storage/{id}_{name}
+        cursor.execute("ALTER TABLE files ADD COLUMN blob TEXT REFERENCES blobs(hash)")
+
+
+def _m006_files_tags(cursor):
+    # Lista de etiquetas de cada fichero ya concatenada ("a,b,c"; NULL si no tiene),
+    # para listar sin GROUP_CONCAT sobre file_tags + tags. La mantienen triggers
+    # sobre file_tags, en la misma transacción que el cambio de etiquetas.
+    cursor.execute("PRAGMA table_info(files)")
+    if "tags" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE files ADD COLUMN tags TEXT")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_names_insert AFTER INSERT ON file_tags
+        BEGIN
+            UPDATE files SET tags = CASE WHEN tags IS NULL OR tags = '' THEN t.tag ELSE tags || ',' || t.tag END
+            FROM (SELECT tag FROM tags WHERE id = NEW.tag_id) AS t
+            WHERE files.id = NEW.file_id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_names_delete AFTER DELETE ON file_tags
+        BEGIN
+            UPDATE files SET tags = (
+                SELECT GROUP_CONCAT(t.tag) FROM file_tags ft JOIN tags t ON t.id = ft.tag_id
+                WHERE ft.file_id = OLD.file_id
+            )
+            WHERE id = OLD.file_id;
+        END
+    """)
+    rebuild_file_tags(cursor)
+
+
+def rebuild_file_tags(cursor) -> None:
+    """Recalcula files.tags de todos los ficheros a partir de file_tags."""
+    cursor.execute("""
+        UPDATE files SET tags = (
+            SELECT GROUP_CONCAT(t.tag) FROM file_tags ft JOIN tags t ON t.id = ft.tag_id
+            WHERE ft.file_id = files.id
+        )
+    """)
+
+
+def check_file_tags(db_path="database/db.db", repair: bool = False) -> List[int]:
+    """
+    Comprueba que files.tags coincide (como conjunto) con file_tags para cada fichero.
+    Devuelve los ids que no coinciden; con repair=True además reconstruye la columna.
+    """
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("""
+            SELECT f.id, f.tags, GROUP_CONCAT(t.tag, char(31))
+            FROM files f
+            LEFT JOIN file_tags ft ON ft.file_id = f.id
+            LEFT JOIN tags t ON t.id = ft.tag_id
+            GROUP BY f.id
+        """)
+        mismatched = [
+            file_id for file_id, stored, actual in cursor
+            if sorted(stored.split(",") if stored else []) != sorted(actual.split("\x1f") if actual else [])
+        ]
+        if repair and mismatched:
+            rebuild_file_tags(cursor)
+            conn.commit()
+    finally:
+        close_connection(conn)
+    return mismatched
+
+
+def _m007_tag_pairs(cursor):
+    # Co-ocurrencias: cuántos ficheros tienen a la vez tag_a y tag_b. Cada par se
+    # guarda en los dos sentidos para leer los vecinos de una etiqueta por rango
+    # de clave. Igual que tag_counts, lo mantienen triggers sobre file_tags.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_pairs'")
+    backfill = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tag_pairs (
+            tag_a INTEGER NOT NULL,
+            tag_b INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(tag_a, tag_b)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_pairs_insert AFTER INSERT ON file_tags
+        BEGIN
+            INSERT INTO tag_pairs (tag_a, tag_b, count)
+            SELECT NEW.tag_id, tag_id, 1 FROM file_tags WHERE file_id = NEW.file_id AND tag_id <> NEW.tag_id
+            ON CONFLICT(tag_a, tag_b) DO UPDATE SET count = count + 1;
+            INSERT INTO tag_pairs (tag_a, tag_b, count)
+            SELECT tag_id, NEW.tag_id, 1 FROM file_tags WHERE file_id = NEW.file_id AND tag_id <> NEW.tag_id
+            ON CONFLICT(tag_a, tag_b) DO UPDATE SET count = count + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_pairs_delete AFTER DELETE ON file_tags
+        BEGIN
+            UPDATE tag_pairs SET count = count - 1
+            WHERE tag_a = OLD.tag_id AND tag_b IN (SELECT tag_id FROM file_tags WHERE file_id = OLD.file_id);
+            UPDATE tag_pairs SET count = count - 1
+            WHERE tag_b = OLD.tag_id AND tag_a IN (SELECT tag_id FROM file_tags WHERE file_id = OLD.file_id);
+        END
+    """)
+    if backfill:
+        cursor.execute("""
+            INSERT INTO tag_pairs (tag_a, tag_b, count)
+            SELECT a.tag_id, b.tag_id, COUNT(*)
+            FROM file_tags a JOIN file_tags b ON b.file_id = a.file_id AND b.tag_id <> a.tag_id
+            GROUP BY a.tag_id, b.tag_id
+        """)
+
+
+def _m008_changelog(cursor):
+    # Registro de cambios para la replicación (core/replication.py). Las filas
+    # las escriben triggers que sólo existen en el líder (enable_changelog).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            op TEXT NOT NULL,
+            data TEXT NOT NULL
+        )
+    """)
+    # Estado de un seguidor: último seq del líder aplicado
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS replication_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+
+
+def _m009_blob_codec(cursor):
+    # Codec con el que está guardado cada blob (core/storage.py). No se replica:
+    # cada nodo decide cómo guarda sus blobs.
+    cursor.execute("PRAGMA table_info(blobs)")
+    if "codec" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE blobs ADD COLUMN codec TEXT NOT NULL DEFAULT 'identity'")
+
+
+def _m010_blob_packs(cursor):
+    # Blobs guardados dentro de un pack (core/packs.py): path es el pack,
+    # pack_offset la posición y pack_length los bytes guardados; NULL si el
+    # blob tiene fichero propio. No se replica (los seguidores no usan packs).
+    cursor.execute("PRAGMA table_info(blobs)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if "pack_offset" not in columns:
+        cursor.execute("ALTER TABLE blobs ADD COLUMN pack_offset INTEGER")
+    if "pack_length" not in columns:
+        cursor.execute("ALTER TABLE blobs ADD COLUMN pack_length INTEGER")
+    # Contenido de cada pack, en orden, para compact_packs
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS blobs_by_pack ON blobs (path, pack_offset)
+        WHERE pack_offset IS NOT NULL
+    """)
+
+
+# Columnas registradas de cada tabla replicada. files.tags, tag_counts y
+# tag_pairs no se registran: los recalculan los triggers de cada réplica.
+CHANGELOG_TABLES = {
+    "files": ("id", "name", "path", "blob"),
+    "tags": ("id", "tag"),
+    "file_tags": ("file_id", "tag_id"),
+    "blobs": ("hash", "path", "size", "refcount"),
+}
+
+
+def enable_changelog(db_path="database/db.db") -> None:
+    """Crea los triggers que registran en changelog los cambios de las tablas replicadas."""
+    conn, cursor = get_connection(db_path)
+    try:
+        for table, columns in CHANGELOG_TABLES.items():
+            for op, ref in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+                if table in ("tags", "file_tags") and op == "update":
+                    continue
+                data = ", ".join(f"'{c}', {ref}.{c}" for c in columns)
+                # UPDATE OF: los cambios en files.tags (derivados) no se registran
+                event = f"UPDATE OF {', '.join(columns)}" if op == "update" else op.upper()
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS changelog_{table}_{op} AFTER {event} ON {table}
+                    BEGIN
+                        INSERT INTO changelog (tbl, op, data) VALUES ('{table}', '{op}', json_object({data}));
+                    END
+                """)
+        conn.commit()
+    finally:
+        close_connection(conn)
+
+
+def disable_changelog(db_path="database/db.db") -> None:
+    """Elimina los triggers de enable_changelog (el registro existente se conserva)."""
+    conn, cursor = get_connection(db_path)
+    try:
+        for table in CHANGELOG_TABLES:
+            for op in ("insert", "update", "delete"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS changelog_{table}_{op}")
+        conn.commit()
+    finally:
+        close_connection(conn)
+
+
+# (versión, nombre, función). Añadir siempre al final; nunca renumerar.
+MIGRATIONS = [
+    (1, "base", _m001_base),
+    (2, "file_tags_by_tag", _m002_file_tags_by_tag),
+    (3, "tag_counts", _m003_tag_counts),
+    (4, "file_tags_without_rowid", _m004_file_tags_without_rowid),
+    (5, "blobs", _m005_blobs),
+    (6, "files_tags", _m006_files_tags),
+    (7, "tag_pairs", _m007_tag_pairs),
+    (8, "changelog", _m008_changelog),
+    (9, "blob_codec", _m009_blob_codec),
+    (10, "blob_packs", _m010_blob_packs),
+]
+
+
+def schema_version(db_path="database/db.db") -> int:
+    """Última migración aplicada (0 si la base de datos no tiene schema_version)."""
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        if cursor.fetchone() is None:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    finally:
+        close_connection(conn)
+
+
+def migrate(db_path="database/db.db", target=None):
+    """
+    Aplica en orden las migraciones pendientes (hasta target, si se indica).
+    Cada una corre en su propia transacción junto con su fila de schema_version,
+    así que un fallo deja la base de datos en la última versión completa.
+    Devuelve la lista de versiones aplicadas.
+    """
+    conn, cursor = get_connection(db_path)
+    applied = []
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+        for version, name, step in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            # BEGIN IMMEDIATE: si otro proceso migra a la vez, uno espera al otro
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+                if cursor.fetchone() is None:
+                    step(cursor)
+                    cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+                    applied.append(version)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+    finally:
+        close_connection(conn)
+    for version in applied:
+        print(f"[INFO] Migración {version} aplicada: {dict((v, n) for v, n, _ in MIGRATIONS)[version]}")
+    return applied
+
+
+def init_db(db_path="database/db.db"):
+    """
+    Inicializa la base de datos: crea las tablas necesarias si no existen y
+    aplica las migraciones pendientes.
+    """
+    migrate(db_path)
 
 def close_connection(conn):
     """
-    Cierra la conexión con la base de datos.
+    Devuelve la conexión al pool (o la cierra si no pertenece a él).
+    Al liberar el último préstamo se descarta cualquier transacción sin confirmar.
     """
-    if conn:
-        conn.close()
+    if not conn:
+        return
+    if getattr(conn, "pooled", False):
+        conn.depth = max(conn.depth - 1, 0)
+        if conn.depth == 0 and conn.in_transaction:
+            conn.rollback()
+        return
+    conn.close()
+
+def close_pool() -> None:
+    """
+    Cierra todas las conexiones del pool. Las siguientes llamadas a
+    get_connection abrirán conexiones nuevas.
+    """
+    global _pool_generation
+    with _pool_lock:
+        connections = list(_pool_connections)
+        _pool_connections.clear()
+        _pool_generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+def pool_size() -> int:
+    """Número de conexiones abiertas actualmente en el pool."""
+    with _pool_lock:
+        return len(_pool_connections)
+
+metrics.Gauge("tbfs_db_pool_connections", "Conexiones abiertas en el pool", pool_size)
 
 def reset_db() -> None:
     """
@@ -66,11 +609,17 @@ def reset_db() -> None:
     conn, cursor = get_connection()
 
     # Eliminar tablas existentes
+    cursor.execute("DROP TABLE IF EXISTS changelog")
+    cursor.execute("DROP TABLE IF EXISTS replication_state")
+    cursor.execute("DROP TABLE IF EXISTS tag_pairs")
+    cursor.execute("DROP TABLE IF EXISTS tag_counts")
     cursor.execute("DROP TABLE IF EXISTS file_tags")
     cursor.execute("DROP TABLE IF EXISTS tags")
     cursor.execute("DROP TABLE IF EXISTS files")
+    cursor.execute("DROP TABLE IF EXISTS blobs")
+    cursor.execute("DROP TABLE IF EXISTS schema_version")
     conn.commit()
-    conn.close()
+    close_connection(conn)
 
     # Eliminar todos los archivos del almacenamiento
     storage_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "storage"))
@@ -84,6 +633,7 @@ def reset_db() -> None:
                     shutil.rmtree(file_path)
             except Exception as e:
                 print(f"[WARNING] No se pudo eliminar '{file_path}': {e}")
+    packs.close()
 
     # Recrear las tablas vacías
     init_db()
@@ -0,0 +1,295 @@
+# core/index.py
+"""
+Índice invertido en memoria: etiqueta -> array ordenado de ids de fichero.
+
+Se construye a partir de las tablas tags/file_tags la primera vez que se usa y
+core.manager lo mantiene sincronizado tras cada escritura confirmada. Las
+consultas AND intersectan las listas empezando por la más pequeña.
+
+Con el registro de cambios activo (core/wal.py) un índice guarda el seq hasta
+el que está al día y catch_up lo actualiza leyendo sólo lo posterior: lo hacen
+get_index y apply_write cuando al índice le faltan registros confirmados.
+"""
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core import wal
+from core.database import get_connection, close_connection, file_identity
+
+# Índices cargados, por ruta absoluta de la base de datos
+_indexes: Dict[str, "TagIndex"] = {}
+_indexes_lock = threading.Lock()
+
+# add_many/remove_many editan la lista en su sitio si los ids son menos de 1/SMALL_BATCH de ella
+SMALL_BATCH = 64
+
+
+class TagIndex:
+    """
+    Listas de ids (array('q') ordenado) por etiqueta.
+    Los ids nuevos son crecientes (AUTOINCREMENT), así que añadir suele ser un append.
+    """
+
+    def __init__(self, file_id=None):
+        self.postings: Dict[str, array] = {}
+        self.file_id = file_id
+        self.seq = 0  # último registro de core/wal.py incluido
+        self.lock = threading.RLock()
+
+    def load(self, cursor) -> None:
+        # Etiquetas y wal_seq de la misma instantánea de lectura
+        own_transaction = not cursor.connection.in_transaction
+        if own_transaction:
+            cursor.execute("BEGIN")
+        try:
+            cursor.execute("SELECT value FROM replication_state WHERE key = 'wal_seq'")
+            row = cursor.fetchone()
+            seq = row[0] if row else 0
+            cursor.execute("""
+                SELECT t.tag, ft.file_id
+                FROM file_tags ft
+                JOIN tags t ON ft.tag_id = t.id
+                ORDER BY t.tag, ft.file_id
+            """)
+            postings = {}
+            current_tag, current = None, None
+            for tag, fid in cursor:
+                if tag != current_tag:
+                    current_tag = tag
+                    current = postings[tag] = array("q")
+                current.append(fid)
+        finally:
+            if own_transaction:
+                cursor.execute("COMMIT")
+        with self.lock:
+            self.postings = postings
+            self.seq = seq
+
+    def apply(self, change: "wal.Change") -> None:
+        """Aplica un registro del registro de cambios."""
+        with self.lock:
+            if change.op == wal.ADD_FILE:
+                self.add(change.data[0], change.data[2])
+            elif change.op == wal.DELETE_FILE:
+                self.remove(change.data[0], change.data[2])
+            elif change.op == wal.ADD_TAGS:
+                self.add_many(*change.data)
+            elif change.op == wal.DELETE_TAGS:
+                self.remove_many(*change.data)
+            self.seq = change.seq
+
+    def catch_up(self, log: "wal.ChangeLog") -> int:
+        """
+        Aplica los registros posteriores a self.seq. Devuelve cuántos aplicó.
+        Lanza wal.OffsetUnavailable si ya no están (hay que volver a cargar).
+        """
+        applied = 0
+        for change in log.read(self.seq):
+            self.apply(change)
+            applied += 1
+        return applied
+
+    def add(self, file_id: int, tags: Iterable[str]) -> None:
+        with self.lock:
+            for tag in tags:
+                posting = self.postings.get(tag)
+                if posting is None:
+                    self.postings[tag] = array("q", [file_id])
+                elif not posting or posting[-1] < file_id:
+                    posting.append(file_id)
+                else:
+                    i = bisect_left(posting, file_id)
+                    if i == len(posting) or posting[i] != file_id:
+                        posting.insert(i, file_id)
+
+    def remove(self, file_id: int, tags: Iterable[str]) -> None:
+        with self.lock:
+            for tag in tags:
+                posting = self.postings.get(tag)
+                if not posting:
+                    continue
+                i = bisect_left(posting, file_id)
+                if i < len(posting) and posting[i] == file_id:
+                    del posting[i]
+                if not posting:
+                    del self.postings[tag]
+
+    def add_many(self, tag: str, file_ids: Iterable[int]) -> None:
+        """
+        Añade muchos ids a una etiqueta de una vez: pocos ids sobre una lista
+        grande se insertan en su sitio; si no, se fusiona.
+        """
+        with self.lock:
+            posting = self.postings.get(tag)
+            file_ids = sorted(set(file_ids))
+            if posting and len(file_ids) * SMALL_BATCH < len(posting):
+                for fid in file_ids:
+                    i = bisect_left(posting, fid)
+                    if i == len(posting) or posting[i] != fid:
+                        posting.insert(i, fid)
+                return
+            merged = set(posting or ())
+            merged.update(file_ids)
+            if merged:
+                self.postings[tag] = array("q", sorted(merged))
+
+    def remove_many(self, tag: str, file_ids: Iterable[int]) -> None:
+        with self.lock:
+            posting = self.postings.get(tag)
+            if not posting:
+                return
+            drop = set(file_ids)
+            if len(drop) * SMALL_BATCH < len(posting):
+                for fid in sorted(drop, reverse=True):
+                    i = bisect_left(posting, fid)
+                    if i < len(posting) and posting[i] == fid:
+                        del posting[i]
+                return
+            kept = array("q", (fid for fid in posting if fid not in drop))
+            if kept:
+                self.postings[tag] = kept
+            else:
+                del self.postings[tag]
+
+    def cardinality(self, tag: str) -> int:
+        posting = self.postings.get(tag)
+        return len(posting) if posting else 0
+
+    def posting_set(self, tag: str, candidates: Optional[Set[int]] = None) -> Set[int]:
+        """Ids con la etiqueta, restringidos a candidates si se indica."""
+        with self.lock:
+            posting = self.postings.get(tag)
+            if not posting:
+                return set()
+            if candidates is None:
+                return set(posting)
+            return set(_intersect(sorted(candidates), posting))
+
+    def match_all(self, tags: List[str]) -> List[int]:
+        """
+        Ids (ordenados) de los ficheros que tienen TODAS las etiquetas.
+        Intersecta de la lista más pequeña a la más grande y corta en cuanto queda vacía.
+        """
+        with self.lock:
+            postings = []
+            for tag in set(tags):
+                posting = self.postings.get(tag)
+                if not posting:
+                    return []
+                postings.append(posting)
+            postings.sort(key=len)
+
+            result = postings[0].tolist()
+            for posting in postings[1:]:
+                if not result:
+                    break
+                result = _intersect(result, posting)
+            return result
+
+
+def _intersect(candidates: List[int], posting: array) -> List[int]:
+    """
+    Intersección de una lista ordenada pequeña con una lista ordenada mayor.
+    Con pocos candidatos se busca cada uno por bisección; si no, se usa un set.
+    """
+    n, m = len(candidates), len(posting)
+    if n * max(m.bit_length(), 1) < m:
+        out = []
+        lo = 0
+        for fid in candidates:
+            lo = bisect_left(posting, fid, lo)
+            if lo == m:
+                break
+            if posting[lo] == fid:
+                out.append(fid)
+        return out
+    return sorted(set(candidates).intersection(posting))
+
+
+def _load(idx: TagIndex, db_path: str) -> None:
+    conn, cursor = get_connection(db_path)
+    try:
+        idx.load(cursor)
+    finally:
+        close_connection(conn)
+
+
+def _refresh(idx: TagIndex, db_path: str, log: "wal.ChangeLog") -> None:
+    """
+    Pone el índice al día con el registro. Si lo que le falta ya está compactado,
+    se vuelve a cargar: repetir el tramo compactado sobre un índice con datos
+    no quitaría lo que ya no está.
+    """
+    with idx.lock:
+        if idx.seq >= log.committed:
+            return
+        if idx.seq < log.base:
+            _load(idx, db_path)
+            return
+        try:
+            idx.catch_up(log)
+        except wal.OffsetUnavailable:
+            _load(idx, db_path)
+
+
+def get_index(db_path: str = "database/db.db") -> TagIndex:
+    """
+    Devuelve el índice de la base de datos, construyéndolo si hace falta.
+    Si el fichero de la base de datos fue reemplazado, el índice se reconstruye.
+    Con el registro de cambios activo, se pone al día con lo que le falte.
+    """
+    key = os.path.abspath(db_path)
+    identity = file_identity(key)
+    with _indexes_lock:
+        idx = _indexes.get(key)
+        if idx is None or idx.file_id != identity:
+            idx = TagIndex(identity)
+            _load(idx, db_path)
+            _indexes[key] = idx
+            return idx
+    log = wal.get_log(db_path)
+    if log is not None and idx.seq < log.committed:
+        _refresh(idx, db_path, log)
+    return idx
+
+
+def apply_write(db_path: str, seqs: Optional[Tuple[int, int]], update: Callable[[TagIndex], None]) -> None:
+    """
+    Mantiene el índice cargado (si lo hay) tras una escritura confirmada.
+    seqs es lo que devolvió wal.commit: sin registro (None) se aplica update(idx);
+    con registro, se aplica y avanza seq sólo si el índice estaba justo antes del
+    lote; si le faltan registros anteriores se pone al día desde el registro, y
+    si ya lo incluye no se hace nada.
+    """
+    idx = loaded_index(db_path)
+    if idx is None:
+        return
+    with idx.lock:
+        if seqs is None:
+            update(idx)
+            return
+        first, last = seqs
+        if idx.seq == first - 1:
+            update(idx)
+            idx.seq = last
+        elif idx.seq < first - 1:
+            log = wal.get_log(db_path)
+            if log is not None:
+                _refresh(idx, db_path, log)
+
+
+def loaded_index(db_path: str = "database/db.db") -> Optional[TagIndex]:
+    """Devuelve el índice sólo si ya está cargado (para mantenerlo tras una escritura)."""
+    return _indexes.get(os.path.abspath(db_path))
+
+
+def drop_index(db_path: Optional[str] = None) -> None:
+    """Descarta el índice de una base de datos (o todos). Se reconstruirá al usarse."""
+    with _indexes_lock:
+        if db_path is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(os.path.abspath(db_path), None)
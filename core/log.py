@@ -0,0 +1,73 @@
+# core/log.py
+"""
+Registro estructurado para el servidor y core/.
+
+Los mensajes llevan campos (extra={"fields": {...}}) además del texto:
+- TBFS_LOG_FORMAT=text (por defecto): "[INFO] mensaje", como los print de antes.
+- TBFS_LOG_FORMAT=json: una línea JSON por mensaje con ts, level, logger, msg
+  y los campos, para agregarlos sin analizar texto.
+TBFS_LOG_LEVEL fija el nivel (INFO por defecto; WARNING silencia los avisos
+por fichero de las ingestas grandes).
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+FORMAT = os.getenv("TBFS_LOG_FORMAT", "text")
+LEVEL = os.getenv("TBFS_LOG_LEVEL", "INFO").upper()
+
+_configured = False
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Escribe en el sys.stdout actual (respeta contextlib.redirect_stdout)."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return f"[{record.levelname}] {record.getMessage()}"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure(fmt: str = FORMAT, level: str = LEVEL) -> None:
+    """(Re)configura el logger "tbfs": salida estándar, formato text o json."""
+    global _configured
+    root = logging.getLogger("tbfs")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = _StdoutHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    root.propagate = False
+    _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger hijo de "tbfs" (p. ej. get_logger("manager") -> "tbfs.manager")."""
+    if not _configured:
+        configure()
+    return logging.getLogger(f"tbfs.{name}")
@@ -1,13 +1,48 @@
 import os
+import bisect
+import json
 import shutil
-from typing import List, Optional, Tuple
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
 from core.database import get_connection, close_connection
+from core import cache
+from core import index
+from core import storage
+from core import packs
+from core import query
+from core import wal
+from core import metrics
+from core import trace
+from core.log import get_logger
 
-STORAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "storage")
+logger = get_logger("manager")
+
+# Directorio de almacenamiento interno (TBFS_STORAGE_DIR para cambiarlo)
+STORAGE_DIR = os.getenv("TBFS_STORAGE_DIR", os.path.join(os.path.dirname(__file__), "..", "storage"))
+
+# Motor de consultas por defecto de query_files: "sql" (JOIN + GROUP BY) o
+# "index" (índice invertido en memoria, ver core/index.py).
+QUERY_ENGINE = os.getenv("TBFS_QUERY_ENGINE", "sql")
+
+# Hilos que copian ficheros a storage/ durante la ingesta
+COPY_WORKERS = int(os.getenv("TBFS_COPY_WORKERS", str(min(8, (os.cpu_count() or 1) * 2))))
+
+# Paginación de listados (keyset sobre files.id): tamaño por defecto y máximo
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# Serializa los cambios de refcount de blobs con el borrado de sus ficheros,
+# para que una ingesta no reutilice un blob que se está eliminando.
+_blob_lock = threading.Lock()
 
 # Crear carpeta storage si no existe
 os.makedirs(STORAGE_DIR, exist_ok=True)
 
+@metrics.timed("add_files")
 def add_files(file_list: List[str], tag_list: List[str], db_path: str = "database/db.db") -> bool:
     """
     Agrega ficheros y sus etiquetas al sistema.
@@ -17,115 +52,732 @@ def add_files(file_list: List[str], tag_list: List[str], db_path: str = "databas
     - tag_list: lista de etiquetas (strings, sin espacios).
     Devuelve True si al menos un archivo fue agregado, False si no se agregó ninguno.
     """
-    if not tag_list:
-        print("[ERROR] No se pueden agregar ficheros sin etiquetas.")
+    if not [t for t in tag_list if t.strip()]:
+        logger.error("No se pueden agregar ficheros sin etiquetas.")
         return False
 
-    # Asegurar directorio de almacenamiento
-    storage_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "storage"))
+    stats = _ingest(file_list, tag_list, db_path, batch_size=1000, workers=COPY_WORKERS, verbose=True)
+    return stats["added"] > 0
+
+@metrics.timed("add_files_bulk")
+def add_files_bulk(file_list: Iterable[str], tag_list: List[str], db_path: str = "database/db.db",
+                   batch_size: int = 1000, workers: Optional[int] = None) -> dict:
+    """
+    Ingesta masiva: como add_files, pero resolviendo los ids de las etiquetas una sola vez
+    y escribiendo ficheros y relaciones en transacciones de batch_size ficheros
+    (executemany + lastrowid, sin SELECT de relectura).
+
+    - file_list: rutas (cualquier iterable; se consume por lotes).
+    - tag_list: etiquetas comunes a todos los ficheros.
+    - workers: hilos de copia (por defecto COPY_WORKERS).
+    Devuelve un dict con added, skipped, bytes, seconds, files_per_sec y mb_per_sec.
+    """
+    start = time.perf_counter()
+    if not [t for t in tag_list if t.strip()]:
+        logger.error("No se pueden agregar ficheros sin etiquetas.")
+        return _bulk_stats({"added": 0, "skipped": 0, "bytes": 0, "bytes_written": 0, "deduplicated": 0}, start)
+
+    result = _ingest(file_list, tag_list, db_path, batch_size, workers or COPY_WORKERS, verbose=False)
+    logger.info(f"Ingesta masiva: {result['added']} ficheros ({result['skipped']} omitidos) en "
+                f"{result['seconds']:.2f}s — {result['files_per_sec']:.1f} ficheros/s, {result['mb_per_sec']:.2f} MB/s",
+                extra={"fields": {"event": "ingest", **result}})
+    return result
+
+
+def _ingest(file_list, tag_list, db_path, batch_size, workers, verbose):
+    """
+    Pipeline de ingesta: un pool de hilos guarda los ficheros como blobs (ver
+    core/storage.py) mientras este hilo, único escritor de la base de datos,
+    registra en lotes los que ya están guardados. El lote k se escribe mientras
+    se copia el k+1.
+    """
+    start = time.perf_counter()
+    stats = {"added": 0, "skipped": 0, "bytes": 0, "bytes_written": 0, "deduplicated": 0}
+    tags = list(dict.fromkeys(t.strip() for t in tag_list if t.strip()))
+    storage_dir = os.path.abspath(STORAGE_DIR)
     os.makedirs(storage_dir, exist_ok=True)
+    batch_size = max(int(batch_size), 1)
 
     conn, cursor = get_connection(db_path)
-    added_any = False
+    try:
+        tag_ids = _resolve_tags(cursor, tags)
+        conn.commit()
 
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="tbfs-copy") as pool:
+                for batch in _batches(file_list, batch_size, stats, verbose):
+                    pending.append(_start_copies(pool, cursor, batch, storage_dir, stats, verbose))
+                    if len(pending) > 1:
+                        _write_batch(conn, cursor, pending.popleft(), tags, tag_ids, storage_dir, stats, db_path, verbose)
+                while pending:
+                    _write_batch(conn, cursor, pending.popleft(), tags, tag_ids, storage_dir, stats, db_path, verbose)
+        except BaseException:
+            # Blobs nuevos de lotes que no llegaron a registrarse
+            created = []
+            for jobs in pending:
+                for future, _, _ in jobs:
+                    if not future.cancelled() and future.exception() is None and future.result()[3]:
+                        created.append(future.result()[0])
+            with _blob_lock:
+                _discard_unreferenced(cursor, created, storage_dir)
+            raise
+    finally:
+        close_connection(conn)
+    return _bulk_stats(stats, start)
+
+
+def _resolve_tags(cursor, tags: List[str]) -> List[int]:
+    """Crea las etiquetas que falten y devuelve sus ids, todo en una pasada."""
+    cursor.executemany("INSERT OR IGNORE INTO tags (tag) VALUES (?)", [(t,) for t in tags])
+    cursor.execute("SELECT id FROM tags WHERE tag IN (SELECT value FROM json_each(?))", (json.dumps(tags),))
+    return [r[0] for r in cursor.fetchall()]
+
+
+def _batches(file_list, batch_size, stats, verbose):
+    """Agrupa las rutas válidas en lotes de (ruta, nombre), descartando repetidas e inexistentes."""
+    seen = set()
+    batch = []
     for file_input in file_list:
         file_input = file_input.strip()
         if not file_input:
             continue
-
         # Si no es ruta absoluta, buscar en el directorio actual
         file_path = file_input if os.path.isabs(file_input) else os.path.join(os.getcwd(), file_input)
-
-        # Verificar existencia física del archivo
-        if not os.path.exists(file_path):
-            print(f"[ERROR] No se encontró el archivo '{file_input}'. Ruta interpretada: '{file_path}'")
+        file_name = os.path.basename(file_path)
+        if not os.path.isfile(file_path):
+            if verbose:
+                logger.error(f"No se encontró el archivo '{file_input}'. Ruta interpretada: '{file_path}'")
+            stats["skipped"] += 1
             continue
+        if file_name in seen:
+            stats["skipped"] += 1
+            continue
+        seen.add(file_name)
+        batch.append((file_path, file_name))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        file_name = os.path.basename(file_path)
 
-        # Comprobar si ya existe en la BD
-        cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
-        row = cursor.fetchone()
-        if row:
-            print(f"[WARNING] El fichero '{file_name}' ya existe en la base de datos. Se omite.")
+def _start_copies(pool, cursor, batch, storage_dir, stats, verbose):
+    """Descarta los nombres ya registrados y lanza el guardado del resto. Devuelve [(futuro, ruta, nombre)]."""
+    cursor.execute("SELECT name FROM files WHERE name IN (SELECT value FROM json_each(?))",
+                   (json.dumps([name for _, name in batch]),))
+    existing = {r[0] for r in cursor.fetchall()}
+    jobs = []
+    for file_path, file_name in batch:
+        if file_name in existing:
+            if verbose:
+                logger.warning(f"El fichero '{file_name}' ya existe en la base de datos. Se omite.")
+            stats["skipped"] += 1
             continue
+        jobs.append((pool.submit(storage.store_file, file_path, storage_dir), file_path, file_name))
+    return jobs
 
-        # Insertar fichero con path temporal vacío
-        cursor.execute("INSERT INTO files (name, path) VALUES (?, ?)", (file_name, ""))
-        cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
-        file_id = cursor.fetchone()[0]
-
-        # Construir la nueva ruta en storage
-        new_file_name = f"{file_id}_{file_name}"
-        storage_path = os.path.join(storage_dir, new_file_name)
 
-        # Copiar el fichero al almacenamiento interno
+def _write_batch(conn, cursor, jobs, tags, tag_ids, storage_dir, stats, db_path, verbose):
+    """
+    Registra en una sola transacción los ficheros del lote cuyo blob ya está guardado.
+    Si la escritura falla, se deshace y se borran los blobs que creó el lote.
+    """
+    rows, links, added, created = [], [], [], []
+    with _blob_lock:
         try:
-            shutil.copy2(file_path, storage_path)
-        except Exception as e:
-            cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
-            print(f"[ERROR] No se pudo copiar '{file_path}' a storage: {e}. Registro eliminado.")
-            continue
+            stored = []
+            for future, file_path, file_name in jobs:
+                try:
+                    blob = future.result()
+                except OSError as e:
+                    stats["skipped"] += 1
+                    logger.error(f"No se pudo copiar '{file_path}' a storage: {e}.")
+                    continue
+                if blob.created:
+                    created.append(blob.digest)
+                elif blob.data is None and not os.path.exists(blob.path):
+                    # El blob se borró mientras tanto: volver a guardarlo
+                    blob = storage.store_file(file_path, storage_dir)
+                    if blob.created:
+                        created.append(blob.digest)
+                stored.append((file_name, blob))
 
-        # Actualizar la ruta definitiva en la BD
-        cursor.execute("UPDATE files SET path = ? WHERE id = ?", (storage_path, file_id))
+            # Contenido ya registrado antes de este lote (o repetido dentro de él)
+            known = _known_blobs(cursor, [blob.digest for _, blob in stored])
 
-        # Insertar etiquetas y relaciones
-        for tag in tag_list:
-            tag = tag.strip()
-            if not tag:
-                continue
-            cursor.execute("INSERT OR IGNORE INTO tags (tag) VALUES (?)", (tag,))
-            cursor.execute("SELECT id FROM tags WHERE tag = ?", (tag,))
-            tag_id = cursor.fetchone()[0]
-            cursor.execute("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)", (file_id, tag_id))
+            for file_name, blob in stored:
+                blob = _place(blob, known, storage_dir)
+                try:
+                    cursor.execute("INSERT INTO files (name, path, blob) VALUES (?, ?, ?)",
+                                   (file_name, blob.path, blob.digest))
+                except sqlite3.IntegrityError:
+                    # Otro escritor registró el mismo nombre mientras se copiaba
+                    stats["skipped"] += 1
+                    continue
+                file_id = cursor.lastrowid
+                stats["bytes"] += blob.size
+                if blob.digest in known:
+                    stats["deduplicated"] += 1
+                else:
+                    stats["bytes_written"] += blob.size
+                    known[blob.digest] = (blob.path, blob.codec, blob.offset, blob.length)
+                rows.append((blob.digest, blob.path, blob.size, blob.codec, blob.offset, blob.length))
+                links.extend((file_id, tag_id) for tag_id in tag_ids)
+                added.append((file_id, file_name))
+
+            cursor.executemany(_INSERT_BLOB_SQL, rows)
+            cursor.executemany("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)", links)
+            seqs = wal.commit(conn, cursor, db_path, [(wal.ADD_FILE, (fid, name, tags)) for fid, name in added])
+        except BaseException:
+            conn.rollback()
+            _discard_unreferenced(cursor, created, storage_dir)
+            raise
+        # Blobs creados para ficheros que al final no se registraron
+        _discard_unreferenced(cursor, created, storage_dir)
+
+    stats["added"] += len(added)
+    if verbose:
+        for _, file_name in added:
+            logger.info(f"Fichero '{file_name}' agregado correctamente con etiquetas: {', '.join(tags)}",
+                        extra={"fields": {"event": "add_file", "file": file_name, "tags": tags}})
+    if added:
+        cache.invalidate(db_path, tags)
+
+    def update(idx):
+        for file_id, _ in added:
+            idx.add(file_id, tags)
+    index.apply_write(db_path, seqs, update)
+
+
+# Los valores vienen de _place: si la fila ya existe sólo cambia el codec cuando
+# su fichero se acaba de volver a escribir
+_INSERT_BLOB_SQL = """
+    INSERT INTO blobs (hash, path, size, codec, pack_offset, pack_length, refcount) VALUES (?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1, codec = excluded.codec
+"""
+
+
+def _known_blobs(cursor, digests) -> dict:
+    """{hash: (ruta, codec, pack_offset, pack_length)} de los blobs de la lista que ya están registrados."""
+    cursor.execute("""
+        SELECT hash, path, codec, pack_offset, pack_length FROM blobs
+        WHERE hash IN (SELECT value FROM json_each(?))
+    """, (json.dumps(digests),))
+    return {digest: tuple(row) for digest, *row in cursor.fetchall()}
+
+
+def _place(blob: storage.StoredBlob, known: dict, storage_dir: str) -> storage.StoredBlob:
+    """
+    Decide qué se registra para un blob recién guardado. Se llama con _blob_lock,
+    como compact_packs, para que ningún blob cambie entre la consulta y el registro.
+    - Contenido ya registrado (known): lo que describe su fila (ruta, codec y
+      posición en el pack), que puede venir de otro umbral de pack o de otro
+      codec; una copia suelta recién escrita en otra ruta sobra y se borra. Si
+      se escribió en la ruta de la fila (su fichero faltaba), manda lo escrito.
+    - Blob pequeño pendiente: se añade al pack abierto.
+    - Fichero suelto que ya existía sin fila: su codec se comprueba en el
+      fichero, no se supone el que se habría elegido ahora.
+    """
+    row = known.get(blob.digest)
+    if row is not None:
+        path, codec, offset, length = row
+        if blob.created and blob.path == path:
+            return blob._replace(created=False)
+        if blob.created:
+            storage.remove_quietly(blob.path)
+        return blob._replace(path=path, created=False, codec=codec, offset=offset, length=length, data=None)
+    if blob.data is not None:
+        return storage.append_to_pack(blob, storage_dir)
+    if not blob.created:
+        return blob._replace(codec=storage.detect_codec(blob.path, blob.digest))
+    return blob
 
-        print(f"[INFO] Fichero '{file_name}' agregado correctamente con etiquetas: {', '.join(tag_list)}")
-        added_any = True
 
-    conn.commit()
+def _discard_unreferenced(cursor, digests, storage_dir):
+    """
+    Borra de storage/ los blobs de la lista que no tienen fila en la tabla blobs
+    (los de un pack se quedan como espacio muerto hasta compact_packs).
+    """
+    if not digests:
+        return
+    cursor.execute("SELECT hash FROM blobs WHERE hash IN (SELECT value FROM json_each(?))", (json.dumps(digests),))
+    referenced = {r[0] for r in cursor.fetchall()}
+    for digest in set(digests) - referenced:
+        storage.remove_quietly(storage.blob_path(storage_dir, digest))
+
+
+def _bulk_stats(stats, start):
+    seconds = time.perf_counter() - start
+    return {
+        **stats,
+        "seconds": seconds,
+        "files_per_sec": stats["added"] / seconds if seconds else 0.0,
+        "mb_per_sec": stats["bytes"] / (1024 * 1024) / seconds if seconds else 0.0,
+    }
+
+
+def add_directory(directory: str, tag_list: List[str], db_path: str = "database/db.db",
+                  batch_size: int = 1000) -> dict:
+    """
+    Recorre un directorio (recursivamente) y agrega todos sus ficheros con add_files_bulk.
+    """
+    if not os.path.isdir(directory):
+        logger.error(f"El directorio '{directory}' no existe.")
+        return _bulk_stats({"added": 0, "skipped": 0, "bytes": 0, "bytes_written": 0, "deduplicated": 0},
+                           time.perf_counter())
+
+    def walk():
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                yield os.path.join(root, name)
+
+    return add_files_bulk(walk(), tag_list, db_path, batch_size)
+
+@metrics.timed("add_upload")
+def add_upload(file_name: str, writer: storage.BlobWriter, tag_list: List[str],
+               db_path: str = "database/db.db") -> bool:
+    """
+    Registra un fichero cuyo contenido ya se escribió en storage/ con storage.BlobWriter
+    (subidas en streaming: sin copia temporal intermedia).
+    Devuelve True si se agregó; si no, el contenido escrito se descarta.
+    """
+    tags = list(dict.fromkeys(t.strip() for t in tag_list if t.strip()))
+    file_name = os.path.basename(file_name or "")
+    if not tags or not file_name:
+        writer.abort()
+        logger.error("No se pueden agregar ficheros sin nombre o sin etiquetas.")
+        return False
+
+    conn, cursor = get_connection(db_path)
+    try:
+        with _blob_lock:
+            cursor.execute("SELECT id FROM files WHERE name = ?", (file_name,))
+            if cursor.fetchone():
+                writer.abort()
+                logger.warning(f"El fichero '{file_name}' ya existe en la base de datos. Se omite.")
+                return False
+
+            blob = writer.commit()
+            try:
+                blob = _place(blob, _known_blobs(cursor, [blob.digest]), writer.storage_dir)
+                tag_ids = _resolve_tags(cursor, tags)
+                cursor.execute("INSERT INTO files (name, path, blob) VALUES (?, ?, ?)",
+                               (file_name, blob.path, blob.digest))
+                file_id = cursor.lastrowid
+                cursor.execute(_INSERT_BLOB_SQL, (blob.digest, blob.path, blob.size, blob.codec,
+                                                  blob.offset, blob.length))
+                cursor.executemany("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)",
+                                   [(file_id, tag_id) for tag_id in tag_ids])
+                seqs = wal.commit(conn, cursor, db_path, [(wal.ADD_FILE, (file_id, file_name, tags))])
+            except BaseException:
+                conn.rollback()
+                if blob.created:
+                    _discard_unreferenced(cursor, [blob.digest], writer.storage_dir)
+                raise
+    finally:
+        close_connection(conn)
+
+    logger.info(f"Fichero '{file_name}' agregado correctamente con etiquetas: {', '.join(tags)}",
+                extra={"fields": {"event": "add_file", "file": file_name, "tags": tags}})
+    cache.invalidate(db_path, tags)
+    index.apply_write(db_path, seqs, lambda idx: idx.add(file_id, tags))
+    return True
+
+
+@metrics.timed("add_uploads")
+def add_uploads(uploads: List[Tuple[str, storage.BlobWriter]], tag_list: List[str],
+                db_path: str = "database/db.db") -> dict:
+    """
+    Registra en una sola transacción varios ficheros ya escritos con storage.BlobWriter
+    (subida por lotes). uploads es una lista de (nombre, writer).
+    Los nombres repetidos o ya registrados se omiten y su contenido se descarta.
+    Devuelve estadísticas como add_files_bulk.
+    """
+    start = time.perf_counter()
+    stats = {"added": 0, "skipped": 0, "bytes": 0, "bytes_written": 0, "deduplicated": 0}
+    tags = list(dict.fromkeys(t.strip() for t in tag_list if t.strip()))
+    if not tags or not uploads:
+        for _, writer in uploads:
+            writer.abort()
+        stats["skipped"] = len(uploads)
+        if uploads:
+            logger.error("No se pueden agregar ficheros sin etiquetas.")
+        return _bulk_stats(stats, start)
+
+    storage_dir = uploads[0][1].storage_dir
+    added, created = [], []
+    conn, cursor = get_connection(db_path)
+    try:
+        with _blob_lock:
+            try:
+                names = [os.path.basename(name or "") for name, _ in uploads]
+                cursor.execute("SELECT name FROM files WHERE name IN (SELECT value FROM json_each(?))",
+                               (json.dumps(names),))
+                existing = {r[0] for r in cursor.fetchall()}
+                tag_ids = _resolve_tags(cursor, tags)
+                links = []
+                for file_name, (_, writer) in zip(names, uploads):
+                    if not file_name or file_name in existing:
+                        writer.abort()
+                        stats["skipped"] += 1
+                        logger.warning(f"El fichero '{file_name}' ya existe o no tiene nombre. Se omite.")
+                        continue
+                    existing.add(file_name)
+                    blob = writer.commit()
+                    blob = _place(blob, _known_blobs(cursor, [blob.digest]), storage_dir)
+                    if blob.created:
+                        created.append(blob.digest)
+                    cursor.execute("INSERT INTO files (name, path, blob) VALUES (?, ?, ?)",
+                                   (file_name, blob.path, blob.digest))
+                    file_id = cursor.lastrowid
+                    cursor.execute(_INSERT_BLOB_SQL, (blob.digest, blob.path, blob.size, blob.codec,
+                                                      blob.offset, blob.length))
+                    stats["bytes"] += blob.size
+                    if cursor.execute("SELECT refcount FROM blobs WHERE hash = ?", (blob.digest,)).fetchone()[0] > 1:
+                        stats["deduplicated"] += 1
+                    else:
+                        stats["bytes_written"] += blob.size
+                    links.extend((file_id, tag_id) for tag_id in tag_ids)
+                    added.append((file_id, file_name))
+                cursor.executemany("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)", links)
+                seqs = wal.commit(conn, cursor, db_path, [(wal.ADD_FILE, (fid, name, tags)) for fid, name in added])
+            except BaseException:
+                conn.rollback()
+                # abort() sobre un writer ya confirmado no hace nada
+                for _, writer in uploads:
+                    writer.abort()
+                _discard_unreferenced(cursor, created, storage_dir)
+                raise
+    finally:
+        close_connection(conn)
+
+    stats["added"] = len(added)
+    logger.info(f"{len(added)} fichero(s) agregados por lotes con etiquetas: {', '.join(tags)}")
+    if added:
+        cache.invalidate(db_path, tags)
+
+        def update(idx):
+            for file_id, _ in added:
+                idx.add(file_id, tags)
+        index.apply_write(db_path, seqs, update)
+    return _bulk_stats(stats, start)
+
+
+def file_exists(file_name: str, db_path: str = "database/db.db") -> bool:
+    """Indica si ya hay un fichero registrado con ese nombre."""
+    conn, cursor = get_connection(db_path)
+    cursor.execute("SELECT 1 FROM files WHERE name = ?", (file_name,))
+    row = cursor.fetchone()
     close_connection(conn)
-    return added_any
+    return row is not None
 
-def query_files(query_tags: Optional[List[str]]= None, db_path: str="database/db.db")-> List[Tuple[int, str, str, str]]:
+
+@metrics.timed("query_files")
+def query_files(query_tags: Optional[List[str]]= None, db_path: str="database/db.db",
+                engine: Optional[str] = None)-> List[Tuple[int, str, str, str]]:
     """
     Devuelve lista de tuplas (id, name, tags_concat, path) que cumplen la consulta.
     - query_tags: lista de etiquetas (AND). Si None o vacía -> devuelve todo.
+    - engine: "sql" o "index"; por defecto QUERY_ENGINE.
+    Con TBFS_SLOW_QUERY_MS las que superan el umbral van al registro de consultas lentas (core/trace.py).
     """
-    if query_tags is None:
-        query_tags = []
+    # Sin repetidas: la clave de caché (_filter_node normalizado) ya las ignora
+    query_tags = list(dict.fromkeys(query_tags or []))
+    compute = _traced_query_files if trace.ENABLED else _query_files
+    return cache.cached(db_path, "rows", _filter_node(None, query_tags),
+                        lambda: compute(query_tags, db_path, engine))
 
-    conn, cursor = get_connection(db_path)
 
+def _tags_query(query_tags: List[str]) -> Tuple[str, tuple]:
+    """Sentencia y parámetros de query_files con el motor "sql"."""
     if not query_tags:
-        cursor.execute("""
-            SELECT f.id, f.name, GROUP_CONCAT(DISTINCT t.tag) as tags, f.path
-            FROM files f
-            LEFT JOIN file_tags ft ON f.id = ft.file_id
-            LEFT JOIN tags t ON ft.tag_id = t.id
-            GROUP BY f.id
-            ORDER BY f.id
-        """)
-        results = cursor.fetchall()
-    else:
-        placeholders = ",".join("?" for _ in query_tags)
-        sql = f"""
-            SELECT f.id, f.name, GROUP_CONCAT(DISTINCT t.tag) as tags, f.path
-            FROM files f
-            JOIN file_tags ft ON f.id = ft.file_id
+        return "SELECT f.id, f.name, f.tags, f.path FROM files f ORDER BY f.id", ()
+    query_tags = list(dict.fromkeys(query_tags))
+    placeholders = ",".join("?" for _ in query_tags)
+    sql = f"""
+        SELECT f.id, f.name, f.tags, f.path
+        FROM files f
+        WHERE f.id IN (
+            SELECT ft.file_id
+            FROM file_tags ft
             JOIN tags t ON ft.tag_id = t.id
             WHERE t.tag IN ({placeholders})
-            GROUP BY f.id
+            GROUP BY ft.file_id
             HAVING COUNT(DISTINCT t.tag) = ?
-            ORDER BY f.id
-        """
-        cursor.execute(sql, (*query_tags, len(query_tags)))
-        results = cursor.fetchall()
+        )
+        ORDER BY f.id
+    """
+    return sql, (*query_tags, len(query_tags))
 
+
+def _query_files(query_tags: List[str], db_path: str, engine: Optional[str],
+                 phases: Optional[dict] = None) -> List[Tuple[int, str, str, str]]:
+    """query_files sin caché. phases acumula el tiempo de cada fase (ver core/trace.py)."""
+    if (engine or QUERY_ENGINE) == "index" and query_tags:
+        start = time.perf_counter()
+        file_ids = index.get_index(db_path).match_all(query_tags)
+        if phases is not None:
+            phases["aggregation"] += time.perf_counter() - start
+            start = time.perf_counter()
+        results = _fetch_files(file_ids, db_path)
+        if phases is not None:
+            phases["sql"] += time.perf_counter() - start
+        return results
+
+    conn, cursor = get_connection(db_path)
+    start = time.perf_counter()
+    cursor.execute(*_tags_query(query_tags))
+    results = cursor.fetchall()
+    if phases is not None:
+        phases["sql"] += time.perf_counter() - start
     close_connection(conn)
     return results  # lista de (id, name, tags_concat, path)
 
 
+def _traced_query_files(query_tags: List[str], db_path: str, engine: Optional[str]):
+    """_query_files midiendo fases; si supera el umbral, se registra la traza completa."""
+    phases = trace.new_phases()
+    start = time.perf_counter()
+    results = _query_files(query_tags, db_path, engine, phases)
+    elapsed = time.perf_counter() - start
+    if trace.is_slow(elapsed):
+        trace.record(_query_report(query_tags, db_path, engine, results, elapsed, phases))
+    return results
+
+
+def _query_report(query_tags, db_path, engine, results, elapsed, phases) -> dict:
+    engine = engine or QUERY_ENGINE
+    phases["serialization"] = trace.serialization_seconds(results)
+    conn, cursor = get_connection(db_path)
+    try:
+        if engine == "index" and query_tags:
+            plan = [f"INTERSECCIÓN en memoria de {len(set(query_tags))} lista(s) de etiquetas (core/index.py)"]
+            plan += trace.query_plan(cursor, _FETCH_FILES_SQL, (json.dumps([r[0] for r in results]),))
+        else:
+            plan = trace.query_plan(cursor, *_tags_query(query_tags))
+        if query_tags:
+            cursor.execute("""
+                SELECT COALESCE(SUM(c.count), 0)
+                FROM tags t JOIN tag_counts c ON c.tag_id = t.id
+                WHERE t.tag IN (SELECT value FROM json_each(?))
+            """, (json.dumps(sorted(set(query_tags))),))
+        else:
+            cursor.execute("SELECT COUNT(*) FROM files")
+        scanned = cursor.fetchone()[0]
+    finally:
+        close_connection(conn)
+    return trace.report(query_tags, engine, plan, scanned, len(results), elapsed, phases)
+
+
+def explain_query(query_tags: Optional[List[str]] = None, db_path: str = "database/db.db",
+                  engine: Optional[str] = None) -> dict:
+    """
+    Ejecuta la consulta de query_files sin caché y devuelve su traza: consulta
+    normalizada, plan, filas recorridas/devueltas y tiempo por fase (core/trace.py).
+    """
+    query_tags = [t for t in (query_tags or []) if t.strip()]
+    phases = trace.new_phases()
+    start = time.perf_counter()
+    results = _query_files(query_tags, db_path, engine, phases)
+    elapsed = time.perf_counter() - start
+    return _query_report(query_tags, db_path, engine, results, elapsed, phases)
+
+
+@metrics.timed("match_expression")
+def match_expression(expression, db_path: str = "database/db.db", engine: Optional[str] = None,
+                     naive: bool = False, stats: Optional[dict] = None) -> List[int]:
+    """
+    Evalúa una expresión booleana de etiquetas (ver core/query.py) y devuelve los ids ordenados.
+    - expression: texto ("(a OR b) AND NOT c") o árbol ya parseado.
+    - naive: evalúa de izquierda a derecha sin reordenar (sólo para comparar planes).
+    - stats: si se pasa un dict, se acumulan en él las filas de postings leídas ("rows").
+    Lanza query.QuerySyntaxError si la expresión no es válida.
+    """
+    node = query.parse(expression) if isinstance(expression, str) else expression
+    if stats is not None:
+        stats.setdefault("rows", 0)
+
+    conn, cursor = get_connection(db_path)
+    try:
+        if node is None:
+            cursor.execute("SELECT id FROM files ORDER BY id")
+            return [r[0] for r in cursor.fetchall()]
+
+        tags = sorted(query.tags_in(node))
+        use_index = (engine or QUERY_ENGINE) == "index"
+        if use_index:
+            idx = index.get_index(db_path)
+            counts = {t: idx.cardinality(t) for t in tags}
+        else:
+            # Cardinalidades desde tag_counts (mantenida por triggers)
+            cursor.execute("""
+                SELECT t.tag, t.id, COALESCE(c.count, 0)
+                FROM tags t
+                LEFT JOIN tag_counts c ON c.tag_id = t.id
+                WHERE t.tag IN (SELECT value FROM json_each(?))
+            """, (json.dumps(tags),))
+            rows = cursor.fetchall()
+            tag_ids = {tag: tag_id for tag, tag_id, _ in rows}
+            counts = {tag: count for tag, _, count in rows}
+
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'files'")
+        row = cursor.fetchone()
+        total = max(row[0] if row else 0, max(counts.values(), default=0))
+        planned = query.plan(node, lambda t: counts.get(t, 0), total, naive=naive)
+
+        def postings(tag, candidates):
+            if use_index:
+                ids = idx.posting_set(tag, candidates)
+                read = len(ids) if candidates is None else len(candidates)
+            elif candidates is not None and len(candidates) < counts.get(tag, 0):
+                # Pocos candidatos: comprobar cada uno por la clave primaria (file_id, tag_id)
+                cursor.execute("""
+                    SELECT file_id FROM file_tags
+                    WHERE file_id IN (SELECT value FROM json_each(?)) AND tag_id = ?
+                """, (json.dumps(list(candidates)), tag_ids[tag]))
+                ids = {r[0] for r in cursor.fetchall()}
+                read = len(candidates)
+            else:
+                cursor.execute("SELECT file_id FROM file_tags WHERE tag_id = ?", (tag_ids[tag],))
+                ids = {r[0] for r in cursor.fetchall()}
+                read = len(ids)
+                if candidates is not None:
+                    ids &= candidates
+            if stats is not None:
+                stats["rows"] += read
+            return ids
+
+        def universe(candidates):
+            if candidates is not None:
+                return set(candidates)
+            cursor.execute("SELECT id FROM files")
+            ids = {r[0] for r in cursor.fetchall()}
+            if stats is not None:
+                stats["rows"] += len(ids)
+            return ids
+
+        return query.execute(planned, postings, universe)
+    finally:
+        close_connection(conn)
+
+
+@metrics.timed("search_files")
+def search_files(expression: str, db_path: str = "database/db.db",
+                 engine: Optional[str] = None) -> List[Tuple[int, str, str, str]]:
+    """
+    Como query_files, pero con una expresión booleana de etiquetas
+    ("(photo OR video) AND 2024 AND NOT draft"). Expresión vacía -> todos los ficheros.
+    """
+    node = query.parse(expression)
+    if node is None:
+        return query_files([], db_path)
+    return cache.cached(db_path, "rows", node, lambda: _fetch_files(match_expression(node, db_path, engine), db_path))
+
+
+_FETCH_FILES_SQL = """
+    SELECT f.id, f.name, f.tags, f.path
+    FROM files f
+    WHERE f.id IN (SELECT value FROM json_each(?))
+    ORDER BY f.id
+"""
+
+
+def _fetch_files(file_ids: List[int], db_path: str) -> List[Tuple[int, str, str, str]]:
+    """
+    Devuelve las filas (id, name, tags_concat, path) de los ids indicados, ordenadas por id.
+    """
+    if not file_ids:
+        return []
+    conn, cursor = get_connection(db_path)
+    cursor.execute(_FETCH_FILES_SQL, (json.dumps(file_ids),))
+    results = cursor.fetchall()
+    close_connection(conn)
+    return results
+
+
+def _filter_node(expression: Optional[str], query_tags: Optional[List[str]]):
+    """Árbol de consulta de una expresión o de una lista de etiquetas (AND); None = todo."""
+    if expression is not None:
+        return query.parse(expression)
+    if not query_tags:
+        return None
+    leaves = [("tag", t) for t in query_tags]
+    return leaves[0] if len(leaves) == 1 else ("and", leaves)
+
+
+def _fetch_after(cursor, after: int, limit: int) -> List[Tuple[int, str, str, str]]:
+    """Filas (id, name, tags_concat, path) con id > after, en orden de id, sin recorrer toda la tabla."""
+    cursor.execute("""
+        SELECT f.id, f.name, f.tags, f.path
+        FROM files f
+        WHERE f.id > ?
+        ORDER BY f.id
+        LIMIT ?
+    """, (after, limit))
+    return cursor.fetchall()
+
+
+@metrics.timed("page_files")
+def page_files(expression: Optional[str] = None, query_tags: Optional[List[str]] = None,
+               after: int = 0, limit: int = PAGE_LIMIT, count: bool = False,
+               db_path: str = "database/db.db"):
+    """
+    Una página del listado, paginada por cursor (keyset sobre files.id).
+    - expression / query_tags: filtro como en search_files / query_files.
+    - after: id del último fichero de la página anterior (0 = desde el principio).
+    - limit: filas por página (se recorta a MAX_PAGE_LIMIT).
+    - count: si True, también se calcula el total de coincidencias.
+    Devuelve (filas, next_cursor, total); next_cursor es None en la última página
+    y total es None si no se pidió.
+    Lanza query.QuerySyntaxError si la expresión no es válida.
+    """
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+    node = _filter_node(expression, query_tags)
+    total = None
+    if node is None:
+        conn, cursor = get_connection(db_path)
+        try:
+            rows = _fetch_after(cursor, after, limit + 1)
+            if count:
+                cursor.execute("SELECT COUNT(*) FROM files")
+                total = cursor.fetchone()[0]
+        finally:
+            close_connection(conn)
+    else:
+        ids = cache.cached(db_path, "ids", node, lambda: match_expression(node, db_path))
+        start = bisect.bisect_right(ids, after)
+        rows = _fetch_files(ids[start:start + limit + 1], db_path)
+        if count:
+            total = len(ids)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return rows[:limit], next_cursor, total
+
+
+def iter_files(expression: Optional[str] = None, query_tags: Optional[List[str]] = None,
+               batch_size: int = MAX_PAGE_LIMIT, db_path: str = "database/db.db") -> Iterator[Tuple[int, str, str, str]]:
+    """
+    Recorre todas las coincidencias en orden de id, leyendo batch_size filas cada vez
+    (para exportaciones grandes). No mantiene la conexión abierta entre lotes.
+    """
+    node = _filter_node(expression, query_tags)
+    if node is None:
+        after = 0
+        while True:
+            conn, cursor = get_connection(db_path)
+            try:
+                rows = _fetch_after(cursor, after, batch_size)
+            finally:
+                close_connection(conn)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+    ids = cache.cached(db_path, "ids", node, lambda: match_expression(node, db_path))
+    for start in range(0, len(ids), batch_size):
+        yield from _fetch_files(ids[start:start + batch_size], db_path)
+
+
 def list_files(query_tags: Optional[List[str]] = None, db_path: str = "database/db.db") -> List[Tuple[int, str, str, str]]:
     files = query_files(query_tags, db_path)
     if not files:
@@ -138,6 +790,86 @@ def list_files(query_tags: Optional[List[str]] = None, db_path: str = "database/
     return files
 
 
+@metrics.timed("tag_stats")
+def tag_stats(prefix: Optional[str] = None, limit: int = 50,
+              db_path: str = "database/db.db") -> List[Tuple[str, int]]:
+    """
+    Etiquetas con su número de ficheros, de más a menos usadas, desde tag_counts.
+    - prefix: sólo las que empiezan por prefix (autocompletado; recorre el índice de tags.tag).
+    """
+    conn, cursor = get_connection(db_path)
+    try:
+        if prefix:
+            cursor.execute("""
+                SELECT t.tag, c.count FROM tags t JOIN tag_counts c ON c.tag_id = t.id
+                WHERE t.tag >= ? AND t.tag < ? AND c.count > 0
+                ORDER BY c.count DESC, t.tag
+                LIMIT ?
+            """, (prefix, prefix + "\U0010ffff", limit))
+        else:
+            cursor.execute("""
+                SELECT t.tag, c.count FROM tag_counts c JOIN tags t ON t.id = c.tag_id
+                WHERE c.count > 0
+                ORDER BY c.count DESC, t.tag
+                LIMIT ?
+            """, (limit,))
+        return cursor.fetchall()
+    finally:
+        close_connection(conn)
+
+
+@metrics.timed("cooccurring_tags")
+def cooccurring_tags(expression: Optional[str] = None, query_tags: Optional[List[str]] = None,
+                     limit: int = 10, db_path: str = "database/db.db") -> List[Tuple[str, int]]:
+    """
+    Las limit etiquetas más frecuentes entre los ficheros que cumplen la consulta
+    (sin contar las de la propia consulta), con cuántos de esos ficheros las tienen.
+    - Sin consulta: las etiquetas más usadas (tag_stats).
+    - Una sola etiqueta: desde tag_pairs, sin recorrer file_tags.
+    - Otras consultas: se cuentan las etiquetas (files.tags) de los ids coincidentes; cacheado.
+    Lanza query.QuerySyntaxError si la expresión no es válida.
+    """
+    node = _filter_node(expression, query_tags)
+    if node is None:
+        return tag_stats(limit=limit, db_path=db_path)
+    if node[0] == "tag":
+        conn, cursor = get_connection(db_path)
+        try:
+            cursor.execute("""
+                SELECT t2.tag, p.count
+                FROM tags t
+                JOIN tag_pairs p ON p.tag_a = t.id
+                JOIN tags t2 ON t2.id = p.tag_b
+                WHERE t.tag = ? AND p.count > 0
+                ORDER BY p.count DESC, t2.tag
+                LIMIT ?
+            """, (node[1], limit))
+            return cursor.fetchall()
+        finally:
+            close_connection(conn)
+    return cache.cached(db_path, "cooccur", node, lambda: _count_tags(node, db_path))[:limit]
+
+
+def _count_tags(node, db_path: str) -> List[Tuple[str, int]]:
+    """(etiqueta, ficheros) de los ficheros que cumplen node, ordenado de más a menos."""
+    ids = cache.cached(db_path, "ids", node, lambda: match_expression(node, db_path))
+    exclude = query.tags_in(node)
+    counts = {}
+    conn, cursor = get_connection(db_path)
+    try:
+        for start in range(0, len(ids), MAX_PAGE_LIMIT):
+            cursor.execute("SELECT tags FROM files WHERE id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(ids[start:start + MAX_PAGE_LIMIT]),))
+            for (tags,) in cursor:
+                for tag in tags.split(",") if tags else []:
+                    if tag not in exclude:
+                        counts[tag] = counts.get(tag, 0) + 1
+    finally:
+        close_connection(conn)
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+@metrics.timed("delete_files")
 def delete_files(query_tags: List[str], db_path: str = "database/db.db") -> bool:
     """
     Elimina ficheros que cumplen la query (por etiquetas).
@@ -146,116 +878,232 @@ def delete_files(query_tags: List[str], db_path: str = "database/db.db") -> bool
     """
     if not query_tags:
         # si quieres permitir borrar TODO cuando query vacía, cambia la lógica
-        print("[ERROR] delete_files requiere una query de etiquetas.")
+        logger.error("delete_files requiere una query de etiquetas.")
         return False
 
-    conn, cursor = get_connection(db_path)
+    with _blob_lock:
+        conn, cursor = get_connection(db_path)
+        try:
+            # Los ficheros a borrar se leen dentro de la transacción y no de la caché
+            # de query_files: un borrado concurrente ya no puede haberlos cambiado
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(*_tags_query(query_tags))
+            files = [(fid, name, tags or "", path) for fid, name, tags, path in cursor.fetchall()]
+            if not files:
+                conn.rollback()
+                return False
+            cursor.execute("SELECT id, blob FROM files WHERE id IN (SELECT value FROM json_each(?))",
+                           (json.dumps([fid for fid, _, _, _ in files]),))
+            blobs = dict(cursor.fetchall())
 
-    # obtener archivos a eliminar (usando query_files para consistencia)
-    files = query_files(query_tags, db_path)
-    if not files:
-        close_connection(conn)
-        return False
+            released = []
+            legacy = []
+            for fid, name, _, path in files:
+                digest = blobs[fid]
+                if digest:
+                    # blob compartido: se libera una referencia
+                    cursor.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (digest,))
+                    released.append(digest)
+                elif path:
+                    # fichero antiguo (storage/{id}_{name}): se borra tras confirmar
+                    legacy.append(path)
 
-    file_ids = set()
-    for file_id, name, tags, path in files:
-        file_ids.add((file_id, path, name))
+                # borrar relaciones y metadatos
+                cursor.execute("DELETE FROM file_tags WHERE file_id = ?", (fid,))
+                cursor.execute("DELETE FROM files WHERE id = ?", (fid,))
+                logger.info(f"Eliminado (DB): {name}", extra={"fields": {"event": "delete_file", "file": name}})
 
-    for fid, path, name in file_ids:
-        # borrar archivo físico si existe
-        if path and os.path.exists(path):
+            # Blobs sin referencias: se borran la fila y, tras confirmar, el fichero
+            # (los de un pack quedan como espacio muerto hasta compact_packs)
+            cursor.execute("""
+                SELECT hash, path, pack_offset FROM blobs
+                WHERE refcount <= 0 AND hash IN (SELECT value FROM json_each(?))
+            """, (json.dumps(released),))
+            orphans = cursor.fetchall()
+            cursor.executemany("DELETE FROM blobs WHERE hash = ?", [(digest,) for digest, _, _ in orphans])
+            seqs = wal.commit(conn, cursor, db_path, [(wal.DELETE_FILE, (fid, name, tags.split(",") if tags else []))
+                                                      for fid, name, tags, _ in files])
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            close_connection(conn)
+
+        legacy = [path for path in legacy if os.path.exists(path)]
+        for path in legacy + [blob for _, blob, offset in orphans if offset is None]:
             try:
                 os.remove(path)
-                print(f"[INFO] Archivo físico eliminado: {path}")
-            except Exception as e:
-                print(f"[WARNING] No pude eliminar '{path}': {e}")
+                logger.info(f"Archivo físico eliminado: {path}")
+            except OSError as e:
+                logger.warning(f"No pude eliminar '{path}': {e}")
 
-        # borrar relaciones y metadatos
-        cursor.execute("DELETE FROM file_tags WHERE file_id = ?", (fid,))
-        cursor.execute("DELETE FROM files WHERE id = ?", (fid,))
-        print(f"[INFO] Eliminado (DB): {name}")
+    cache.invalidate(db_path, {t for _, _, tags, _ in files if tags for t in tags.split(",")})
 
-    conn.commit()
-    close_connection(conn)
+    def update(idx):
+        for fid, _, tags, _ in files:
+            idx.remove(fid, tags.split(",") if tags else [])
+    index.apply_write(db_path, seqs, update)
     return True
 
+def _select_targets(cursor, query_tags: List[str]) -> int:
+    """
+    Deja en la tabla temporal retag_files los ids de los ficheros que tienen todas
+    las etiquetas de query_tags (todos si está vacía). Devuelve cuántos son.
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS retag_files (file_id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM retag_files")
+    tags = list(dict.fromkeys(t.strip() for t in query_tags if t.strip()))
+    if tags:
+        cursor.execute("""
+            INSERT INTO retag_files (file_id)
+            SELECT ft.file_id
+            FROM file_tags ft
+            JOIN tags t ON t.id = ft.tag_id
+            WHERE t.tag IN (SELECT value FROM json_each(?))
+            GROUP BY ft.file_id
+            HAVING COUNT(*) = ?
+        """, (json.dumps(tags), len(tags)))
+    else:
+        cursor.execute("INSERT INTO retag_files (file_id) SELECT id FROM files")
+    return cursor.rowcount
+
+
+def _target_tags(cursor) -> List[str]:
+    """Etiquetas que tienen ahora los ficheros de retag_files (para invalidar la caché)."""
+    cursor.execute("""
+        SELECT tag FROM tags WHERE id IN (
+            SELECT DISTINCT ft.tag_id FROM retag_files r JOIN file_tags ft ON ft.file_id = r.file_id
+        )
+    """)
+    return [r[0] for r in cursor.fetchall()]
+
+
+@metrics.timed("add_tags")
 def add_tags(query_tags: List[str], new_tags: List[str], db_path: str = "database/db.db") -> bool:
     """
     Añade etiquetas new_tags a todos los ficheros que cumplen query_tags.
+    Todo en una transacción y con SQL por conjuntos: INSERT ... SELECT sobre los
+    ficheros que cumplen la consulta, sin recorrerlos uno a uno.
     Devuelve True si se agregó al menos a un archivo, False si no hubo coincidencias.
     """
+    new_tags = list(dict.fromkeys(t.strip() for t in new_tags if t.strip()))
     conn, cursor = get_connection(db_path)
-    files = query_files(query_tags, db_path)
-    if not files:
+    try:
+        matched = _select_targets(cursor, query_tags)
+        if not matched:
+            conn.rollback()
+            return False
+        tag_ids = _resolve_tags(cursor, new_tags)
+        cursor.execute("""
+            INSERT OR IGNORE INTO file_tags (file_id, tag_id)
+            SELECT r.file_id, j.value FROM retag_files r, json_each(?) j
+        """, (json.dumps(tag_ids),))
+        inserted = cursor.rowcount
+        changed_tags = _target_tags(cursor) if inserted > 0 else []
+        changes = []
+        if inserted > 0 and (index.loaded_index(db_path) is not None or wal.get_log(db_path) is not None):
+            cursor.execute("SELECT file_id FROM retag_files ORDER BY file_id")
+            file_ids = [r[0] for r in cursor.fetchall()]
+            changes = [(wal.ADD_TAGS, (tag, file_ids)) for tag in new_tags]
+        seqs = wal.commit(conn, cursor, db_path, changes)
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
         close_connection(conn)
-        return False
 
-    affected = 0
-    for file_id, name, _, _ in files:
-        for tag in new_tags:
-            tag = tag.strip()
-            if not tag:
-                continue
-            cursor.execute("INSERT OR IGNORE INTO tags (tag) VALUES (?)", (tag,))
-            cursor.execute("SELECT id FROM tags WHERE tag = ?", (tag,))
-            tag_id = cursor.fetchone()[0]
-            cursor.execute("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)", (file_id, tag_id))
-        affected += 1
-        print(f"[INFO] Etiquetas agregadas a {name}")
-
-    conn.commit()
-    close_connection(conn)
-    return affected > 0
+    logger.info(f"Etiquetas agregadas a {matched} archivo(s) ({inserted} nuevas relaciones)",
+                extra={"fields": {"event": "add_tags", "matched": matched, "inserted": inserted}})
+    if inserted > 0:
+        cache.invalidate(db_path, changed_tags)
+
+        def update(idx):
+            for tag in new_tags:
+                idx.add_many(tag, file_ids)
+        if changes:
+            index.apply_write(db_path, seqs, update)
+    return True
 
+@metrics.timed("delete_tags")
 def delete_tags(query_tags: List[str], del_tags: List[str], db_path: str = "database/db.db") -> bool:
     """
     Elimina las etiquetas del_tags de los ficheros que cumplen query_tags.
-    No elimina etiquetas si el fichero quedaría sin ninguna.
+    No elimina etiquetas si el fichero quedaría sin ninguna: se conserva la última
+    de del_tags (en orden) que tenga, como al borrarlas una a una.
+    Se hace con un único DELETE sobre el conjunto de relaciones, en una transacción.
     Devuelve True si al menos una relación fue eliminada, False si no hubo coincidencias.
     """
+    del_tags = list(dict.fromkeys(t.strip() for t in del_tags if t.strip()))
     conn, cursor = get_connection(db_path)
-    files = query_files(query_tags, db_path)
-    if not files:
-        close_connection(conn)
-        return False
-
-    total_deleted = 0
+    try:
+        if not del_tags or not _select_targets(cursor, query_tags):
+            conn.rollback()
+            return False
 
-    for file_id, name, _, _ in files:
-        # Contar cuántas etiquetas tiene actualmente el archivo
+        # Relaciones (fichero, etiqueta de del_tags); keep = 1 en la que dejaría al fichero sin etiquetas
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS untag_links (file_id INTEGER, tag_id INTEGER, "
+                       "keep INTEGER, PRIMARY KEY (file_id, tag_id))")
+        cursor.execute("DELETE FROM untag_links")
+        cursor.execute("SELECT tag, id FROM tags WHERE tag IN (SELECT value FROM json_each(?))", (json.dumps(del_tags),))
+        del_ids = dict(cursor.fetchall())
+        positions = [[del_ids[tag], pos] for pos, tag in enumerate(del_tags) if tag in del_ids]
+        # Cada (fichero, etiqueta) se comprueba por la clave primaria de file_tags
         cursor.execute("""
-            SELECT COUNT(*) FROM file_tags WHERE file_id = ?
-        """, (file_id,))
-        tag_count = cursor.fetchone()[0]
-
-        for tag in del_tags:
-            tag = tag.strip()
-            if not tag:
-                continue
-
-            # Si solo queda una etiqueta, no eliminar más
-            if tag_count <= 1:
-                print(f"[WARN] No se puede eliminar la última etiqueta de '{name}'.")
-                break
-
-            cursor.execute("SELECT id FROM tags WHERE tag = ?", (tag,))
-            row = cursor.fetchone()
-            if not row:
-                continue
+            WITH dels AS (
+                SELECT json_extract(value, '$[0]') AS tag_id, json_extract(value, '$[1]') AS pos FROM json_each(?)
+            ),
+            targets AS MATERIALIZED (
+                SELECT r.file_id, ft.tag_id, d.pos
+                FROM retag_files r
+                CROSS JOIN dels d
+                JOIN file_tags ft ON ft.file_id = r.file_id AND ft.tag_id = d.tag_id
+            ),
+            per_file AS (
+                SELECT file_id, COUNT(*) AS n, MAX(pos) AS keep_pos FROM targets GROUP BY file_id
+            )
+            INSERT INTO untag_links (file_id, tag_id, keep)
+            SELECT tg.file_id, tg.tag_id,
+                   tg.pos = p.keep_pos AND p.n = (SELECT COUNT(*) FROM file_tags ft2 WHERE ft2.file_id = tg.file_id)
+            FROM targets tg
+            JOIN per_file p ON p.file_id = tg.file_id
+        """, (json.dumps(positions),))
+        cursor.execute("DELETE FROM untag_links WHERE keep")
+        kept = cursor.rowcount
 
-            tag_id = row[0]
-            cursor.execute("DELETE FROM file_tags WHERE file_id = ? AND tag_id = ?", (file_id, tag_id))
-            if cursor.rowcount > 0:
-                total_deleted += cursor.rowcount
-                tag_count -= 1  # actualizamos el contador local
+        cursor.execute("DELETE FROM file_tags WHERE (file_id, tag_id) IN (SELECT file_id, tag_id FROM untag_links)")
+        total_deleted = cursor.rowcount
+        removed = {}
+        if total_deleted > 0:
+            cursor.execute("""
+                SELECT t.tag, u.file_id FROM untag_links u JOIN tags t ON t.id = u.tag_id ORDER BY t.tag, u.file_id
+            """)
+            for tag, file_id in cursor.fetchall():
+                removed.setdefault(tag, []).append(file_id)
+            # Etiquetas que quedan en los ficheros cambiados + las borradas = las de antes
+            cursor.execute("DELETE FROM retag_files WHERE file_id NOT IN (SELECT file_id FROM untag_links)")
+            changed_tags = set(_target_tags(cursor)) | set(removed)
+        seqs = wal.commit(conn, cursor, db_path, [(wal.DELETE_TAGS, item) for item in removed.items()])
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        close_connection(conn)
 
-        print(f"[INFO] Etiquetas eliminadas de {name} (quedan {tag_count})")
+    if kept:
+        logger.warning(f"No se puede eliminar la última etiqueta de {kept} archivo(s); se conserva.")
+    logger.info(f"{total_deleted} relación(es) etiqueta-archivo eliminada(s)",
+                extra={"fields": {"event": "delete_tags", "deleted": total_deleted, "kept": kept}})
+    if total_deleted > 0:
+        cache.invalidate(db_path, changed_tags)
 
-    conn.commit()
-    close_connection(conn)
+        def update(idx):
+            for tag, file_ids in removed.items():
+                idx.remove_many(tag, file_ids)
+        index.apply_write(db_path, seqs, update)
     return total_deleted > 0
 
 
+@metrics.timed("download_file")
 def download_file(file_name: str, destination_folder: str, db_path: str = "database/db.db") -> bool:
     """
     Copia un archivo del sistema (desde storage/) hacia una carpeta destino existente.
@@ -263,17 +1111,21 @@ def download_file(file_name: str, destination_folder: str, db_path: str = "datab
     Devuelve True si se descargó correctamente, False en caso contrario.
     """
     conn, cursor = get_connection(db_path)
-    cursor.execute("SELECT path FROM files WHERE name = ?", (file_name,))
+    cursor.execute("""
+        SELECT f.path, COALESCE(b.codec, 'identity'), b.pack_offset, b.pack_length
+        FROM files f LEFT JOIN blobs b ON b.hash = f.blob
+        WHERE f.name = ?
+    """, (file_name,))
     row = cursor.fetchone()
     close_connection(conn)
 
     if not row:
-        print(f"[ERROR] El archivo '{file_name}' no existe en la base de datos.")
+        logger.error(f"El archivo '{file_name}' no existe en la base de datos.")
         return False
 
     storage_path = row[0]
     if not storage_path or not os.path.exists(storage_path):
-        print(f"[ERROR] El archivo '{file_name}' no se encuentra en el almacenamiento interno.")
+        logger.error(f"El archivo '{file_name}' no se encuentra en el almacenamiento interno.")
         return False
 
     # Interpretar correctamente carpeta "Downloads"
@@ -282,17 +1134,19 @@ def download_file(file_name: str, destination_folder: str, db_path: str = "datab
 
     # Verificar que exista la carpeta de destino
     if not os.path.isdir(destination_folder):
-        print(f"[ERROR] La carpeta destino '{destination_folder}' no existe en el sistema.")
+        logger.error(f"La carpeta destino '{destination_folder}' no existe en el sistema.")
         return False
 
     destination_path = os.path.join(destination_folder, file_name)
 
     try:
-        shutil.copy2(storage_path, destination_path)
-        print(f"[INFO] Archivo '{file_name}' descargado correctamente en '{destination_folder}'.")
+        _, codec, offset, length = row
+        storage.copy_out(storage_path, codec, destination_path, offset, length)
+        metrics.STORAGE_READ_BYTES.inc(os.path.getsize(storage_path) if offset is None else length, "copy")
+        logger.info(f"Archivo '{file_name}' descargado correctamente en '{destination_folder}'.")
         return True
     except Exception as e:
-        print(f"[ERROR] No se pudo copiar el archivo: {e}")
+        logger.error(f"No se pudo copiar el archivo: {e}")
         return False
 
 def get_file_path(file_name: str, db_path: str = "database/db.db") -> Optional[str]:
@@ -302,3 +1156,112 @@ def get_file_path(file_name: str, db_path: str = "database/db.db") -> Optional[s
     row = cursor.fetchone()
     close_connection(conn)
     return row[0] if row else None
+
+
+def get_file_info(file_name: str, db_path: str = "database/db.db") -> Optional[dict]:
+    """
+    Ruta y validador (ETag) del archivo almacenado, o None si no existe.
+    El ETag es el hash del blob: no cambia mientras no cambie el contenido.
+    Los ficheros antiguos sin blob usan tamaño y mtime.
+    codec es el de storage/ y size el tamaño del contenido original; si el blob
+    está en un pack, path es el pack y offset/length su posición y bytes guardados.
+    """
+    conn, cursor = get_connection(db_path)
+    cursor.execute("""
+        SELECT f.path, f.blob, COALESCE(b.codec, 'identity'), b.size, b.pack_offset, b.pack_length
+        FROM files f LEFT JOIN blobs b ON b.hash = f.blob
+        WHERE f.name = ?
+    """, (file_name,))
+    row = cursor.fetchone()
+    close_connection(conn)
+    if not row or not row[0] or not os.path.exists(row[0]):
+        return None
+    path, blob, codec, size, offset, length = row
+    stat = os.stat(path)
+    etag = f'"{blob}"' if blob else f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    return {"path": path, "blob": blob, "size": stat.st_size if size is None else size, "mtime": stat.st_mtime,
+            "etag": etag, "codec": codec, "offset": offset, "length": length}
+
+
+def stored_blobs(file_ids: List[int], db_path: str = "database/db.db") -> dict:
+    """
+    {id: (codec, tamaño original, offset, length)} de los ficheros de la lista
+    guardados comprimidos o dentro de un pack (offset None si no).
+    """
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("""
+            SELECT f.id, b.codec, b.size, b.pack_offset, b.pack_length FROM files f JOIN blobs b ON b.hash = f.blob
+            WHERE f.id IN (SELECT value FROM json_each(?)) AND (b.codec != 'identity' OR b.pack_offset IS NOT NULL)
+        """, (json.dumps(file_ids),))
+        return {file_id: tuple(rest) for file_id, *rest in cursor.fetchall()}
+    finally:
+        close_connection(conn)
+
+
+@metrics.timed("compact_packs")
+def compact_packs(db_path: str = "database/db.db", min_ratio: Optional[float] = None) -> dict:
+    """
+    Recupera el espacio de los blobs borrados de los packs (core/packs.py). Cada
+    pack cerrado con al menos min_ratio (TBFS_PACK_COMPACT_RATIO) de bytes
+    muertos se vacía: sus blobs vivos se copian al pack abierto y, confirmado
+    el cambio de rutas, se borra. Cada pack se hace entero con _blob_lock.
+    Devuelve {"packs": compactados, "moved": blobs copiados, "reclaimed": bytes liberados}.
+    """
+    ratio = packs.COMPACT_RATIO if min_ratio is None else min_ratio
+    storage_dir = os.path.abspath(STORAGE_DIR)
+    stats = {"packs": 0, "moved": 0, "reclaimed": 0}
+    sealed = packs.sealed_packs(storage_dir)
+    if not sealed:
+        return stats
+
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("SELECT path, SUM(pack_length) FROM blobs WHERE pack_offset IS NOT NULL GROUP BY path")
+        live = dict(cursor.fetchall())
+        for path in sealed:
+            total = os.path.getsize(path)
+            if total - live.get(path, 0) < total * ratio:
+                continue
+            with _blob_lock:
+                moved, kept = _empty_pack(conn, cursor, path, storage_dir)
+                packs.remove(path)
+            stats["packs"] += 1
+            stats["moved"] += moved
+            stats["reclaimed"] += total - kept
+    finally:
+        close_connection(conn)
+    if stats["packs"]:
+        logger.info(f"Packs compactados: {stats['packs']} ({stats['moved']} blobs movidos, "
+                    f"{stats['reclaimed'] / 2 ** 20:.1f} MB liberados)",
+                    extra={"fields": {"event": "compact_packs", **stats}})
+    return stats
+
+
+def _empty_pack(conn, cursor, path: str, storage_dir: str) -> Tuple[int, int]:
+    """Copia los blobs vivos del pack al pack abierto y actualiza sus rutas. Devuelve (blobs, bytes) movidos."""
+    cursor.execute("""
+        SELECT hash, pack_offset, pack_length FROM blobs
+        WHERE path = ? AND pack_offset IS NOT NULL ORDER BY pack_offset
+    """, (path,))
+    rows = cursor.fetchall()
+    source = packs.reader(path)
+    moved = []
+    for digest, offset, length in rows:
+        data = os.pread(source.fileno(), length, offset)
+        if len(data) != length:
+            raise OSError(f"El pack '{path}' está truncado (blob {digest})")
+        new_path, new_offset = packs.append(storage_dir, data)
+        moved.append((new_path, new_offset, digest))
+    try:
+        cursor.executemany("UPDATE blobs SET path = ?, pack_offset = ? WHERE hash = ?", moved)
+        # files.path copia la ruta del blob; sin índice por blob, una pasada por files
+        cursor.execute("""
+            UPDATE files SET path = (SELECT b.path FROM blobs b WHERE b.hash = files.blob)
+            WHERE path = ? AND blob IS NOT NULL
+        """, (path,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(moved), sum(length for _, _, length in rows)
@@ -0,0 +1,186 @@
+# core/metrics.py
+"""
+Métricas en memoria con salida en formato de texto de Prometheus (/metrics).
+
+- Histogramas de latencia por endpoint HTTP (server/api.py), por operación de
+  core.manager (decorador timed) y por tipo de sentencia SQL (cursor de
+  core/database.py).
+- Contadores de bytes leídos/escritos en storage/ y de conexiones abiertas.
+
+TBFS_METRICS=0 las desactiva: timed devuelve la función sin envolver, los
+cursores son los de sqlite3 y el resto de llamadas retornan de inmediato.
+"""
+import functools
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+ENABLED = os.getenv("TBFS_METRICS", "1") != "0"
+
+# Límites superiores (segundos) de los cubos de latencia
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _label_text(self, values, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        if not ENABLED:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + self._label_text(k), v) for k, v in sorted(self.values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # etiquetas -> [cuenta por cubo (+Inf al final), suma]
+        self.series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self):
+        out = []
+        with self.lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self.series.items())
+        for labels, (counts, total) in items:
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                out.append((f"{self.name}_bucket{self._label_text(labels, le)}", running))
+            out.append((f"{self.name}_sum{self._label_text(labels)}", total))
+            out.append((f"{self.name}_count{self._label_text(labels)}", running))
+        return out
+
+
+class Gauge(_Metric):
+    """Valor que se lee al exportar (fn sin argumentos)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, self.fn())]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    """Todas las métricas en formato de exposición de texto de Prometheus."""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, value in metric.samples():
+            lines.append(f"{name} {value:.6g}" if isinstance(value, float) else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Pone a cero contadores e histogramas (pruebas)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        with metric.lock:
+            if isinstance(metric, Counter):
+                metric.values.clear()
+            elif isinstance(metric, Histogram):
+                metric.series.clear()
+
+
+# --- Métricas del sistema ---
+
+HTTP_SECONDS = Histogram("tbfs_http_request_duration_seconds",
+                         "Latencia de las peticiones HTTP hasta el inicio de la respuesta",
+                         ("method", "route", "status"))
+MANAGER_SECONDS = Histogram("tbfs_manager_operation_duration_seconds",
+                            "Duración de las operaciones de core.manager", ("operation",))
+SQL_SECONDS = Histogram("tbfs_sql_statement_duration_seconds",
+                        "Duración de execute/executemany por tipo de sentencia (sin recorrer filas)",
+                        ("statement",))
+STORAGE_READ_BYTES = Counter("tbfs_storage_read_bytes_total", "Bytes leídos de storage/", ("path",))
+STORAGE_WRITTEN_BYTES = Counter("tbfs_storage_written_bytes_total", "Bytes escritos en storage/", ("path",))
+DB_CONNECTIONS_OPENED = Counter("tbfs_db_connections_opened_total", "Conexiones SQLite abiertas")
+
+
+def timed(operation: str):
+    """Decorador: registra la duración de cada llamada en MANAGER_SECONDS."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                MANAGER_SECONDS.observe(time.perf_counter() - start, operation)
+        return wrapper
+    return decorator
+
+
+_VERB = re.compile(r"^\s*(\w+)")
+_TABLE = re.compile(r"\b(?:INTO|FROM|UPDATE|TABLE|TRIGGER|INDEX)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(?:temp\.)?(\w+)",
+                    re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=4096)
+def statement_label(sql: str) -> str:
+    """Etiqueta acotada de una sentencia: verbo y primera tabla ("SELECT files", "INSERT file_tags")."""
+    verb = _VERB.match(sql)
+    if not verb:
+        return "OTHER"
+    table = _TABLE.search(sql)
+    return f"{verb.group(1).upper()} {table.group(1)}" if table else verb.group(1).upper()
@@ -0,0 +1,150 @@
+# core/packs.py
+"""
+Packs: ficheros grandes (storage/packs/000001.pack, ...) en los que se
+concatenan los blobs pequeños, para no gastar un inodo, una entrada de
+directorio y un open()/close() por cada uno.
+
+Con TBFS_PACK_THRESHOLD=N (bytes; 0, por defecto, lo desactiva) los contenidos
+de menos de N bytes se añaden al final del pack abierto, y la tabla blobs
+guarda dónde quedaron: path (el pack), pack_offset y pack_length (bytes
+guardados, comprimidos si el blob lo está). Cuando el pack abierto llega a
+TBFS_PACK_BYTES se cierra para siempre y se abre el siguiente: sólo se escribe
+en el último, así que los demás no cambian.
+
+Los blobs borrados dejan sus bytes en el pack; manager.compact_packs copia los
+vivos de los packs cerrados con al menos TBFS_PACK_COMPACT_RATIO de espacio
+muerto al pack abierto y borra el viejo (el servidor lo hace cada
+TBFS_PACK_COMPACT_INTERVAL segundos).
+
+Las lecturas van por posición (os.pread, o sendfile con offset) sobre un único
+descriptor por pack, abierto la primera vez y compartido entre hilos.
+Igual que el resto de core.manager, supone un único proceso escritor.
+"""
+import io
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+THRESHOLD = int(os.getenv("TBFS_PACK_THRESHOLD", "0"))
+PACK_BYTES = int(os.getenv("TBFS_PACK_BYTES", str(256 * 1024 * 1024)))
+COMPACT_RATIO = float(os.getenv("TBFS_PACK_COMPACT_RATIO", "0.5"))
+COMPACT_INTERVAL = float(os.getenv("TBFS_PACK_COMPACT_INTERVAL", "600"))
+
+PACK_DIR = "packs"
+_PACK_NAME = re.compile(r"^(\d+)\.pack$")
+
+_lock = threading.Lock()
+# storage_dir -> (ruta, descriptor) del pack abierto para añadir
+_writers: Dict[str, Tuple[str, int]] = {}
+# ruta del pack -> fichero abierto para leer (se cierra solo cuando nadie lo usa)
+_readers: Dict[str, io.FileIO] = {}
+
+
+def pack_files(storage_dir: str) -> List[str]:
+    """Rutas de los packs de storage_dir, del más antiguo al abierto (el último)."""
+    directory = os.path.join(storage_dir, PACK_DIR)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    numbered = []
+    for name in names:
+        match = _PACK_NAME.match(name)
+        if match:
+            numbered.append((int(match.group(1)), name))
+    return [os.path.join(directory, name) for _, name in sorted(numbered)]
+
+
+def sealed_packs(storage_dir: str) -> List[str]:
+    """Packs cerrados: todos menos el último, que es el único en el que se escribe."""
+    return pack_files(storage_dir)[:-1]
+
+
+def _number(path: str) -> int:
+    return int(_PACK_NAME.match(os.path.basename(path)).group(1))
+
+
+def _open_writer(storage_dir: str, number: int = 1) -> Tuple[str, int]:
+    """Abre para añadir el pack number, o el último que exista si es posterior."""
+    directory = os.path.join(storage_dir, PACK_DIR)
+    os.makedirs(directory, exist_ok=True)
+    existing = pack_files(storage_dir)
+    if existing:
+        number = max(number, _number(existing[-1]))
+    path = os.path.join(directory, f"{number:06d}.pack")
+    return path, os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+
+def append(storage_dir: str, data: bytes) -> Tuple[str, int]:
+    """Añade data al final del pack abierto. Devuelve (ruta del pack, posición)."""
+    with _lock:
+        path, fd = _writers.get(storage_dir) or _open_writer(storage_dir)
+        st = os.fstat(fd)
+        if not st.st_nlink or st.st_size >= PACK_BYTES:
+            # Lleno (queda cerrado para siempre) o borrado por fuera (reset_db)
+            os.close(fd)
+            path, fd = _open_writer(storage_dir, _number(path) + 1 if st.st_nlink else 1)
+            st = os.fstat(fd)
+        _writers[storage_dir] = (path, fd)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        return path, st.st_size
+
+
+def reader(path: str) -> io.FileIO:
+    """
+    El pack abierto para leer por posición (os.pread sobre fileno()). Es
+    compartido: no hay que cerrarlo ni moverlo con seek.
+    """
+    f = _readers.get(path)
+    if f is None:
+        with _lock:
+            f = _readers.get(path)
+            if f is None:
+                f = _readers[path] = open(path, "rb", buffering=0)
+    return f
+
+
+class _Slice(io.RawIOBase):
+    """Vista de sólo lectura de length bytes de un pack a partir de offset."""
+
+    def __init__(self, path: str, offset: int, length: int):
+        super().__init__()
+        self._pack = reader(path)
+        self._pos = offset
+        self._end = offset + length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self._end - self._pos)
+        if n <= 0:
+            return 0
+        data = os.pread(self._pack.fileno(), n, self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def open_slice(path: str, offset: int, length: int, buffer_size: int = io.DEFAULT_BUFFER_SIZE):
+    """Fichero de sólo lectura con el contenido guardado de un blob dentro de un pack."""
+    return io.BufferedReader(_Slice(path, offset, length), buffer_size)
+
+
+def remove(path: str) -> None:
+    """Borra un pack cerrado (las lecturas que ya lo tenían abierto terminan bien)."""
+    with _lock:
+        _readers.pop(path, None)
+    os.remove(path)
+
+
+def close() -> None:
+    """Olvida los packs abiertos (p. ej. después de vaciar storage/)."""
+    with _lock:
+        for _, fd in _writers.values():
+            os.close(fd)
+        _writers.clear()
+        _readers.clear()
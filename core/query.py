@@ -0,0 +1,241 @@
+# core/query.py
+"""
+Lenguaje de consulta de etiquetas: AND, OR, NOT y paréntesis.
+
+    (photo OR video) AND 2024 AND NOT draft
+
+Dos etiquetas seguidas (o separadas por coma) equivalen a AND, así que
+"tag1 tag2" y "tag1,tag2" siguen significando lo mismo que antes.
+Precedencia: NOT > AND > OR. Los operadores no distinguen mayúsculas; una
+etiqueta que se llame igual que un operador se escribe entre comillas ("and").
+
+El árbol sintáctico son tuplas:
+    ("tag", nombre) | ("and", [hijos]) | ("or", [hijos]) | ("not", hijo)
+
+plan() lo convierte en un plan con la cardinalidad estimada de cada nodo
+(tuplas de tres elementos: tipo, contenido, estimación) y ordena los hijos
+de cada AND de más a menos selectivo; execute() lo evalúa restringiendo cada
+paso a los candidatos que quedan del anterior.
+"""
+from typing import Callable, List, Optional, Set
+
+
+class QuerySyntaxError(ValueError):
+    """Error de sintaxis en una expresión de etiquetas."""
+
+
+_KEYWORDS = {"and", "or", "not"}
+
+
+def tokenize(text: str) -> List[tuple]:
+    """
+    Divide la expresión en tokens (tipo, valor): "(", ")", "and", "or", "not" o "tag".
+    La coma se trata como AND.
+    """
+    tokens = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch.isspace():
+            i += 1
+        elif ch in "()":
+            tokens.append((ch, ch))
+            i += 1
+        elif ch == ",":
+            tokens.append(("and", ","))
+            i += 1
+        elif ch == '"':
+            end = text.find('"', i + 1)
+            if end == -1:
+                raise QuerySyntaxError(f"Comilla sin cerrar en la posición {i}")
+            if end == i + 1:
+                raise QuerySyntaxError(f"Etiqueta vacía en la posición {i}")
+            tokens.append(("tag", text[i + 1:end]))
+            i = end + 1
+        else:
+            start = i
+            while i < n and not text[i].isspace() and text[i] not in '(),"':
+                i += 1
+            word = text[start:i]
+            kind = word.lower() if word.lower() in _KEYWORDS else "tag"
+            tokens.append((kind, word))
+    return tokens
+
+
+def parse(text: str):
+    """
+    Convierte la expresión en un árbol. Devuelve None si la expresión está vacía
+    (equivale a "todos los ficheros").
+    """
+    tokens = tokenize(text or "")
+    if not tokens:
+        return None
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(kind):
+        nonlocal pos
+        if peek() != kind:
+            found = tokens[pos][1] if pos < len(tokens) else "fin de la expresión"
+            raise QuerySyntaxError(f"Se esperaba '{kind}' y se encontró '{found}'")
+        pos += 1
+        return tokens[pos - 1][1]
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == "or":
+            take("or")
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def parse_and():
+        children = [parse_not()]
+        while peek() in ("and", "not", "tag", "("):
+            if peek() == "and":
+                take("and")
+            children.append(parse_not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def parse_not():
+        if peek() == "not":
+            take("not")
+            return ("not", parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        if peek() == "(":
+            take("(")
+            node = parse_or()
+            take(")")
+            return node
+        return ("tag", take("tag"))
+
+    node = parse_or()
+    if pos != len(tokens):
+        raise QuerySyntaxError(f"Token inesperado '{tokens[pos][1]}'")
+    return _flatten(node)
+
+
+def _flatten(node):
+    """Aplana AND/OR anidados del mismo tipo: a AND (b AND c) -> AND(a, b, c)."""
+    kind = node[0]
+    if kind == "tag":
+        return node
+    if kind == "not":
+        return ("not", _flatten(node[1]))
+    children = []
+    for child in node[1]:
+        child = _flatten(child)
+        if child[0] == kind:
+            children.extend(child[1])
+        else:
+            children.append(child)
+    return (kind, children)
+
+
+def tags_in(node) -> Set[str]:
+    """Etiquetas que aparecen en el árbol."""
+    if node is None:
+        return set()
+    if node[0] == "tag":
+        return {node[1]}
+    if node[0] == "not":
+        return tags_in(node[1])
+    out = set()
+    for child in node[1]:
+        out |= tags_in(child)
+    return out
+
+
+def plan(node, cardinality: Callable[[str], int], total: int, naive: bool = False):
+    """
+    Anota cada nodo con su cardinalidad estimada (suponiendo independencia entre
+    etiquetas) y ordena los hijos de cada AND: primero las condiciones positivas
+    de menor cardinalidad, que son las que dirigen la evaluación, y al final los NOT,
+    que se aplican como filtros sobre los candidatos.
+    Con naive=True se respeta el orden escrito (evaluación de izquierda a derecha).
+    """
+    total = max(total, 1)
+    kind = node[0]
+    if kind == "tag":
+        return ("tag", node[1], min(cardinality(node[1]), total))
+    if kind == "not":
+        child = plan(node[1], cardinality, total, naive)
+        return ("not", child, total - child[2])
+
+    children = [plan(c, cardinality, total, naive) for c in node[1]]
+    if kind == "and":
+        if not naive:
+            children.sort(key=lambda c: (c[0] == "not", c[2]))
+        est = float(total)
+        for c in children:
+            est *= c[2] / total
+        return ("and", children, int(est))
+
+    if not naive:
+        children.sort(key=lambda c: -c[2])
+    miss = 1.0
+    for c in children:
+        miss *= 1 - c[2] / total
+    return ("or", children, int(total * (1 - miss)))
+
+
+def execute(planned, postings: Callable[[str, Optional[Set[int]]], Set[int]],
+            universe: Callable[[Optional[Set[int]]], Set[int]]) -> List[int]:
+    """
+    Evalúa un plan y devuelve los ids ordenados.
+    - postings(tag, candidatos): ids con la etiqueta (restringidos a candidatos si no es None).
+    - universe(candidatos): todos los ids (o los candidatos) para resolver NOT.
+    """
+    return sorted(_evaluate(planned, None, postings, universe))
+
+
+def _evaluate(node, candidates, postings, universe) -> Set[int]:
+    kind = node[0]
+    if kind == "tag":
+        if node[2] == 0:
+            return set()
+        return postings(node[1], candidates)
+
+    if kind == "not":
+        base = universe(candidates)
+        if not base:
+            return base
+        return base - _evaluate(node[1], base, postings, universe)
+
+    if kind == "or":
+        result = set()
+        for child in node[1]:
+            result |= _evaluate(child, candidates, postings, universe)
+        return result
+
+    positives = [c for c in node[1] if c[0] != "not"]
+    negatives = [c for c in node[1] if c[0] == "not"]
+    if positives:
+        result = _evaluate(positives[0], candidates, postings, universe)
+        for child in positives[1:]:
+            if not result:
+                return result
+            result = _evaluate(child, result, postings, universe)
+    else:
+        result = universe(candidates)
+    for child in negatives:
+        if not result:
+            break
+        result = result - _evaluate(child[1], result, postings, universe)
+    return result
+
+
+def explain(planned, indent: int = 0) -> str:
+    """Representación legible del plan, con la estimación de cada nodo."""
+    pad = "  " * indent
+    kind = planned[0]
+    if kind == "tag":
+        return f"{pad}TAG {planned[1]} (~{planned[2]})"
+    if kind == "not":
+        return f"{pad}NOT (~{planned[2]})\n" + explain(planned[1], indent + 1)
+    lines = [f"{pad}{kind.upper()} (~{planned[2]})"]
+    lines.extend(explain(c, indent + 1) for c in planned[1])
+    return "\n".join(lines)
@@ -0,0 +1,366 @@
+# core/replication.py
+"""
+Replicación líder/seguidores.
+
+- Líder (TBFS_ROLE=leader): los triggers de database.enable_changelog escriben
+  cada cambio de files, tags, file_tags y blobs en la tabla changelog. Los
+  seguidores la leen por HTTP (/replication/changes) junto con los blobs nuevos
+  (/replication/blobs/{hash}); un seguidor nuevo (o demasiado atrasado) parte
+  de una copia completa de la base de datos (/replication/snapshot).
+- Seguidor (TBFS_ROLE=follower, TBFS_LEADER_URL): un hilo (Follower) consulta
+  el líder cada POLL_INTERVAL segundos y aplica los cambios en una
+  transacción por lote. Sirve lecturas; las escrituras, y las lecturas si lleva
+  más de MAX_STALENESS segundos sin ponerse al día, se redirigen al líder
+  (ver server/api.py).
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import requests
+
+from core import cache
+from core import database
+from core import index
+from core import storage
+from core.database import get_connection, close_connection
+from core.log import get_logger
+
+logger = get_logger("replication")
+
+ROLE = os.getenv("TBFS_ROLE", "standalone")  # standalone | leader | follower
+LEADER_URL = os.getenv("TBFS_LEADER_URL", "").rstrip("/")
+
+# Seguidor: frecuencia de consulta, cambios por petición y antigüedad máxima
+# (segundos desde la última vez que estuvo al día) para seguir sirviendo lecturas
+POLL_INTERVAL = float(os.getenv("TBFS_REPLICATION_POLL", "0.2"))
+BATCH = int(os.getenv("TBFS_REPLICATION_BATCH", "5000"))
+MAX_STALENESS = float(os.getenv("TBFS_MAX_STALENESS", "5"))
+
+# Líder: cambios que se conservan en changelog (un seguidor más atrasado
+# vuelve a empezar desde una copia completa)
+CHANGELOG_KEEP = int(os.getenv("TBFS_CHANGELOG_KEEP", "1000000"))
+
+BLOB_CHUNK = 1024 * 1024
+
+
+class ResyncNeeded(Exception):
+    """El líder ya no conserva los cambios que el seguidor necesita."""
+
+
+# --- Líder ---
+
+def changes_after(after: int, limit: int = BATCH, db_path: str = "database/db.db") -> dict:
+    """
+    Cambios con seq > after (como mucho limit), y el primer y último seq del registro.
+    Si after es anterior al primero conservado, el seguidor debe volver a copiar todo.
+    """
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("SELECT seq, tbl, op, data FROM changelog WHERE seq > ? ORDER BY seq LIMIT ?", (after, limit))
+        changes = [(seq, tbl, op, json.loads(data)) for seq, tbl, op, data in cursor.fetchall()]
+        cursor.execute("SELECT COALESCE(MIN(seq), 0), COALESCE(MAX(seq), 0) FROM changelog")
+        first, head = cursor.fetchone()
+        # Un registro vacío conserva su contador en sqlite_sequence
+        if head == 0:
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'")
+            row = cursor.fetchone()
+            head = first = row[0] if row else 0
+    finally:
+        close_connection(conn)
+    return {"changes": changes, "first": first, "head": head}
+
+
+def prune_changelog(keep: int = CHANGELOG_KEEP, db_path: str = "database/db.db") -> int:
+    """Borra los cambios más antiguos dejando los keep últimos. Devuelve cuántos borró."""
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("DELETE FROM changelog WHERE seq <= (SELECT MAX(seq) FROM changelog) - ?", (keep,))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        close_connection(conn)
+
+
+def snapshot(db_path: str = "database/db.db") -> str:
+    """
+    Copia consistente de la base de datos en un fichero temporal (API de backup
+    de SQLite, sin bloquear a los escritores más que por páginas). Devuelve su ruta.
+    """
+    fd, path = tempfile.mkstemp(prefix="tbfs_snapshot_", suffix=".db")
+    os.close(fd)
+    conn, _ = get_connection(db_path)
+    dst = sqlite3.connect(path)
+    try:
+        conn.backup(dst, pages=1024)
+    finally:
+        dst.close()
+        close_connection(conn)
+    return path
+
+
+def blob_file(digest: str, db_path: str = "database/db.db") -> Optional[Tuple[str, str, Optional[int], Optional[int]]]:
+    """(ruta, codec, offset, length) del blob si está registrado (offset: posición en su pack)."""
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("SELECT path, codec, pack_offset, pack_length FROM blobs WHERE hash = ?", (digest,))
+        row = cursor.fetchone()
+    finally:
+        close_connection(conn)
+    return tuple(row) if row else None
+
+
+# --- Seguidor ---
+
+def last_applied(db_path: str = "database/db.db") -> int:
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("SELECT value FROM replication_state WHERE key = 'last_seq'")
+        row = cursor.fetchone()
+    finally:
+        close_connection(conn)
+    return row[0] if row else 0
+
+
+def apply_changes(changes: List[tuple], storage_dir: str, fetch_blob: Callable[[str, str], bool],
+                  db_path: str = "database/db.db") -> Tuple[int, set]:
+    """
+    Aplica en una transacción una lista de cambios (seq, tbl, op, data) del líder.
+    - fetch_blob(hash, storage_dir): trae el contenido de un blob que no está en
+      local (devuelve False si el líder ya no lo tiene).
+    Las rutas de los blobs se reescriben para el storage_dir local.
+    Devuelve (último seq aplicado, etiquetas afectadas).
+    """
+    if not changes:
+        return last_applied(db_path), set()
+
+    # Contenido antes que metadatos: ningún fichero visible sin su blob
+    for _, tbl, op, data in changes:
+        if tbl == "blobs" and op != "delete" and not os.path.exists(storage.blob_path(storage_dir, data["hash"])):
+            if not fetch_blob(data["hash"], storage_dir):
+                logger.warning(f"El líder ya no tiene el blob {data['hash']}; se omite su contenido.")
+
+    removed_blobs, tag_ids, tag_names = [], set(), set()
+    conn, cursor = get_connection(db_path)
+    try:
+        for _, tbl, op, data in changes:
+            if tbl == "files":
+                if op == "delete":
+                    cursor.execute("DELETE FROM files WHERE id = ?", (data["id"],))
+                    continue
+                path = storage.blob_path(storage_dir, data["blob"]) if data["blob"] else data["path"]
+                cursor.execute("""
+                    INSERT INTO files (id, name, path, blob) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET name = excluded.name, path = excluded.path, blob = excluded.blob
+                """, (data["id"], data["name"], path, data["blob"]))
+            elif tbl == "tags":
+                tag_names.add(data["tag"])
+                if op == "delete":
+                    cursor.execute("DELETE FROM tags WHERE id = ?", (data["id"],))
+                else:
+                    cursor.execute("INSERT OR IGNORE INTO tags (id, tag) VALUES (?, ?)", (data["id"], data["tag"]))
+            elif tbl == "file_tags":
+                tag_ids.add(data["tag_id"])
+                if op == "delete":
+                    cursor.execute("DELETE FROM file_tags WHERE file_id = ? AND tag_id = ?",
+                                   (data["file_id"], data["tag_id"]))
+                else:
+                    cursor.execute("INSERT OR IGNORE INTO file_tags (file_id, tag_id) VALUES (?, ?)",
+                                   (data["file_id"], data["tag_id"]))
+            elif tbl == "blobs":
+                if op == "delete":
+                    cursor.execute("DELETE FROM blobs WHERE hash = ?", (data["hash"],))
+                    removed_blobs.append(data["hash"])
+                else:
+                    cursor.execute("""
+                        INSERT INTO blobs (hash, path, size, refcount) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(hash) DO UPDATE SET refcount = excluded.refcount
+                    """, (data["hash"], storage.blob_path(storage_dir, data["hash"]), data["size"], data["refcount"]))
+        seq = changes[-1][0]
+        cursor.execute("""
+            INSERT INTO replication_state (key, value) VALUES ('last_seq', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (seq,))
+        if tag_ids:
+            cursor.execute("SELECT tag FROM tags WHERE id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(sorted(tag_ids)),))
+            tag_names.update(r[0] for r in cursor.fetchall())
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        close_connection(conn)
+
+    for digest in removed_blobs:
+        storage.remove_quietly(storage.blob_path(storage_dir, digest))
+    return seq, tag_names
+
+
+def restore_snapshot(path: str, db_path: str = "database/db.db") -> None:
+    """Sustituye el contenido de la base de datos local por el de una copia del líder."""
+    src = sqlite3.connect(path)
+    conn, cursor = get_connection(db_path)
+    try:
+        src.backup(conn)
+        # El registro del líder no sirve aquí; el seguidor continúa desde su último seq
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM changelog")
+        head = cursor.fetchone()[0]
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changelog'")
+        row = cursor.fetchone()
+        head = max(head, row[0] if row else 0)
+        cursor.execute("DELETE FROM changelog")
+        cursor.execute("""
+            INSERT INTO replication_state (key, value) VALUES ('last_seq', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (head,))
+        conn.commit()
+    finally:
+        close_connection(conn)
+        src.close()
+    database.disable_changelog(db_path)
+    index.drop_index(db_path)
+    cache.clear()
+
+
+class Follower:
+    """Hilo que mantiene la base de datos y los blobs locales al día con el líder."""
+
+    def __init__(self, leader_url: str, storage_dir: str, db_path: str = "database/db.db",
+                 poll_interval: float = POLL_INTERVAL):
+        self.leader_url = leader_url.rstrip("/")
+        self.storage_dir = storage_dir
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.session = requests.Session()
+        self.synced_at = 0.0   # momento de la última consulta que alcanzó la cabeza del líder
+        self.leader_head = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- estado ---
+
+    def lag_seconds(self) -> float:
+        return time.monotonic() - self.synced_at if self.synced_at else float("inf")
+
+    def is_stale(self, max_staleness: float = MAX_STALENESS) -> bool:
+        return self.lag_seconds() > max_staleness
+
+    def status(self) -> dict:
+        applied = last_applied(self.db_path)
+        return {"role": "follower", "leader": self.leader_url, "applied": applied,
+                "leader_head": self.leader_head, "behind": max(self.leader_head - applied, 0),
+                "lag_seconds": None if not self.synced_at else round(self.lag_seconds(), 3),
+                "stale": self.is_stale()}
+
+    # --- sincronización ---
+
+    def fetch_blob(self, digest: str, storage_dir: str) -> bool:
+        with self.session.get(f"{self.leader_url}/replication/blobs/{digest}", stream=True, timeout=60) as r:
+            if r.status_code == 404:
+                return False
+            r.raise_for_status()
+            # Los seguidores guardan cada blob en su fichero y sin comprimir
+            # (blobs.codec y la posición en los packs no se replican)
+            writer = storage.BlobWriter(storage_dir, codec=storage.IDENTITY, pack=False)
+            try:
+                for chunk in r.iter_content(BLOB_CHUNK):
+                    writer.write(chunk)
+            except BaseException:
+                writer.abort()
+                raise
+        stored = writer.commit().digest
+        if stored != digest:
+            storage.remove_quietly(storage.blob_path(storage_dir, stored))
+            raise ValueError(f"blob {digest} recibido con hash {stored}")
+        return True
+
+    def bootstrap(self) -> None:
+        """Copia completa de la base de datos del líder y de los blobs que falten."""
+        fd, path = tempfile.mkstemp(prefix="tbfs_snapshot_", suffix=".db")
+        os.close(fd)
+        try:
+            with self.session.get(f"{self.leader_url}/replication/snapshot", stream=True, timeout=600) as r:
+                r.raise_for_status()
+                with open(path, "wb") as f:
+                    for chunk in r.iter_content(BLOB_CHUNK):
+                        f.write(chunk)
+            restore_snapshot(path, self.db_path)
+        finally:
+            storage.remove_quietly(path)
+
+        conn, cursor = get_connection(self.db_path)
+        try:
+            cursor.execute("SELECT hash FROM blobs")
+            digests = [r[0] for r in cursor.fetchall()]
+            # Rutas del líder -> rutas locales (sin comprimir ni packs, como los guarda fetch_blob)
+            cursor.executemany("""
+                UPDATE blobs SET path = ?, codec = 'identity', pack_offset = NULL, pack_length = NULL WHERE hash = ?
+            """, [(storage.blob_path(self.storage_dir, d), d) for d in digests])
+            cursor.executemany("UPDATE files SET path = ? WHERE blob = ?",
+                               [(storage.blob_path(self.storage_dir, d), d) for d in digests])
+            conn.commit()
+        finally:
+            close_connection(conn)
+        for digest in digests:
+            if not os.path.exists(storage.blob_path(self.storage_dir, digest)):
+                self.fetch_blob(digest, self.storage_dir)
+        logger.info(f"Seguidor inicializado desde el líder (seq {last_applied(self.db_path)}, {len(digests)} blobs)")
+
+    def sync_once(self) -> int:
+        """Aplica los cambios pendientes (en lotes). Devuelve cuántos aplicó."""
+        applied = 0
+        after = last_applied(self.db_path)
+        while True:
+            # Lo aplicado está al día al menos hasta el momento de la petición
+            asked_at = time.monotonic()
+            r = self.session.get(f"{self.leader_url}/replication/changes",
+                                 params={"after": after, "limit": BATCH}, timeout=60)
+            r.raise_for_status()
+            page = r.json()
+            self.leader_head = page["head"]
+            if after < page["first"] - 1 or after > page["head"]:
+                raise ResyncNeeded(f"seq {after} fuera del registro del líder ({page['first']}..{page['head']})")
+            changes = page["changes"]
+            if changes:
+                after, tags = apply_changes(changes, self.storage_dir, self.fetch_blob, self.db_path)
+                applied += len(changes)
+                cache.invalidate(self.db_path, tags)
+                index.drop_index(self.db_path)
+            if after >= page["head"]:
+                self.synced_at = asked_at
+                return applied
+
+    def run(self) -> None:
+        if last_applied(self.db_path) == 0:
+            self._retrying(self.bootstrap)
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except ResyncNeeded as e:
+                logger.warning(f"{e}; se vuelve a copiar la base de datos del líder.")
+                self._retrying(self.bootstrap)
+            except (requests.RequestException, ValueError, sqlite3.Error) as e:
+                logger.warning(f"Replicación: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _retrying(self, fn) -> None:
+        while not self._stop.is_set():
+            try:
+                return fn()
+            except (requests.RequestException, ValueError, sqlite3.Error) as e:
+                logger.warning(f"Replicación: {e}; reintento en 1s")
+                self._stop.wait(1)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name="tbfs-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,98 @@
+# core/sharding.py
+"""
+Reparto de ficheros entre varios nodos (modo shard, ver server/coordinator.py).
+
+- HashRing: hashing consistente del nombre del fichero. El nombre es la clave
+  con la que se sube, descarga y comprueba la unicidad, así que cualquier
+  coordinador sabe a qué nodo ir sin guardar un directorio aparte. Al añadir
+  un nodo sólo cambia de dueño ~1/N de los nombres.
+- Cursor compuesto de /list: el último id devuelto de cada nodo, para paginar
+  la mezcla de los listados de todos los nodos sin repetir ni saltar filas.
+"""
+import bisect
+import hashlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Puntos de cada nodo en el anillo (más puntos = reparto más uniforme)
+REPLICAS = 64
+
+# Marca de nodo agotado dentro del cursor compuesto
+EXHAUSTED = "x"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Anillo de hashing consistente sobre una lista de nodos (p. ej. URLs)."""
+
+    def __init__(self, nodes: Sequence[str], replicas: int = REPLICAS):
+        if not nodes:
+            raise ValueError("HashRing necesita al menos un nodo")
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._keys = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        """Nodo dueño de key: el primer punto del anillo a partir de su hash."""
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[i]
+
+    def group(self, keys) -> Dict[str, List]:
+        """{nodo: [claves]} para repartir un lote."""
+        out = {}
+        for key in keys:
+            out.setdefault(self.node_for(key), []).append(key)
+        return out
+
+
+def decode_cursor(token, shards: int) -> List[Optional[int]]:
+    """
+    Cursor compuesto -> último id de cada nodo (None = nodo agotado).
+    "0" o vacío es el principio de todos los nodos. Lanza ValueError si no es válido.
+    """
+    token = str(token or "0")
+    if token == "0":
+        return [0] * shards
+    parts = token.split("-")
+    if len(parts) != shards:
+        raise ValueError("el cursor no corresponde a este número de nodos")
+    return [None if p == EXHAUSTED else int(p) for p in parts]
+
+
+def encode_cursor(cursors: List[Optional[int]]) -> Optional[str]:
+    """Inverso de decode_cursor; None si todos los nodos están agotados."""
+    if all(c is None for c in cursors):
+        return None
+    return "-".join(EXHAUSTED if c is None else str(c) for c in cursors)
+
+
+def merge_pages(pages: List[Optional[Tuple[List[dict], Optional[int]]]], cursors: List[Optional[int]],
+                limit: int) -> Tuple[List[Tuple[int, dict]], Optional[str]]:
+    """
+    Mezcla una página de cada nodo en orden (id, nodo) y se queda con las limit primeras.
+    - pages[i]: (filas, next_cursor) del nodo i, o None si no se consultó (agotado).
+      Cada fila es un dict con "id".
+    - cursors: cursores con los que se pidió cada página.
+    Devuelve ([(nodo, fila)], cursor compuesto de la página siguiente).
+    """
+    merged = sorted(
+        ((row["id"], shard, row) for shard, page in enumerate(pages) if page for row in page[0]),
+        key=lambda item: (item[0], item[1]),
+    )
+    taken = merged[:limit]
+    new_cursors = list(cursors)
+    used = {}
+    for file_id, shard, _ in taken:
+        new_cursors[shard] = file_id
+        used[shard] = used.get(shard, 0) + 1
+    for shard, page in enumerate(pages):
+        if page is None:
+            continue
+        rows, next_cursor = page
+        # Nodo agotado: ya no tiene más páginas y se han entregado todas sus filas
+        if next_cursor is None and used.get(shard, 0) == len(rows):
+            new_cursors[shard] = None
+    return [(shard, row) for _, shard, row in taken], encode_cursor(new_cursors)
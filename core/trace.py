@@ -0,0 +1,114 @@
+# core/trace.py
+"""
+Trazas de las consultas por etiquetas (manager.query_files) y registro de
+consultas lentas.
+
+TBFS_SLOW_QUERY_MS=N lo activa: cada consulta que tarde N ms o más (0 = todas)
+se escribe como una línea JSON en TBFS_SLOW_LOG, que rota al llegar a
+TBFS_SLOW_LOG_BYTES y conserva TBFS_SLOW_LOG_BACKUPS copias. Cada traza lleva:
+- query: la consulta normalizada (etiquetas sin repetir y ordenadas, con AND);
+- plan: EXPLAIN QUERY PLAN de la sentencia (con el motor "index", la
+  intersección en memoria y la lectura de las filas por id);
+- rows_scanned: entradas de file_tags de esas etiquetas (según tag_counts);
+  rows_returned: ficheros devueltos;
+- sql_ms / aggregation_ms / serialization_ms: tiempo dentro de SQLite,
+  combinando las listas de cada etiqueta en Python (sólo el motor "index";
+  con "sql" el GROUP BY cuenta como SQL) y generando el JSON de /list.
+Sin la variable no se traza nada. manager.explain_query (GET /explain,
+main.py explain) devuelve el mismo desglose a demanda.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from typing import Dict, List
+
+from core.log import JsonFormatter
+
+SLOW_QUERY_MS = float(os.getenv("TBFS_SLOW_QUERY_MS", "-1"))
+ENABLED = SLOW_QUERY_MS >= 0
+SLOW_LOG = os.getenv("TBFS_SLOW_LOG", os.path.join("database", "slow_queries.log"))
+SLOW_LOG_BYTES = int(os.getenv("TBFS_SLOW_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_LOG_BACKUPS = int(os.getenv("TBFS_SLOW_LOG_BACKUPS", "3"))
+
+PHASES = ("sql", "aggregation", "serialization")
+
+_logger = logging.getLogger("tbfs.slow_queries")
+_logger.propagate = False
+_logger.setLevel(logging.INFO)
+_handler_path = None
+_lock = threading.Lock()
+
+
+def new_phases() -> Dict[str, float]:
+    """Acumuladores de tiempo (segundos) por fase."""
+    return dict.fromkeys(PHASES, 0.0)
+
+
+def normalize(query_tags: List[str]) -> str:
+    """Forma canónica de una consulta AND: "a AND b" (vacía = todos los ficheros)."""
+    return " AND ".join(sorted({t.strip() for t in query_tags if t.strip()}))
+
+
+def query_plan(cursor, sql: str, params=()) -> List[str]:
+    """Líneas de EXPLAIN QUERY PLAN, sangradas según el árbol del plan."""
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in cursor.fetchall():
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def serialization_seconds(rows) -> float:
+    """Tiempo en generar el JSON de estas filas como lo devuelve /list (id, name, tags)."""
+    start = time.perf_counter()
+    json.dumps({"files": [{"id": r[0], "name": r[1], "tags": r[2]} for r in rows]}, ensure_ascii=False)
+    return time.perf_counter() - start
+
+
+def report(query_tags: List[str], engine: str, plan: List[str], rows_scanned: int, rows_returned: int,
+           elapsed: float, phases: Dict[str, float]) -> dict:
+    """La traza de una consulta; los tiempos en ms."""
+    entry = {
+        "query": normalize(query_tags),
+        "engine": engine,
+        "plan": plan,
+        "rows_scanned": rows_scanned,
+        "rows_returned": rows_returned,
+        "total_ms": round((elapsed + phases["serialization"]) * 1000, 3),
+    }
+    for phase in PHASES:
+        entry[f"{phase}_ms"] = round(phases[phase] * 1000, 3)
+    return entry
+
+
+def is_slow(elapsed: float) -> bool:
+    return ENABLED and elapsed * 1000 >= SLOW_QUERY_MS
+
+
+def record(entry: dict) -> None:
+    """Añade la traza al registro de consultas lentas (SLOW_LOG, rotado)."""
+    global _handler_path
+    with _lock:
+        if _handler_path != SLOW_LOG:
+            close()
+            os.makedirs(os.path.dirname(SLOW_LOG) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(SLOW_LOG, maxBytes=SLOW_LOG_BYTES,
+                                                           backupCount=SLOW_LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(JsonFormatter())
+            _logger.addHandler(handler)
+            _handler_path = SLOW_LOG
+    _logger.info(f"Consulta lenta ({entry['total_ms']} ms): {entry['query'] or '(todo)'}", extra={"fields": entry})
+
+
+def close() -> None:
+    """Cierra el fichero del registro (se vuelve a abrir en el siguiente record)."""
+    global _handler_path
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+        handler.close()
+    _handler_path = None
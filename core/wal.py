@@ -0,0 +1,540 @@
+# core/wal.py
+"""
+Registro de cambios (write-ahead) de core.manager en segmentos binarios.
+
+Cada mutación de add_files/add_upload(s), delete_files, add_tags y
+delete_tags se añade al registro antes de confirmar su transacción. Las
+estructuras derivadas (p. ej. core/index.py) guardan el último seq aplicado y
+se ponen al día leyendo desde él, en lugar de recorrer toda la base de datos.
+
+Formato (todo little-endian):
+- Directorio <db>.changes/ con segmentos NNNNNNNNNNNNNNNNNNNN.seg (seq del
+  primer registro). Se pasa a un segmento nuevo al superar SEGMENT_BYTES.
+- Cabecera de segmento: "TBFSLOG1", flags (1 = compactado), base (uint64).
+- Registro: longitud (uint32), crc32 (uint32), seq (uint64), op (uint8) y la
+  carga: varints y cadenas (varint + UTF-8); los ids de ADD_TAGS y
+  DELETE_TAGS van ordenados y en diferencias.
+
+El seq del último registro se guarda en replication_state ('wal_seq') dentro
+de la misma transacción: al abrir el registro se descartan los registros de
+transacciones que no llegaron a confirmarse, y los lectores sólo ven hasta el
+último confirmado. La primera escritura con el registro desactivado borra
+wal_seq: al reactivarlo, el registro viejo se descarta.
+
+Compactación: los segmentos cerrados se sustituyen por uno compactado
+(compact-<base>.seg) con un ADD_FILE por fichero vivo, que lleva el estado
+hasta base. Un consumidor que empieza de cero lo lee entero; uno que se quedó
+dentro del tramo compactado recibe OffsetUnavailable y debe reconstruir. Un
+registro vacío sobre una base de datos con ficheros empieza igual: con un
+tramo compactado con el estado confirmado en ese momento.
+
+No es el registro de replicación (tabla changelog, core/replication.py): ese
+guarda filas de las tablas para copiarlas a los seguidores; éste, las
+operaciones de core.manager para mantener estructuras derivadas.
+"""
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from core.database import get_connection, close_connection, file_identity
+
+# TBFS_CHANGE_LOG=1 activa el registro para todas las bases de datos
+ENABLED = os.getenv("TBFS_CHANGE_LOG", "0") != "0"
+SEGMENT_BYTES = int(os.getenv("TBFS_CHANGE_LOG_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+# fsync tras cada escritura (si no, sólo flush: sobrevive a la caída del proceso, no a la del sistema)
+FSYNC = os.getenv("TBFS_CHANGE_LOG_FSYNC", "0") != "0"
+# Segmentos cerrados que disparan una compactación en segundo plano (0 = nunca)
+COMPACT_SEGMENTS = int(os.getenv("TBFS_CHANGE_LOG_COMPACT_SEGMENTS", "16"))
+
+ADD_FILE, DELETE_FILE, ADD_TAGS, DELETE_TAGS, CHECKPOINT = 1, 2, 3, 4, 5
+
+MAGIC = b"TBFSLOG1"
+SEGMENT_HEADER = struct.Struct("<8sBQ")
+RECORD_HEADER = struct.Struct("<IIQB")
+COMPACTED = 1
+
+
+class Change(NamedTuple):
+    """
+    Un registro. data según op:
+    - ADD_FILE / DELETE_FILE: (file_id, nombre, (etiquetas...))
+    - ADD_TAGS / DELETE_TAGS: (etiqueta, [file_ids ordenados])
+    - CHECKPOINT: None (marca el final del tramo compactado)
+    """
+    seq: int
+    op: int
+    data: object
+
+
+class OffsetUnavailable(Exception):
+    """El seq pedido ya no está en el registro (compactado o de otro registro)."""
+
+
+# --- codificación ---
+
+def _put_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _put_str(out: bytearray, s: str) -> None:
+    raw = s.encode("utf-8")
+    _put_varint(out, len(raw))
+    out += raw
+
+
+def _get_str(buf: bytes, pos: int) -> Tuple[str, int]:
+    n, pos = _get_varint(buf, pos)
+    return buf[pos:pos + n].decode("utf-8"), pos + n
+
+
+def encode(op: int, data) -> bytes:
+    out = bytearray()
+    if op in (ADD_FILE, DELETE_FILE):
+        file_id, name, tags = data
+        _put_varint(out, file_id)
+        _put_str(out, name)
+        _put_varint(out, len(tags))
+        for tag in tags:
+            _put_str(out, tag)
+    elif op in (ADD_TAGS, DELETE_TAGS):
+        tag, file_ids = data
+        _put_str(out, tag)
+        _put_varint(out, len(file_ids))
+        prev = 0
+        for fid in sorted(file_ids):
+            _put_varint(out, fid - prev)
+            prev = fid
+    return bytes(out)
+
+
+def decode(op: int, payload: bytes):
+    if op in (ADD_FILE, DELETE_FILE):
+        file_id, pos = _get_varint(payload, 0)
+        name, pos = _get_str(payload, pos)
+        count, pos = _get_varint(payload, pos)
+        tags = []
+        for _ in range(count):
+            tag, pos = _get_str(payload, pos)
+            tags.append(tag)
+        return file_id, name, tuple(tags)
+    if op in (ADD_TAGS, DELETE_TAGS):
+        tag, pos = _get_str(payload, 0)
+        count, pos = _get_varint(payload, pos)
+        file_ids, prev = [], 0
+        for _ in range(count):
+            delta, pos = _get_varint(payload, pos)
+            prev += delta
+            file_ids.append(prev)
+        return tag, file_ids
+    return None
+
+
+def _crc(seq: int, op: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(struct.pack("<QB", seq, op)))
+
+
+def _scan(path: str) -> Iterator[Tuple[int, int, int, bytes]]:
+    """(offset, seq, op, carga) de cada registro íntegro; se detiene en el primero roto."""
+    with open(path, "rb") as f:
+        f.seek(SEGMENT_HEADER.size)
+        offset = SEGMENT_HEADER.size
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, crc, seq, op = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or _crc(seq, op, payload) != crc:
+                return
+            yield offset, seq, op, payload
+            offset += RECORD_HEADER.size + length
+
+
+def _segment_header(path: str) -> Tuple[int, int]:
+    with open(path, "rb") as f:
+        magic, flags, base = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} no es un segmento del registro de cambios")
+    return flags, base
+
+
+# --- registro ---
+
+class ChangeLog:
+    """Registro de cambios en un directorio de segmentos."""
+
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES, fsync: bool = FSYNC,
+                 compact_segments: int = COMPACT_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.compact_segments = compact_segments
+        self.lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self.file_id = None  # identidad de la base de datos con la que se alineó (get_log)
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        names = os.listdir(self.directory)
+        compacted = sorted(n for n in names if n.startswith("compact-") and n.endswith(".seg"))
+        self.base = 0
+        self.compacted = None
+        if compacted:
+            # El último compactado manda; lo anterior a su base ya está dentro de él
+            self.compacted = os.path.join(self.directory, compacted[-1])
+            self.base = _segment_header(self.compacted)[1]
+            for name in compacted[:-1]:
+                os.remove(os.path.join(self.directory, name))
+        self.firsts, self.segments = [], []
+        for name in sorted(n for n in names if n.endswith(".seg") and not n.startswith("compact-")):
+            first = int(name[:-4])
+            if first <= self.base:
+                os.remove(os.path.join(self.directory, name))
+                continue
+            self.firsts.append(first)
+            self.segments.append(os.path.join(self.directory, name))
+        for name in names:
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+
+        self.head = self.base
+        self._file = None
+        if self.segments:
+            end = SEGMENT_HEADER.size
+            for offset, seq, op, payload in _scan(self.segments[-1]):
+                self.head = seq
+                end = offset + RECORD_HEADER.size + len(payload)
+            self._open_tail(end)
+        # Último seq confirmado en la base de datos (lo alinean get_log y commit)
+        self.committed = self.head
+
+    def _open_tail(self, end: int) -> None:
+        """Abre el último segmento para añadir, cortando un final roto (escritura a medias)."""
+        self._file = open(self.segments[-1], "r+b")
+        self._file.truncate(end)
+        self._file.seek(end)
+
+    def _roll(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        first = self.head + 1
+        path = os.path.join(self.directory, f"{first:020d}.seg")
+        self._file = open(path, "w+b")
+        self._file.write(SEGMENT_HEADER.pack(MAGIC, 0, 0))
+        self.firsts.append(first)
+        self.segments.append(path)
+        if self.compact_segments and len(self.segments) - 1 >= self.compact_segments \
+                and not self._compacting.locked():
+            threading.Thread(target=self.compact, name="tbfs-wal-compact", daemon=True).start()
+
+    def append(self, changes: Iterable[Tuple[int, object]]) -> Tuple[tuple, int]:
+        """
+        Añade [(op, data)] como registros consecutivos. Devuelve (marca, último seq);
+        la marca permite deshacerlo con truncate si la transacción no se confirma.
+        """
+        with self.lock:
+            if self._file is None or self._file.tell() >= self.segment_bytes:
+                self._roll()
+            mark = (self.segments[-1], self._file.tell(), self.head)
+            out = bytearray()
+            for op, data in changes:
+                self.head += 1
+                payload = encode(op, data)
+                out += RECORD_HEADER.pack(len(payload), _crc(self.head, op, payload), self.head, op)
+                out += payload
+            self._file.write(out)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            return mark, self.head
+
+    def truncate(self, mark: tuple) -> None:
+        """Deshace lo añadido desde mark (transacción que no se confirmó)."""
+        with self.lock:
+            segment, offset, head = mark
+            # Un lote nunca cruza segmentos: está entero en el que sigue abierto
+            if self.segments[-1] != segment:
+                return
+            self._file.truncate(offset)
+            self._file.seek(offset)
+            self.head = head
+
+    def truncate_after(self, seq: int) -> int:
+        """Descarta los registros con seq > seq (no confirmados en la base de datos). Devuelve cuántos."""
+        with self.lock:
+            if seq >= self.head:
+                return 0
+            dropped = self.head - seq
+            if seq < self.base:
+                self.reset()
+                return dropped
+            while self.segments and self.firsts[-1] > seq:
+                self._file.close()
+                os.remove(self.segments.pop())
+                self.firsts.pop()
+                self._file = None
+                if self.segments:
+                    self._open_tail(os.path.getsize(self.segments[-1]))
+            if self.segments:
+                end = SEGMENT_HEADER.size
+                for offset, rec_seq, _, payload in _scan(self.segments[-1]):
+                    if rec_seq > seq:
+                        break
+                    end = offset + RECORD_HEADER.size + len(payload)
+                self._file.truncate(end)
+                self._file.seek(end)
+            self.head = self.committed = seq
+            return dropped
+
+    def reset(self) -> None:
+        """Vacía el registro (no corresponde a la base de datos)."""
+        self.close()
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        self._load()
+
+    def read(self, after: int = 0) -> Iterator[Change]:
+        """
+        Registros confirmados con seq > after, en orden. after = 0 empieza por el
+        tramo compactado (si lo hay); un after dentro de él o posterior al último
+        confirmado lanza OffsetUnavailable.
+        """
+        with self.lock:
+            head, base, compacted = self.committed, self.base, self.compacted
+            firsts, segments = list(self.firsts), list(self.segments)
+            if self._file is not None:
+                self._file.flush()
+        if after > head or (0 < after < base):
+            raise OffsetUnavailable(f"seq {after} fuera del registro ({base}..{head})")
+        if after == 0 and compacted:
+            try:
+                for _, seq, op, payload in _scan(compacted):
+                    yield Change(seq, op, decode(op, payload))
+            except FileNotFoundError:
+                raise OffsetUnavailable("el tramo compactado cambió durante la lectura")
+            after = base
+        start = max(bisect_right(firsts, after) - 1, 0)
+        for path in segments[start:]:
+            try:
+                for _, seq, op, payload in _scan(path):
+                    if seq > head:
+                        return
+                    if seq > after:
+                        yield Change(seq, op, decode(op, payload))
+            except FileNotFoundError:
+                raise OffsetUnavailable(f"seq {after} compactado durante la lectura")
+
+    def size(self) -> int:
+        """Bytes ocupados por todos los segmentos."""
+        with self.lock:
+            paths = self.segments + ([self.compacted] if self.compacted else [])
+            return sum(os.path.getsize(p) for p in paths)
+
+    def compact(self) -> int:
+        """
+        Sustituye los segmentos cerrados (todos menos el abierto) por uno compactado.
+        Devuelve la nueva base (0 si no había nada que compactar).
+        """
+        with self._compacting:
+            with self.lock:
+                if len(self.segments) < 2:
+                    return 0
+                sealed = self.segments[:-1]
+                base = self.firsts[-1] - 1
+                previous = self.compacted
+
+            # Estado (fichero -> (nombre, etiquetas)) reproduciendo el tramo
+            files: Dict[int, Tuple[str, set]] = {}
+            sources = ([previous] if previous else []) + sealed
+            for path in sources:
+                for _, seq, op, payload in _scan(path):
+                    data = decode(op, payload)
+                    if op == ADD_FILE:
+                        files[data[0]] = (data[1], set(data[2]))
+                    elif op == DELETE_FILE:
+                        files.pop(data[0], None)
+                    elif op in (ADD_TAGS, DELETE_TAGS):
+                        tag, file_ids = data
+                        for fid in file_ids:
+                            entry = files.get(fid)
+                            if entry is None:
+                                continue
+                            if op == ADD_TAGS:
+                                entry[1].add(tag)
+                            else:
+                                entry[1].discard(tag)
+            path = self._write_compacted(base, files)
+
+            with self.lock:
+                self.compacted, self.base = path, base
+                del self.segments[:len(sealed)]
+                del self.firsts[:len(sealed)]
+            for old in sealed + ([previous] if previous else []):
+                os.remove(old)
+            return base
+
+    def _write_compacted(self, base: int, files: Dict[int, Tuple[str, Iterable[str]]]) -> str:
+        """
+        Escribe compact-<base>.seg con un ADD_FILE por fichero, en orden de id y con
+        seq consecutivos que terminan en base (cada fichero vivo tuvo su propio
+        ADD_FILE en el tramo, así que caben). Sin ficheros, sólo un CHECKPOINT en base.
+        """
+        path = os.path.join(self.directory, f"compact-{base:020d}.seg")
+        with open(path + ".tmp", "wb") as f:
+            f.write(SEGMENT_HEADER.pack(MAGIC, COMPACTED, base))
+            seq = base - len(files)
+            for fid in sorted(files):
+                seq += 1
+                name, tags = files[fid]
+                payload = encode(ADD_FILE, (fid, name, sorted(tags)))
+                f.write(RECORD_HEADER.pack(len(payload), _crc(seq, ADD_FILE, payload), seq, ADD_FILE))
+                f.write(payload)
+            if not files:
+                f.write(RECORD_HEADER.pack(0, _crc(base, CHECKPOINT, b""), base, CHECKPOINT))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return path
+
+    def seed(self, files: Dict[int, Tuple[str, Iterable[str]]]) -> None:
+        """
+        Empieza un registro vacío con el estado de files (id -> (nombre, etiquetas))
+        como tramo compactado, con seq 1..len(files).
+        """
+        with self.lock:
+            if self.head or not files:
+                return
+            self.compacted = self._write_compacted(len(files), files)
+            self.base = self.head = self.committed = len(files)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# --- registro de cada base de datos ---
+
+_logs: Dict[str, ChangeLog] = {}
+_logs_lock = threading.Lock()
+# Bases de datos (ruta -> identidad del fichero) en las que ya se borró wal_seq con el registro desactivado
+_unlogged: Dict[str, tuple] = {}
+
+
+def log_dir(db_path: str) -> str:
+    return os.path.abspath(db_path) + ".changes"
+
+
+def get_log(db_path: str = "database/db.db") -> Optional[ChangeLog]:
+    """
+    Registro de la base de datos (None si está desactivado), alineado con su wal_seq.
+    Si el fichero de la base de datos fue reemplazado, se vuelve a alinear.
+    """
+    if not ENABLED:
+        return None
+    key = os.path.abspath(db_path)
+    _unlogged.pop(key, None)
+    identity = file_identity(key)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = ChangeLog(log_dir(key), SEGMENT_BYTES, FSYNC, COMPACT_SEGMENTS)
+        if log.file_id != identity:
+            log.file_id = identity
+            seq = committed_seq(key)
+            if seq < log.base or (seq == 0 and log.head):
+                # El registro es de otra base de datos (o de una anterior a la copia de seguridad)
+                log.reset()
+            log.truncate_after(seq)
+        return log
+
+
+def close_logs() -> None:
+    """Cierra los registros abiertos (se reabren y realinean al volver a usarse)."""
+    with _logs_lock:
+        for log in _logs.values():
+            log.close()
+        _logs.clear()
+
+
+def committed_seq(db_path: str = "database/db.db") -> int:
+    """Último seq confirmado en la base de datos."""
+    conn, cursor = get_connection(db_path)
+    try:
+        cursor.execute("SELECT value FROM replication_state WHERE key = 'wal_seq'")
+        row = cursor.fetchone()
+    finally:
+        close_connection(conn)
+    return row[0] if row else 0
+
+
+def _catalogue(db_path: str) -> Dict[int, Tuple[str, List[str]]]:
+    """
+    Ficheros confirmados (id -> (nombre, etiquetas)), leídos con una conexión
+    aparte: no ve la transacción que el hilo tenga abierta.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, name, tags FROM files").fetchall()
+    finally:
+        conn.close()
+    return {fid: (name, tags.split(",") if tags else []) for fid, name, tags in rows}
+
+
+def commit(conn, cursor, db_path: str, changes: List[Tuple[int, object]]) -> Optional[Tuple[int, int]]:
+    """
+    Confirma la transacción de conn registrando antes changes [(op, data)].
+    Devuelve (primer seq, último seq) de los registros, o None si no se registró nada.
+    Si la confirmación falla, los registros se deshacen.
+    """
+    log = get_log(db_path)
+    if log is None:
+        # Sin registro, wal_seq deja de describir la base de datos: se borra una vez
+        key = os.path.abspath(db_path)
+        identity = file_identity(key)
+        if _unlogged.get(key) != identity:
+            cursor.execute("DELETE FROM replication_state WHERE key = 'wal_seq'")
+            conn.commit()
+            _unlogged[key] = identity
+        else:
+            conn.commit()
+        return None
+    if not changes:
+        conn.commit()
+        return None
+    with log.lock:
+        if not log.head:
+            # Primer registro: antes, el estado confirmado (ficheros de antes de activarlo)
+            log.seed(_catalogue(db_path))
+        mark, seq = log.append(changes)
+        try:
+            cursor.execute("""
+                INSERT INTO replication_state (key, value) VALUES ('wal_seq', ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (seq,))
+            conn.commit()
+        except BaseException:
+            log.truncate(mark)
+            raise
+        log.committed = seq
+        return mark[2] + 1, seq
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tarfile
 import requests
 import streamlit as st
 import pandas as pd
@@ -10,6 +12,16 @@ os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 print(f"Usando: {API_URL}")
 
+# Archivos por petición al subir (POST /add-batch)
+UPLOAD_BATCH = 200
+
+@st.cache_resource
+def get_session():
+    """Sesión HTTP compartida entre recargas: reutiliza las conexiones con el servidor."""
+    return requests.Session()
+
+session = get_session()
+
 st.set_page_config(page_title="Tag-based File System", layout="wide")
 st.markdown("---")
 st.title("📂 Tag-based File System")
@@ -20,23 +32,75 @@ if "modal" not in st.session_state:
 if "refresh_needed" not in st.session_state:
     st.session_state.refresh_needed = False  # fuerza recarga solo al confirmar una acción
 
+# --- Parámetros de paginación ---
+ITEMS_PER_PAGE = 5
+
 # --- Función para refrescar lista ---
-def refresh_list(tags=None):
+def refresh_list(tags=None, cursor=0):
+    """
+    Pide al servidor sólo la página visible (ITEMS_PER_PAGE archivos a partir
+    de cursor) y el total de coincidencias. Devuelve (archivos, siguiente cursor, total).
+    """
     try:
-        params = {}
+        params = {"cursor": cursor, "limit": ITEMS_PER_PAGE, "count": "true"}
         if tags:
-            params["tags"] = tags
-        response = requests.get(f"{API_URL}/list", params=params)
+            params["q"] = tags
+        response = session.get(f"{API_URL}/list", params=params)
+        if response.status_code == 400:
+            st.error(response.json().get("detail", "Consulta inválida"))
+            return [], None, 0
         response.raise_for_status()
         data = response.json()
-        return data.get("files", [])
+        return data.get("files", []), data.get("next_cursor"), data.get("total", 0)
     except requests.RequestException as e:
         st.error(f"No se pudo obtener la lista de archivos: {e}")
-        return []
+        return [], None, 0
+
+# --- Sugerencias de etiquetas (GET /tags, servido desde contadores) ---
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_tags(prefix=None, q=None, top=8):
+    """Etiquetas que empiezan por prefix y, si hay consulta, las que más aparecen con ella."""
+    try:
+        params = {"limit": top, "top": top}
+        if prefix:
+            params["prefix"] = prefix
+        if q:
+            params["q"] = q
+        response = session.get(f"{API_URL}/tags", params=params)
+        if response.status_code != 200:
+            return [], []
+        data = response.json()
+        return [t["tag"] for t in data.get("tags", [])], [t["tag"] for t in data.get("cooccurring", [])]
+    except requests.RequestException:
+        return [], []
+
+def complete_filter(text, tag):
+    """Callback: sustituye la palabra a medio escribir (o añade ' AND tag') en el filtro."""
+    st.session_state.tag_filter = text + tag if not text or text[-1] in " ,(" else f"{text} AND {tag}"
+
+def _typed_word(text):
+    """Palabra que se está escribiendo al final del filtro (vacía si acaba en separador u operador)."""
+    word = text.replace("(", " ").replace(")", " ").replace(",", " ").split(" ")[-1]
+    return "" if word.upper() in ("AND", "OR", "NOT") else word
 
 # --- Mostrar lista ---
 st.subheader("📖 Archivos disponibles")
-tags_filter = st.text_input("Filtrar por etiquetas (separadas por comas):", key="tag_filter")
+tags_filter = st.text_input(
+    "Filtrar por etiquetas (separadas por comas, o con AND/OR/NOT y paréntesis):",
+    key="tag_filter",
+    placeholder="(foto OR video) AND 2024 AND NOT borrador",
+)
+
+typed = _typed_word(tags_filter)
+done = tags_filter[:len(tags_filter) - len(typed)].rstrip()
+matches, _ = fetch_tags(prefix=typed) if typed else ([], [])
+_, related = fetch_tags(q=done) if done and not typed else ([], [])
+suggestions = [(tag, tags_filter[:len(tags_filter) - len(typed)]) for tag in matches if tag != typed]
+suggestions += [(tag, tags_filter.rstrip()) for tag in related]
+if suggestions:
+    suggestion_cols = st.columns(len(suggestions))
+    for col, (tag, base) in zip(suggestion_cols, suggestions):
+        col.button(tag, key=f"sug_{tag}", on_click=complete_filter, args=(base, tag))
 
 # Solo refrescamos la lista si se necesita
 if st.session_state.refresh_needed:
@@ -71,24 +135,18 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-files = refresh_list(tags_filter)
-
-# --- Parámetros de paginación ---
-ITEMS_PER_PAGE = 5
-if "current_page" not in st.session_state:
+# Cursores de las páginas visitadas: page_cursors[i] es el cursor de la página i + 1.
+# Al cambiar el filtro se vuelve a la primera página.
+if st.session_state.get("list_filter") != tags_filter or "page_cursors" not in st.session_state:
+    st.session_state.list_filter = tags_filter
+    st.session_state.page_cursors = [0]
     st.session_state.current_page = 1
 
-if files:
-    total_items = len(files)
-    total_pages = math.ceil(total_items / ITEMS_PER_PAGE)
-
-    # Aseguramos que la página actual esté dentro del rango
-    st.session_state.current_page = max(1, min(st.session_state.current_page, total_pages))
+visible_files, next_cursor, total_items = refresh_list(
+    tags_filter, st.session_state.page_cursors[st.session_state.current_page - 1])
 
-    # Calculamos los índices de los archivos visibles en esta página
-    start_idx = (st.session_state.current_page - 1) * ITEMS_PER_PAGE
-    end_idx = start_idx + ITEMS_PER_PAGE
-    visible_files = files[start_idx:end_idx]
+if visible_files:
+    total_pages = max(1, math.ceil(total_items / ITEMS_PER_PAGE))
 
     df = pd.DataFrame([
         {"Nombre": f.get("name"), "Etiquetas": f.get("tags")}
@@ -114,11 +172,11 @@ if files:
 
         if row_cols[2].button("Descargar", key=f"dl_{row['Nombre']}"):
             try:
-                r = requests.get(f"{API_URL}/download/{row['Nombre']}", stream=True)
+                r = session.get(f"{API_URL}/download/{row['Nombre']}", stream=True)
                 r.raise_for_status()
                 download_path = os.path.join(DOWNLOAD_DIR, f"{row['Nombre']}")
                 with open(download_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
+                    for chunk in r.iter_content(chunk_size=1024 * 1024):
                         f.write(chunk)
                 st.success(f"Archivo descargado en {download_path}")
                 # st.re
@@ -144,10 +202,31 @@ if files:
         )
 
     with col_next:
-        if st.button("Siguiente ➡️", disabled=(st.session_state.current_page == total_pages)):
+        if st.button("Siguiente ➡️", disabled=(next_cursor is None)):
+            del st.session_state.page_cursors[st.session_state.current_page:]
+            st.session_state.page_cursors.append(next_cursor)
             st.session_state.current_page += 1
             st.rerun()
 
+    # --- Descargar todas las coincidencias (un único tar en streaming) ---
+    if tags_filter.strip() and st.button(f"⬇️ Descargar las {total_items} coincidencias", key="dl_batch"):
+        try:
+            count = 0
+            with session.get(f"{API_URL}/download-batch", params={"q": tags_filter}, stream=True) as r:
+                r.raise_for_status()
+                r.raw.decode_content = True
+                with tarfile.open(fileobj=r.raw, mode="r|") as tar:
+                    for member in tar:
+                        if not member.isfile():
+                            continue
+                        with tar.extractfile(member) as src, \
+                                open(os.path.join(DOWNLOAD_DIR, os.path.basename(member.name)), "wb") as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+                        count += 1
+            st.success(f"{count} archivo(s) descargados en {DOWNLOAD_DIR}")
+        except (requests.RequestException, tarfile.TarError) as e:
+            st.error(f"No se pudo completar la descarga: {e}")
+
 else:
     st.warning("No se encontraron archivos.")
 
@@ -181,16 +260,16 @@ if st.session_state.modal == "add_file":
                 elif not tags.strip():
                     st.warning("Debes ingresar al menos una etiqueta.")
                 else:
-                    for file in uploaded_files:
-                        files = {"file": (file.name, file.getvalue())}
-                        data = {"tags": tags}
+                    # Todos los archivos en peticiones multipart de UPLOAD_BATCH
+                    for start in range(0, len(uploaded_files), UPLOAD_BATCH):
+                        batch = uploaded_files[start:start + UPLOAD_BATCH]
+                        files = [("files", (file.name, file.getvalue())) for file in batch]
                         try:
-                            response = requests.post(f"{API_URL}/add", files=files, data=data)
+                            response = session.post(f"{API_URL}/add-batch", files=files, data={"tags": tags})
                             response.raise_for_status()
-                            st.success(f"Archivo '{file.name}' subido correctamente.")
-                            # st.rerun()
+                            st.success(f"{response.json()['added']} de {len(batch)} archivo(s) subidos correctamente.")
                         except requests.RequestException as e:
-                            st.error(f"Error al subir '{file.name}': {e}")
+                            st.error(f"Error al subir {len(batch)} archivo(s): {e}")
                     st.session_state.modal = None
                     st.session_state.refresh_needed = True
                     st.rerun()
@@ -211,7 +290,7 @@ elif st.session_state.modal == "add_tags":
                 else:
                     params = {"query": query_tags, "new_tags": new_tags}
                     try:
-                        response = requests.post(f"{API_URL}/add-tags", params=params)
+                        response = session.post(f"{API_URL}/add-tags", params=params)
                         response.raise_for_status()
                         data = response.json()
                         if data.get("success"):
@@ -240,7 +319,7 @@ elif st.session_state.modal == "del_tags":
                 else:
                     params = {"query": query_tags, "del_tags": del_tags}
                     try:
-                        response = requests.post(f"{API_URL}/delete-tags", params=params)
+                        response = session.post(f"{API_URL}/delete-tags", params=params)
                         response.raise_for_status()
                         data = response.json()
                         if data.get("success"):
@@ -266,7 +345,7 @@ elif st.session_state.modal == "del_files":
                 else:
                     params = {"tags": tags}
                     try:
-                        response = requests.delete(f"{API_URL}/delete", params=params)
+                        response = session.delete(f"{API_URL}/delete", params=params)
                         response.raise_for_status()
                         data = response.json()
                         if data.get("success"):
@@ -1,21 +1,236 @@
 import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import tarfile
+import threading
+import contextlib
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 API_URL = os.getenv("API_URL","http://127.0.0.1:8000")
 
+# Transferencias concurrentes con --jobs N (como máximo MAX_JOBS)
+MAX_JOBS = 32
+
+# Una sola sesión HTTP para todo el proceso: reutiliza las conexiones TCP
+# (una por hilo de --jobs como máximo)
+session = requests.Session()
+session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_JOBS))
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_JOBS))
+
+# Reintentos de fallos transitorios (conexión, timeout, 429/5xx) con espera
+# exponencial: RETRY_BACKOFF, 2x, 4x, ... más un poco de azar
+RETRIES = 4
+RETRY_BACKOFF = 0.5
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+# Archivos por petición en "add" (POST /add-batch; el servidor admite hasta 1000)
+UPLOAD_BATCH = 200
+
+# Archivos por página en "list" (el servidor admite hasta 1000)
+LIST_LIMIT = 50
+
+# Descargas: trozos grandes y reintentos que reanudan con Range desde el .part
+DOWNLOAD_CHUNK = 1024 * 1024
+DOWNLOAD_RETRIES = 5
+
+
+def is_transient(error):
+    """Errores que merece la pena reintentar."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in TRANSIENT_STATUS
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def backoff(attempt):
+    """Espera antes del reintento número attempt (1, 2, ...)."""
+    time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1) * (1 + random.random() / 2))
+
+
+def with_retries(fn, what):
+    """Llama a fn() reintentando los fallos transitorios hasta RETRIES veces."""
+    for attempt in range(1, RETRIES + 2):
+        try:
+            return fn()
+        except requests.RequestException as e:
+            if attempt > RETRIES or not is_transient(e):
+                raise
+            print(f"[WARNING] {what}: {e}; reintento {attempt}/{RETRIES}")
+            backoff(attempt)
+
+
+class Progress:
+    """Progreso agregado (archivos, MB y MB/s) de transferencias concurrentes."""
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def update(self, files, nbytes, failed=0):
+        with self._lock:
+            self.files += files
+            self.bytes += nbytes
+            self.failed += failed
+            print(f"[INFO] {self.label}: {self.files + self.failed}/{self.total} archivos, {self.rate()}")
+
+    def rate(self):
+        seconds = max(time.perf_counter() - self.start, 1e-9)
+        return (f"{self.bytes / 2 ** 20:.1f} MB en {seconds:.1f}s "
+                f"({self.bytes / 2 ** 20 / seconds:.1f} MB/s, {self.files / seconds:.0f} archivos/s)")
+
+
+def parse_jobs(args):
+    """Quita '--jobs N' de args (in situ) y devuelve N (1 si no está), entre 1 y MAX_JOBS."""
+    if "--jobs" not in args:
+        return 1
+    i = args.index("--jobs")
+    try:
+        jobs = int(args[i + 1])
+    except (IndexError, ValueError):
+        print("[WARNING] --jobs necesita un número; se usa 1.")
+        jobs = 1
+    del args[i:i + 2]
+    return max(1, min(jobs, MAX_JOBS))
+
+
+def expand_paths(paths):
+    """Rutas de archivos; los directorios se recorren recursivamente."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def upload_batch(batch, tags):
+    """Sube un lote con POST /add-batch (con reintentos). Devuelve la respuesta JSON."""
+    def send():
+        with contextlib.ExitStack() as stack:
+            parts = [("files", (os.path.basename(p), stack.enter_context(open(p, "rb")))) for p in batch]
+            response = session.post(f"{API_URL}/add-batch", files=parts, data={"tags": ",".join(tags)})
+            response.raise_for_status()
+            return response.json()
+    return with_retries(send, f"Lote de {len(batch)} archivo(s)")
+
+
+def download(file_name, dest_folder):
+    """
+    Descarga <file_name> en <dest_folder>/<file_name>.
+    Se escribe en '<nombre>.part' (y su ETag en '<nombre>.part.etag'); si la
+    transferencia se corta, el siguiente intento (o la siguiente ejecución)
+    pide sólo los bytes que faltan con Range + If-Range. Si el archivo cambió
+    en el servidor, éste responde 200 y se vuelve a empezar desde cero.
+    Si el servidor lo envía con Content-Encoding: gzip, el .part guarda los bytes
+    comprimidos (a ellos se refieren los rangos) y se descomprime al terminar.
+    """
+    path = os.path.join(dest_folder, file_name)
+    part = path + ".part"
+    etag_path = part + ".etag"
+
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        etag = None
+        if offset and os.path.exists(etag_path):
+            with open(etag_path) as f:
+                etag = f.readline().strip() or None
+        headers = {"Accept-Encoding": "gzip"}
+        if etag:
+            headers.update({"Range": f"bytes={offset}-", "If-Range": etag})
+        try:
+            with session.get(f"{API_URL}/download/{file_name}", headers=headers, stream=True, timeout=60) as r:
+                if r.status_code == 416:
+                    # El .part ya contiene el archivo completo
+                    break
+                r.raise_for_status()
+                if r.status_code == 206:
+                    mode = "ab"
+                    print(f"[INFO] Reanudando '{file_name}' desde el byte {offset}")
+                else:
+                    mode = "wb"
+                    with open(etag_path, "w") as f:
+                        f.write(r.headers.get("ETag", "") + "\n" + r.headers.get("Content-Encoding", "") + "\n")
+                with open(part, mode) as f:
+                    for chunk in r.raw.stream(DOWNLOAD_CHUNK, decode_content=False):
+                        f.write(chunk)
+            break
+        except requests.RequestException as e:
+            if isinstance(e, requests.HTTPError) and not is_transient(e):
+                print(f"[ERROR] No se pudo descargar '{file_name}': {e}")
+                return False
+            if attempt == DOWNLOAD_RETRIES:
+                print(f"[ERROR] No se pudo descargar '{file_name}': {e} (se reanudará en la próxima ejecución)")
+                return False
+            print(f"[WARNING] Descarga interrumpida ({e}); reintento {attempt}/{DOWNLOAD_RETRIES - 1}")
+            backoff(attempt)
+
+    encoding = ""
+    if os.path.exists(etag_path):
+        with open(etag_path) as f:
+            encoding = (f.read().splitlines()[1:2] or [""])[0].strip()
+    if encoding == "gzip":
+        with gzip.open(part, "rb") as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK)
+        os.remove(part)
+    else:
+        os.replace(part, path)
+    if os.path.exists(etag_path):
+        os.remove(etag_path)
+    return True
+
+
+def download_batch(query, dest_folder):
+    """
+    Descarga en <dest_folder> todos los archivos que cumplen la consulta, como un
+    único tar en streaming (GET /download-batch) que se extrae sobre la marcha.
+    Devuelve el número de archivos, o None si falla.
+    """
+    count = 0
+    try:
+        with session.get(f"{API_URL}/download-batch", params={"q": query}, stream=True, timeout=60) as r:
+            if r.status_code == 400:
+                print(f"[ERROR] {r.json().get('detail')}")
+                return None
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with tarfile.open(fileobj=r.raw, mode="r|") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    # Sólo el nombre: nada de rutas del tar fuera de dest_folder
+                    with tar.extractfile(member) as src, \
+                            open(os.path.join(dest_folder, os.path.basename(member.name)), "wb") as dst:
+                        shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK)
+                    count += 1
+    except (requests.RequestException, tarfile.TarError) as e:
+        print(f"[ERROR] No se pudo completar la descarga por lotes: {e}")
+        return None
+    return count
+
+
 def main():
     if len(sys.argv) < 2:
-        print("[ERROR] Debes indicar un comando: add, delete, list, add-tags, delete-tags, reset")
+        print("[ERROR] Debes indicar un comando: add, add-bulk, delete, list, tags, add-tags, delete-tags, check-tags, explain, download, download-batch, reset")
         return
 
+    jobs = parse_jobs(sys.argv)
     command = sys.argv[1].strip().lower()
     print(command)
 
     # --- ADD ---
     if command == "add":
         if len(sys.argv) < 4:
-            print("[ERROR] Uso: python main.py add <archivo1,archivo2,...> <etiqueta1,etiqueta2,...>")
+            print("[ERROR] Uso: python main.py add <archivo1,directorio,...> <etiqueta1,etiqueta2,...> [--jobs N]")
             return
 
         files = sys.argv[2].split(",")
@@ -31,38 +246,149 @@ def main():
                 print(f"[ERROR] La etiqueta '{t}' contiene espacios. Usa '_' en su lugar.")
                 return
 
-        for file_path in files:
+        existing = []
+        for file_path in expand_paths(files):
             if not os.path.exists(file_path):
                 print(f"[ERROR] El archivo '{file_path}' no existe.")
                 continue
+            existing.append(file_path)
 
-            with open(file_path, "rb") as f:
+        # Lotes de UPLOAD_BATCH archivos por petición, hasta `jobs` peticiones a la vez
+        progress = Progress("Subida", len(existing))
+        batches = [existing[i:i + UPLOAD_BATCH] for i in range(0, len(existing), UPLOAD_BATCH)]
+        skipped = 0
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(upload_batch, batch, tags): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
                 try:
-                    print(tags)
-                    response = requests.post(
-                        f"{API_URL}/add",
-                        files={"file": (os.path.basename(file_path), f)},
-                        data={"tags": ",".join(tags)},
-                    )
-                    response.raise_for_status()
-                    print(f"[OK] Archivo '{file_path}' agregado correctamente.")
+                    result = future.result()
+                    skipped += result["skipped"]
+                    progress.update(result["added"], result["bytes"], failed=result["skipped"])
                 except requests.RequestException as e:
-                    print(f"[ERROR] No se pudo subir '{file_path}': {e}")
+                    print(f"[ERROR] No se pudo subir el lote de {len(batch)} archivo(s): {e}")
+                    progress.update(0, 0, failed=len(batch))
+        print(f"[OK] {progress.files} de {len(existing)} archivo(s) agregados ({skipped} omitidos); {progress.rate()}")
+    # --- ADD BULK ---
+    elif command == "add-bulk":
+        if len(sys.argv) < 4:
+            print("[ERROR] Uso: python main.py add-bulk <directorio> <etiqueta1,etiqueta2,...> [tamaño_lote]")
+            print("        El directorio debe ser accesible desde el servidor y estar dentro de TBFS_INGEST_ROOT.")
+            return
+
+        directory = os.path.abspath(sys.argv[2])
+        tags = sys.argv[3]
+        batch_size = sys.argv[4] if len(sys.argv) > 4 else "1000"
+        try:
+            response = session.post(
+                f"{API_URL}/add-bulk",
+                data={"directory": directory, "tags": tags, "batch_size": batch_size},
+            )
+            response.raise_for_status()
+            stats = response.json()
+            print(f"[OK] {stats['added']} archivos agregados ({stats['skipped']} omitidos) en {stats['seconds']:.2f}s")
+            print(f"     {stats['files_per_sec']:.1f} archivos/s, {stats['mb_per_sec']:.2f} MB/s")
+        except requests.RequestException as e:
+            print(f"[ERROR] No se pudo hacer la ingesta de '{directory}': {e}")
+
     # --- LIST ---
     elif command == "list":
-        tag_query = sys.argv[2:] if len(sys.argv) > 2 else []
+        # Expresión de etiquetas: "tag1 tag2" (AND) o "(foto OR video) AND 2024 AND NOT borrador"
+        # Opciones: --limit N (por defecto LIST_LIMIT), --cursor C (página siguiente), --all (exportar todo)
+        args = sys.argv[2:]
+        params = {"limit": LIST_LIMIT, "cursor": 0}
+        export_all = False
+        words = []
+        i = 0
+        while i < len(args):
+            if args[i] == "--limit" and i + 1 < len(args) and args[i + 1].isdigit():
+                params["limit"] = int(args[i + 1])
+                i += 2
+                continue
+            if args[i] == "--cursor" and i + 1 < len(args):
+                # Un número con un solo servidor; con el coordinador (modo shard), un cursor compuesto
+                params["cursor"] = args[i + 1]
+                i += 2
+                continue
+            if args[i] == "--all":
+                export_all = True
+            else:
+                words.append(args[i])
+            i += 1
+        params["q"] = " ".join(words)
         try:
-            response = requests.get(f"{API_URL}/list", params=[("tags", t) for t in tag_query])
+            if export_all:
+                # NDJSON por streaming: no se carga la lista entera en memoria
+                with session.get(f"{API_URL}/list/export", params={"q": params["q"]}, stream=True) as response:
+                    if response.status_code == 400:
+                        print(f"[ERROR] {response.json().get('detail')}")
+                        return
+                    response.raise_for_status()
+                    found = False
+                    for line in response.iter_lines():
+                        if line:
+                            f = json.loads(line)
+                            found = True
+                            print(f"Nombre: {f['name']} | Etiquetas: {f['tags']}")
+                    if not found:
+                        print("[INFO] No se encontraron archivos.")
+                return
+            response = session.get(f"{API_URL}/list", params=params)
+            if response.status_code in (400, 422):
+                print(f"[ERROR] {response.json().get('detail')}")
+                return
             response.raise_for_status()
-            data = response.json().get("files", [])
+            page = response.json()
+            data = page.get("files", [])
             if not data:
                 print("[INFO] No se encontraron archivos.")
             else:
                 for f in data:
                     print(f"Nombre: {f['name']} | Etiquetas: {f['tags']}")
+            if page.get("next_cursor") is not None:
+                print(f"[INFO] Hay más resultados: python main.py list --cursor {page['next_cursor']} "
+                      f"--limit {params['limit']} {params['q']}".rstrip())
         except requests.RequestException as e:
             print(f"[ERROR] No se pudo listar archivos: {e}")
 
+    # --- TAGS ---
+    elif command == "tags":
+        # Sin expresión: etiquetas y número de ficheros. Con expresión: además las
+        # etiquetas que más aparecen junto a ella. Opciones: --prefix P, --limit N
+        args = sys.argv[2:]
+        params = {"limit": LIST_LIMIT}
+        words = []
+        i = 0
+        while i < len(args):
+            if args[i] in ("--prefix", "--limit") and i + 1 < len(args):
+                params[args[i][2:]] = args[i + 1]
+                i += 2
+                continue
+            words.append(args[i])
+            i += 1
+        if words:
+            params["q"] = " ".join(words)
+            params["top"] = params["limit"]
+        try:
+            response = session.get(f"{API_URL}/tags", params=params)
+            if response.status_code in (400, 422):
+                print(f"[ERROR] {response.json().get('detail')}")
+                return
+            response.raise_for_status()
+            data = response.json()
+            if "cooccurring" in data:
+                if not data["cooccurring"]:
+                    print("[INFO] Ninguna etiqueta aparece junto a esa consulta.")
+                for t in data["cooccurring"]:
+                    print(f"{t['tag']} | Archivos: {t['count']}")
+            elif not data["tags"]:
+                print("[INFO] No hay etiquetas.")
+            else:
+                for t in data["tags"]:
+                    print(f"{t['tag']} | Archivos: {t['count']}")
+        except requests.RequestException as e:
+            print(f"[ERROR] No se pudo obtener las etiquetas: {e}")
+
     # --- DELETE FILES ---
     elif command == "delete":
         if len(sys.argv) < 3:
@@ -71,7 +397,7 @@ def main():
 
         tag_query = sys.argv[2]
         try:
-            response = requests.delete(f"{API_URL}/delete", params={"tags": tag_query})
+            response = session.delete(f"{API_URL}/delete", params={"tags": tag_query})
             response.raise_for_status()
             msg = response.json().get("message", "")
             print(f"[INFO] {msg}")
@@ -88,7 +414,7 @@ def main():
         new_tags = sys.argv[3]
 
         try:
-            response = requests.post(f"{API_URL}/add-tags", params={"query": query_tags, "new_tags": new_tags})
+            response = session.post(f"{API_URL}/add-tags", params={"query": query_tags, "new_tags": new_tags})
             response.raise_for_status()
             if response.json().get("success"):
                 print("[OK] Etiquetas agregadas correctamente.")
@@ -107,7 +433,7 @@ def main():
         del_tags = sys.argv[3]
 
         try:
-            response = requests.post(f"{API_URL}/delete-tags", params={"query": query_tags, "del_tags": del_tags})
+            response = session.post(f"{API_URL}/delete-tags", params={"query": query_tags, "del_tags": del_tags})
             response.raise_for_status()
             if response.json().get("success"):
                 print("[OK] Etiquetas eliminadas correctamente.")
@@ -116,6 +442,46 @@ def main():
         except requests.RequestException as e:
             print(f"[ERROR] No se pudieron eliminar etiquetas: {e}")
 
+    # --- CHECK TAGS ---
+    elif command == "check-tags":
+        repair = "--repair" in sys.argv[2:]
+        try:
+            response = session.post(f"{API_URL}/admin/check-tags", params={"repair": repair})
+            response.raise_for_status()
+            data = response.json()
+            if not data["mismatched"]:
+                print("[OK] La lista de etiquetas de los ficheros es consistente.")
+            elif data["repaired"]:
+                print(f"[OK] {data['mismatched']} fichero(s) inconsistentes; lista de etiquetas reconstruida.")
+            else:
+                print(f"[WARNING] {data['mismatched']} fichero(s) inconsistentes (ids: {data['ids']}). "
+                      "Usa --repair para reconstruir.")
+        except requests.RequestException as e:
+            print(f"[ERROR] No se pudo verificar las etiquetas: {e}")
+
+    # --- EXPLAIN ---
+    elif command == "explain":
+        # Traza de una consulta AND: plan, filas recorridas/devueltas y tiempo por fase
+        args = [a for a in sys.argv[2:] if not a.startswith("--engine=")]
+        engine = next((a.split("=", 1)[1] for a in sys.argv[2:] if a.startswith("--engine=")), None)
+        tags = [t for t in ",".join(args).split(",") if t.strip()]
+        try:
+            response = session.get(f"{API_URL}/explain", params={"tags": tags, "engine": engine})
+            if response.status_code == 400:
+                print(f"[ERROR] {response.json().get('detail')}")
+                return
+            response.raise_for_status()
+            data = response.json()
+            print(f"Consulta: {data['query'] or '(todos los ficheros)'}  [motor {data['engine']}]")
+            print(f"Filas recorridas: {data['rows_scanned']} | devueltas: {data['rows_returned']}")
+            print(f"Tiempo: {data['total_ms']:.3f} ms (SQL {data['sql_ms']:.3f} | agregación "
+                  f"{data['aggregation_ms']:.3f} | JSON {data['serialization_ms']:.3f})")
+            print("Plan:")
+            for line in data["plan"]:
+                print(f"  {line}")
+        except requests.RequestException as e:
+            print(f"[ERROR] No se pudo obtener el plan: {e}")
+
     # --- RESET ---
     # elif command == "reset":
     #     confirm = input("⚠️ Esto eliminará toda la base de datos y archivos. ¿Continuar? (y/N): ").lower()
@@ -127,26 +493,42 @@ def main():
     
     elif command == "download":
         if len(sys.argv) < 4:
-            print("[ERROR] Uso: python main.py download <nombre_archivo> <carpeta_destino>")
+            print("[ERROR] Uso: python main.py download <archivo1,archivo2,...> <carpeta_destino> [--jobs N]")
             return
 
-        file_name = sys.argv[2]
+        file_names = [n for n in sys.argv[2].split(",") if n]
         dest_folder = sys.argv[3]
         os.makedirs(dest_folder, exist_ok=True)
-        try:
-            response = requests.get(f"{API_URL}/download/{file_name}", stream=True)
-            response.raise_for_status()
-            path = os.path.join(dest_folder, file_name)
-            with open(path, "wb") as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-            print(f"[OK] Archivo '{file_name}' descargado en '{dest_folder}'")
-        except requests.RequestException as e:
-            print(f"[ERROR] No se pudo descargar '{file_name}': {e}")
+        if len(file_names) == 1:
+            if download(file_names[0], dest_folder):
+                print(f"[OK] Archivo '{file_names[0]}' descargado en '{dest_folder}'")
+            return
+
+        progress = Progress("Descarga", len(file_names))
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(download, name, dest_folder): name for name in file_names}
+            for future in as_completed(futures):
+                path = os.path.join(dest_folder, futures[future])
+                if future.result():
+                    progress.update(1, os.path.getsize(path))
+                else:
+                    progress.update(0, 0, failed=1)
+        print(f"[OK] {progress.files} de {len(file_names)} archivo(s) descargados en '{dest_folder}'; {progress.rate()}")
+
+    elif command == "download-batch":
+        if len(sys.argv) < 4:
+            print("[ERROR] Uso: python main.py download-batch <consulta> <carpeta_destino>")
+            return
+
+        dest_folder = sys.argv[-1]
+        os.makedirs(dest_folder, exist_ok=True)
+        count = download_batch(" ".join(sys.argv[2:-1]), dest_folder)
+        if count is not None:
+            print(f"[OK] {count} archivo(s) descargados en '{dest_folder}'")
 
     else:
         print(f"[ERROR] Comando desconocido: {command}")
-        print("Comandos válidos: add, delete, list, add-tags, delete-tags, reset")
+        print("Comandos válidos: add, add-bulk, delete, list, tags, add-tags, delete-tags, check-tags, explain, download, download-batch, reset")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,18 @@
+#!/bin/bash
+# Replicación en local: un líder en el puerto 8000 (recibe las escrituras) y
+# N seguidores en 8001..800N que sirven lecturas y redirigen las escrituras al
+# líder. Cada proceso tiene su directorio, su database/ y su storage/.
+#   ./run_replicated.sh [N]
+N=${1:-2}
+ROOT=$(cd "$(dirname "$0")" && pwd)
+LEADER=http://127.0.0.1:8000
+DIR="$ROOT/replicas/leader"
+mkdir -p "$DIR/database"
+(cd "$DIR" && PYTHONPATH="$ROOT" TBFS_STORAGE_DIR="$DIR/storage" TBFS_ROLE=leader uvicorn server.api:app --host 0.0.0.0 --port 8000) &
+for i in $(seq 1 "$N"); do
+    PORT=$((8000 + i))
+    DIR="$ROOT/replicas/follower$i"
+    mkdir -p "$DIR/database"
+    (cd "$DIR" && PYTHONPATH="$ROOT" TBFS_STORAGE_DIR="$DIR/storage" TBFS_ROLE=follower TBFS_LEADER_URL="$LEADER" uvicorn server.api:app --host 127.0.0.1 --port "$PORT") &
+done
+API_URL=http://127.0.0.1:8001 streamlit run gui/web.py
@@ -0,0 +1,16 @@
+#!/bin/bash
+# Modo shard en local: N nodos server.api (cada uno con su directorio, su
+# database/ y su storage/) y el coordinador en el puerto 8000.
+#   ./run_sharded.sh [N]
+N=${1:-3}
+ROOT=$(cd "$(dirname "$0")" && pwd)
+SHARDS=""
+for i in $(seq 1 "$N"); do
+    PORT=$((8000 + i))
+    DIR="$ROOT/shards/node$i"
+    mkdir -p "$DIR/database"
+    (cd "$DIR" && PYTHONPATH="$ROOT" TBFS_STORAGE_DIR="$DIR/storage" uvicorn server.api:app --host 127.0.0.1 --port "$PORT") &
+    SHARDS="$SHARDS${SHARDS:+,}http://127.0.0.1:$PORT"
+done
+TBFS_SHARDS="$SHARDS" uvicorn server.coordinator:app --host 0.0.0.0 --port 8000 &
+API_URL=http://127.0.0.1:8000 streamlit run gui/web.py
@@ -1,82 +1,477 @@
 # server/api.py
-from fastapi import FastAPI, UploadFile, Form, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from core import aio
+from core import cache
 from core import manager
+from core import metrics
 from core import database
+from core import packs
+from core import replication
+from core import storage
+from core.log import get_logger
+from core.query import QuerySyntaxError, parse as parse_query
+from server import archive
+from server.ranges import RangeFileResponse, accepts_encoding
+import asyncio
+import json
 import os
 import shutil
+import time
 from typing import List, Optional
 
+# Pool de conexiones: una conexión SQLite por hilo, abierta una sola vez.
+# TBFS_DB_POOL=0 vuelve a abrir/cerrar una conexión por llamada.
+database.configure_pool(
+    enabled=os.getenv("TBFS_DB_POOL", "1") != "0",
+    mmap_size=int(os.getenv("TBFS_DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    cache_size=int(os.getenv("TBFS_DB_CACHE_SIZE", str(-64 * 1024))),
+)
 database.init_db()
 
+# Replicación (core/replication.py): el líder registra los cambios; el
+# seguidor los aplica en segundo plano y sólo atiende lecturas.
+if replication.ROLE == "leader":
+    database.enable_changelog()
+follower = None
+if replication.ROLE == "follower":
+    if not replication.LEADER_URL:
+        raise RuntimeError("TBFS_ROLE=follower necesita TBFS_LEADER_URL")
+    follower = replication.Follower(replication.LEADER_URL, os.path.abspath(manager.STORAGE_DIR))
+# Tarea de compactación de packs (sólo si hay packs y el nodo acepta escrituras)
+compactor = None
+
 app = FastAPI(title="Tag-Based File System API")
+logger = get_logger("api")
+
+# Los manejadores son async: la base de datos y los ficheros se atienden en los
+# ejecutores de core/aio.py (lecturas en paralelo, un único hilo escritor).
+@app.on_event("startup")
+def startup():
+    global compactor
+    aio.start()
+    if follower is not None:
+        follower.start()
+    elif packs.THRESHOLD and packs.COMPACT_INTERVAL > 0:
+        compactor = asyncio.get_running_loop().create_task(compact_packs_periodically())
+
+@app.on_event("shutdown")
+def shutdown():
+    if follower is not None:
+        follower.stop()
+    if compactor is not None:
+        compactor.cancel()
+    aio.shutdown()
+
+async def compact_packs_periodically():
+    """Recupera cada TBFS_PACK_COMPACT_INTERVAL segundos el espacio muerto de los packs (core/packs.py)."""
+    while True:
+        await asyncio.sleep(packs.COMPACT_INTERVAL)
+        try:
+            await aio.run_write(manager.compact_packs)
+        except Exception as e:
+            logger.error(f"No se pudieron compactar los packs: {e}")
+
+READ_METHODS = ("GET", "HEAD")
+
+@app.middleware("http")
+async def route_to_leader(request: Request, call_next):
+    """
+    En un seguidor: las escrituras van al líder (307 conserva método y cuerpo),
+    y también las lecturas mientras lleve más de TBFS_MAX_STALENESS segundos
+    sin ponerse al día.
+    """
+    if follower is not None and not request.url.path.startswith("/replication/"):
+        if request.method not in READ_METHODS or follower.is_stale():
+            target = replication.LEADER_URL + request.url.path
+            if request.url.query:
+                target += "?" + request.url.query
+            return RedirectResponse(target, status_code=307)
+    return await call_next(request)
+
+if metrics.ENABLED:
+    @app.middleware("http")
+    async def observe_latency(request: Request, call_next):
+        """Latencia por método, plantilla de ruta ("/download/{file_name}") y estado."""
+        start = time.perf_counter()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, request.method,
+                                     route.path if route is not None else "unmatched", response.status_code)
+        return response
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas en formato de texto de Prometheus (vacías con TBFS_METRICS=0)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Servidor funcionando"}
 
+# Tamaño de los trozos con los que se vuelcan las subidas a storage/
+UPLOAD_CHUNK = 1024 * 1024
+
 @app.post("/add")
 async def add_file(file: UploadFile, tags: str = Form(...)):
     """
     Sube un archivo al sistema con etiquetas.
+    El contenido se vuelca por trozos directamente a storage/ (sin copia en uploads/).
     """
-    os.makedirs("uploads", exist_ok=True)
-    temp_path = os.path.join("uploads", file.filename)
+    tag_list = [t.strip() for t in tags.split(",") if t.strip()]
+    file_name = os.path.basename(file.filename or "")
+    if not tag_list or not file_name or await aio.file_exists(file_name):
+        raise HTTPException(status_code=400, detail="No se pudo agregar el archivo")
+
+    async def chunks():
+        while chunk := await file.read(UPLOAD_CHUNK):
+            yield chunk
+
+    writer = await aio.open_blob_writer()
+    await aio.write_chunks(writer, chunks())
+    if not await aio.add_upload(file_name, writer, tag_list):
+        raise HTTPException(status_code=400, detail="No se pudo agregar el archivo")
+
+    return {"success": True, "message": f"Archivo '{file_name}' agregado correctamente"}
 
-    # Guardar temporalmente el archivo subido
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
+# Ficheros por petición en /add-batch (límite de partes multipart de Starlette)
+MAX_BATCH_FILES = 1000
 
+@app.post("/add-batch")
+async def add_batch(files: List[UploadFile] = File(...), tags: str = Form(...)):
+    """
+    Sube varios archivos en una sola petición multipart (campo "files" repetido),
+    todos con las mismas etiquetas. Se registran en una única transacción.
+    """
     tag_list = [t.strip() for t in tags.split(",") if t.strip()]
-    added = manager.add_files([temp_path], tag_list)
+    if not tag_list:
+        raise HTTPException(status_code=400, detail="Debes indicar al menos una etiqueta")
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Como máximo {MAX_BATCH_FILES} archivos por petición")
+
+    uploads = []
+    try:
+        for file in files:
+            async def chunks(file=file):
+                while chunk := await file.read(UPLOAD_CHUNK):
+                    yield chunk
+
+            writer = await aio.open_blob_writer()
+            await aio.write_chunks(writer, chunks())
+            uploads.append((file.filename, writer))
+    except BaseException:
+        for _, writer in uploads:
+            await aio.run_io(writer.abort)
+        raise
+    stats = await aio.add_uploads(uploads, tag_list)
+    return {"success": stats["added"] > 0, **stats}
 
-    # Eliminar temporal después de copiar a storage
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
+@app.put("/files/{file_name}")
+async def put_file(file_name: str, request: Request, tags: str):
+    """
+    Sube un archivo enviando su contenido como cuerpo de la petición (sin multipart).
+    Se escribe en storage/ a medida que llega, sin pasar por ficheros temporales de subida.
+    """
+    tag_list = [t.strip() for t in tags.split(",") if t.strip()]
+    file_name = os.path.basename(file_name)
+    if not tag_list or not file_name or await aio.file_exists(file_name):
+        raise HTTPException(status_code=400, detail="No se pudo agregar el archivo")
 
-    if not added:
+    writer = await aio.open_blob_writer()
+    await aio.write_chunks(writer, request.stream())
+    if not await aio.add_upload(file_name, writer, tag_list):
         raise HTTPException(status_code=400, detail="No se pudo agregar el archivo")
 
-    return {"success": True, "message": f"Archivo '{file.filename}' agregado correctamente"}
+    return {"success": True, "message": f"Archivo '{file_name}' agregado correctamente"}
+
+# Directorio del servidor bajo el que /add-bulk puede leer (TBFS_INGEST_ROOT).
+# Sin él /add-bulk está desactivado: cualquier cliente podría ingerir (y luego
+# descargar) cualquier fichero legible por el servidor.
+INGEST_ROOT = os.getenv("TBFS_INGEST_ROOT", "")
+
+def _inside_ingest_root(directory: str) -> bool:
+    """True si directory, resueltos los enlaces simbólicos y "..", queda dentro de INGEST_ROOT."""
+    if not INGEST_ROOT:
+        return False
+    root = os.path.realpath(INGEST_ROOT)
+    return os.path.commonpath([root, os.path.realpath(directory)]) == root
+
+@app.post("/add-bulk")
+async def add_bulk(directory: str = Form(...), tags: str = Form(...), batch_size: int = Form(1000)):
+    """
+    Ingesta masiva de todos los ficheros de un directorio visible para el servidor.
+    Sólo se aceptan directorios dentro de TBFS_INGEST_ROOT (403 si no).
+    Devuelve el número de ficheros agregados y el rendimiento (ficheros/s y MB/s).
+    """
+    if not _inside_ingest_root(directory):
+        raise HTTPException(status_code=403, detail=f"El directorio '{directory}' está fuera de TBFS_INGEST_ROOT")
+    if not os.path.isdir(directory):
+        raise HTTPException(status_code=404, detail=f"El directorio '{directory}' no existe en el servidor")
+    tag_list = [t.strip() for t in tags.split(",") if t.strip()]
+    if not tag_list:
+        raise HTTPException(status_code=400, detail="Debes indicar al menos una etiqueta")
+    stats = await aio.add_directory(directory, tag_list, batch_size=batch_size)
+    return {"success": stats["added"] > 0, **stats}
+
+# Campos que se pueden pedir en /list; "path" es interno y sólo va si se pide
+LIST_FIELDS = ("id", "name", "tags", "path")
+DEFAULT_LIST_FIELDS = "id,name,tags"
+
+def _parse_fields(fields: str) -> List[str]:
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in LIST_FIELDS]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(unknown) or '(vacío)'}; "
+                                                    f"válidos: {', '.join(LIST_FIELDS)}")
+    return selected
+
+def _format_row(row, fields: List[str]) -> dict:
+    values = dict(zip(LIST_FIELDS, row))
+    return {f: values[f] for f in fields}
 
 @app.get("/list")
-def list_files(tags: Optional[List[str]] = Query(None)):
+async def list_files(tags: Optional[List[str]] = Query(None), q: Optional[str] = None,
+               cursor: int = Query(0, ge=0),
+               limit: int = Query(manager.PAGE_LIMIT, ge=1, le=manager.MAX_PAGE_LIMIT),
+               count: bool = False, fields: str = DEFAULT_LIST_FIELDS):
+    """
+    Lista archivos y sus etiquetas, paginado por cursor (keyset sobre el id).
+    - tags: etiquetas que deben tener todos (AND); puede repetirse.
+    - q: expresión booleana, p. ej. "(foto OR video) AND 2024 AND NOT borrador".
+    - cursor: "next_cursor" de la respuesta anterior (0 = primera página).
+    - limit: archivos por página (máximo manager.MAX_PAGE_LIMIT).
+    - count: incluir "total" (cuesta recorrer todas las coincidencias).
+    - fields: campos a devolver, separados por comas (id, name, tags, path).
+    """
+    selected = _parse_fields(fields)
+    try:
+        files, next_cursor, total = await aio.page_files(q, tags, after=cursor, limit=limit, count=count)
+    except QuerySyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Consulta inválida: {e}")
+    response = {"files": [_format_row(row, selected) for row in files], "next_cursor": next_cursor}
+    if count:
+        response["total"] = total
+    return response
+
+@app.get("/list/export")
+async def export_files(tags: Optional[List[str]] = Query(None), q: Optional[str] = None,
+                 fields: str = DEFAULT_LIST_FIELDS):
+    """
+    Exporta todas las coincidencias como NDJSON (un objeto JSON por línea),
+    leyendo la base de datos por lotes en lugar de montar toda la respuesta.
+    """
+    selected = _parse_fields(fields)
+    try:
+        parse_query(q or "")
+    except QuerySyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Consulta inválida: {e}")
+
+    async def lines():
+        # Un bloque de filas por salto al pool de lectura
+        async for block in aio.iter_file_blocks(q, tags):
+            yield "".join(json.dumps(_format_row(row, selected), ensure_ascii=False) + "\n" for row in block)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/tags")
+async def list_tags(prefix: Optional[str] = None, tags: Optional[List[str]] = Query(None),
+                    q: Optional[str] = None, limit: int = Query(50, ge=1, le=manager.MAX_PAGE_LIMIT),
+                    top: int = Query(10, ge=1, le=manager.MAX_PAGE_LIMIT)):
+    """
+    Etiquetas y número de ficheros de cada una (prefix para autocompletar).
+    Con tags o q también devuelve "cooccurring": las top etiquetas más frecuentes
+    entre los ficheros que cumplen la consulta.
+    """
+    result = {"tags": [{"tag": t, "count": c} for t, c in await aio.tag_stats(prefix, limit)]}
+    if q or tags:
+        try:
+            pairs = await aio.cooccurring_tags(q, tags, top)
+        except QuerySyntaxError as e:
+            raise HTTPException(status_code=400, detail=f"Consulta inválida: {e}")
+        result["cooccurring"] = [{"tag": t, "count": c} for t, c in pairs]
+    return result
+
+@app.get("/explain")
+async def explain(tags: Optional[List[str]] = Query(None), engine: Optional[str] = None):
+    """
+    Traza de una consulta por etiquetas (AND) como en el registro de consultas
+    lentas: consulta normalizada, plan, filas recorridas/devueltas y tiempo en
+    SQL, agregación y serialización. engine: "sql" o "index" (por defecto el del servidor).
+    """
+    if engine not in (None, "sql", "index"):
+        raise HTTPException(status_code=400, detail="engine debe ser 'sql' o 'index'")
+    return await aio.run_read(manager.explain_query, tags or [], engine=engine)
+
+@app.get("/stats/cache")
+async def cache_stats():
+    """Contadores de la caché de consultas (aciertos, fallos, expulsiones, invalidaciones)."""
+    return cache.stats()
+
+@app.post("/admin/check-tags")
+async def check_tags(repair: bool = False):
     """
-    Lista todos los archivos y sus etiquetas.
+    Verifica la lista de etiquetas desnormalizada (files.tags) contra file_tags.
+    Con repair=true la reconstruye si hay diferencias.
     """
-    files = manager.query_files(query_tags=tags)
-    formatted = [
-        {"id": fid, "name": name, "tags": tags, "path": path}
-        for fid, name, tags, path in files
-    ]
-    return {"files": formatted}
+    mismatched = await aio.check_file_tags(repair=repair)
+    if mismatched and repair:
+        cache.clear()
+    return {"mismatched": len(mismatched), "ids": mismatched[:100], "repaired": bool(mismatched) and repair}
 
 @app.delete("/delete")
-def delete_files(tags: str):
+async def delete_files(tags: str):
     """
     Elimina archivos según etiquetas.
     """
     tag_list = [t.strip() for t in tags.split(",") if t.strip()]
-    deleted = manager.delete_files(tag_list)
+    deleted = await aio.delete_files(tag_list)
     return {"success": deleted, "message": "Archivos eliminados" if deleted else "No se encontró coincidencia"}
 
 @app.post("/add-tags")
-def add_tags(query: str, new_tags: str):
+async def add_tags(query: str, new_tags: str):
     query_tags = [t.strip() for t in query.split(",") if t.strip()]
     tags = [t.strip() for t in new_tags.split(",") if t.strip()]
-    ok = manager.add_tags(query_tags, tags)
+    ok = await aio.add_tags(query_tags, tags)
     return {"success": ok}
 
 @app.post("/delete-tags")
-def delete_tags(query: str, del_tags: str):
+async def delete_tags(query: str, del_tags: str):
     query_tags = [t.strip() for t in query.split(",") if t.strip()]
     tags = [t.strip() for t in del_tags.split(",") if t.strip()]
-    ok = manager.delete_tags(query_tags, tags)
+    ok = await aio.delete_tags(query_tags, tags)
     return {"success": ok}
 
-@app.get("/download/{file_name}")
-def download_file(file_name: str):
-    path = manager.get_file_path(file_name)
-    if not path or not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="Archivo no encontrado")
-    return FileResponse(path=path, filename=file_name)
+# Trozos con los que se leen los ficheros de /download-batch
+ARCHIVE_CHUNK = 1024 * 1024
+
+@app.get("/download-batch")
+async def download_batch(tags: Optional[List[str]] = Query(None), q: Optional[str] = None):
+    """
+    Descarga en un único tar (en streaming) todos los archivos que cumplen la
+    consulta (tags o q, como en /list).
+    """
+    if not q and not tags:
+        raise HTTPException(status_code=400, detail="Debes indicar una consulta (tags o q)")
+    try:
+        if q:
+            parse_query(q)
+    except QuerySyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Consulta inválida: {e}")
+
+    async def body():
+        async for block in aio.iter_file_blocks(q, tags):
+            # Blobs comprimidos del bloque (se descomprimen al escribir el tar) o en un pack
+            stored = await aio.run_read(manager.stored_blobs, [row[0] for row in block])
+            for file_id, name, _, path in block:
+                codec, size, offset, length = stored.get(file_id, (storage.IDENTITY, None, None, None))
+                try:
+                    f = await aio.run_io(storage.open_blob, path, codec, offset, length)
+                except OSError as e:
+                    logger.warning(f"No se pudo leer '{name}' para el tar: {e}")
+                    continue
+                try:
+                    st = await aio.run_io(os.stat, path)
+                    # Tamaño del contenido original (el de storage/ si no está comprimido)
+                    size = st.st_size if size is None else size
+                    yield archive.header(name, size, st.st_mtime)
+                    remaining = size
+                    while remaining > 0:
+                        chunk = await aio.run_io(f.read, min(ARCHIVE_CHUNK, remaining))
+                        if not chunk:
+                            # Los blobs no cambian; si aun así se acorta, se rellena para no romper el tar
+                            chunk = b"\0" * remaining
+                        remaining -= len(chunk)
+                        yield chunk
+                    yield archive.padding(size)
+                    metrics.STORAGE_READ_BYTES.inc(st.st_size if offset is None else length, "archive")
+                finally:
+                    await aio.run_io(f.close)
+        yield archive.END
+
+    return StreamingResponse(body(), media_type="application/x-tar",
+                             headers={"Content-Disposition": 'attachment; filename="tbfs.tar"'})
+
+@app.api_route("/download/{file_name}", methods=["GET", "HEAD"])
+async def download_file(file_name: str, request: Request):
+    """
+    Descarga con soporte de Range (206, también varios rangos), If-Range,
+    If-None-Match / If-Modified-Since (304) y envío por sendfile si el
+    servidor ASGI lo ofrece. Los blobs comprimidos se envían tal cual si el
+    cliente acepta su Content-Encoding y, si no, descomprimidos por trozos.
+    Los blobs de un pack se sirven como el trozo del pack que ocupan.
+    """
+    for attempt in range(2):
+        info = await aio.get_file_info(file_name)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        try:
+            return await aio.run_io(_download_response, file_name, info, request)
+        except FileNotFoundError:
+            # compact_packs movió el blob a otro pack entre la consulta y la apertura
+            if attempt:
+                raise
+
+def _download_response(file_name: str, info: dict, request: Request) -> RangeFileResponse:
+    codec = info["codec"]
+    common = {"filename": file_name, "method": request.method, "offset": info["offset"], "length": info["length"]}
+    if codec == storage.IDENTITY:
+        return RangeFileResponse(info["path"], request.headers, etag=info["etag"], **common)
+    if accepts_encoding(request.headers.get("accept-encoding"), codec):
+        return RangeFileResponse(info["path"], request.headers, etag=f'"{info["blob"]}-{codec}"',
+                                 content_encoding=codec, **common)
+    return RangeFileResponse(info["path"], request.headers, etag=info["etag"], decode=codec, size=info["size"],
+                             **common)
+
+# --- Replicación ---
+
+@app.get("/replication/status")
+async def replication_status():
+    if follower is not None:
+        return await aio.run_read(follower.status)
+    page = await aio.run_read(replication.changes_after, 0, 0) if replication.ROLE == "leader" else None
+    return {"role": replication.ROLE, "head": page["head"] if page else None}
+
+def _require_leader():
+    if replication.ROLE != "leader":
+        raise HTTPException(status_code=404, detail="Este nodo no es líder (TBFS_ROLE=leader)")
+
+@app.get("/replication/changes")
+async def replication_changes(after: int = Query(0, ge=0), limit: int = Query(replication.BATCH, ge=1, le=50000)):
+    """Cambios con seq > after, en orden; first/head delimitan el registro conservado."""
+    _require_leader()
+    page = await aio.run_read(replication.changes_after, after, limit)
+    if page["head"] - page["first"] > replication.CHANGELOG_KEEP * 1.1:
+        await aio.run_write(replication.prune_changelog)
+    return page
+
+@app.get("/replication/blobs/{digest}")
+async def replication_blob(digest: str):
+    _require_leader()
+    found = await aio.run_read(replication.blob_file, digest)
+    if found is None or not await aio.run_io(os.path.exists, found[0]):
+        raise HTTPException(status_code=404, detail="Blob no encontrado")
+    path, codec, offset, length = found
+    if codec == storage.IDENTITY and offset is None:
+        return FileResponse(path, media_type="application/octet-stream")
+    # Contenido original: el seguidor lo verifica por hash y lo guarda sin comprimir
+    return StreamingResponse(_decoded_chunks(path, codec, offset, length), media_type="application/octet-stream")
+
+async def _decoded_chunks(path: str, codec: str, offset: Optional[int] = None, length: Optional[int] = None):
+    f = await aio.run_io(storage.open_blob, path, codec, offset, length)
+    try:
+        while True:
+            chunk = await aio.run_io(f.read, replication.BLOB_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await aio.run_io(f.close)
+
+@app.get("/replication/snapshot")
+async def replication_snapshot():
+    """Copia consistente de la base de datos para inicializar un seguidor."""
+    _require_leader()
+    path = await aio.run_read(replication.snapshot)
+    return FileResponse(path, media_type="application/vnd.sqlite3",
+                        background=BackgroundTask(os.remove, path))
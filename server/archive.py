@@ -0,0 +1,26 @@
+# server/archive.py
+"""
+Tar en streaming para la descarga por lotes: cabeceras generadas con tarfile,
+contenido copiado por trozos. No se construye el archivo completo en memoria
+ni en disco.
+"""
+import tarfile
+
+BLOCK = tarfile.BLOCKSIZE
+
+# Fin de archivo: dos bloques de ceros
+END = b"\0" * (2 * BLOCK)
+
+
+def header(name: str, size: int, mtime: float) -> bytes:
+    """Cabecera (PAX, admite nombres largos y no ASCII) de un fichero regular."""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def padding(size: int) -> bytes:
+    """Relleno hasta completar el último bloque de un fichero de size bytes."""
+    return b"\0" * (-size % BLOCK)
@@ -0,0 +1,320 @@
+# server/coordinator.py
+"""
+Coordinador del modo shard: expone la misma API que server/api.py y la reparte
+entre TBFS_SHARDS nodos (URLs separadas por comas), cada uno un server.api
+normal con su propia base de datos y su propio storage/.
+
+- Subidas y descargas van al nodo dueño del nombre (hashing consistente,
+  core/sharding.py). Si el dueño no tiene el fichero (p. ej. se añadió un nodo
+  después de subirlo) la descarga lo busca en los demás.
+- Consultas (/list, /tags, ...) y reetiquetados se envían a todos los nodos en
+  paralelo y se mezclan las respuestas.
+
+Arranque local (ver run_sharded.sh):
+    TBFS_SHARDS=http://127.0.0.1:8001,http://127.0.0.1:8002 uvicorn server.coordinator:app --port 8000
+"""
+import asyncio
+import os
+from typing import List, Optional
+
+import httpx
+from fastapi import FastAPI, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from core import sharding
+from server import archive
+
+SHARDS = [u.strip().rstrip("/") for u in os.getenv("TBFS_SHARDS", "http://127.0.0.1:8001").split(",") if u.strip()]
+
+# Conexiones abiertas por nodo
+SHARD_CONNECTIONS = int(os.getenv("TBFS_SHARD_CONNECTIONS", "32"))
+
+# Tamaño de los trozos al reenviar subidas
+UPLOAD_CHUNK = 1024 * 1024
+
+# Cabeceras de la respuesta del nodo que se reenvían en descargas
+PROXY_HEADERS = ("content-type", "content-length", "content-range", "content-disposition",
+                 "accept-ranges", "etag", "last-modified", "content-encoding", "vary")
+
+# Cabeceras de la petición que se reenvían en descargas (Range, condicionales y
+# Accept-Encoding: el cuerpo se reenvía sin tocar, comprimido o no)
+FORWARD_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since", "accept-encoding")
+
+ring = sharding.HashRing(SHARDS)
+_client: Optional[httpx.AsyncClient] = None
+
+app = FastAPI(title="Tag-Based File System API (coordinador)")
+
+
+@app.on_event("startup")
+async def startup():
+    global _client
+    _client = httpx.AsyncClient(timeout=httpx.Timeout(60, read=None),
+                                limits=httpx.Limits(max_connections=SHARD_CONNECTIONS * len(SHARDS)))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _client is not None:
+        await _client.aclose()
+
+
+def client() -> httpx.AsyncClient:
+    if _client is None:
+        raise HTTPException(status_code=503, detail="Coordinador no iniciado")
+    return _client
+
+
+def _raise_for(response: httpx.Response, node: str):
+    """Propaga los errores del nodo (400/404/...) con su detalle."""
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+
+async def _call(node: str, method: str, path: str, **kwargs) -> dict:
+    try:
+        response = await client().request(method, f"{node}{path}", **kwargs)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Nodo {node} no disponible: {e}")
+    _raise_for(response, node)
+    return response.json()
+
+
+async def _fan_out(method: str, path: str, **kwargs) -> List[dict]:
+    """La misma petición a todos los nodos en paralelo; respuestas en el orden de SHARDS."""
+    return await asyncio.gather(*[_call(node, method, path, **kwargs) for node in SHARDS])
+
+
+def _query_params(tags, q) -> list:
+    params = [("tags", t) for t in tags or []]
+    if q is not None:
+        params.append(("q", q))
+    return params
+
+
+@app.get("/")
+async def root():
+    return {"message": "Coordinador funcionando", "shards": SHARDS}
+
+
+# --- Subidas: al nodo dueño del nombre ---
+
+@app.post("/add")
+async def add_file(file: UploadFile, tags: str = Form(...)):
+    file_name = os.path.basename(file.filename or "")
+    if not file_name:
+        raise HTTPException(status_code=400, detail="No se pudo agregar el archivo")
+
+    async def chunks():
+        while chunk := await file.read(UPLOAD_CHUNK):
+            yield chunk
+
+    return await _call(ring.node_for(file_name), "PUT", f"/files/{file_name}",
+                       params={"tags": tags}, content=chunks())
+
+
+@app.put("/files/{file_name}")
+async def put_file(file_name: str, request: Request, tags: str):
+    file_name = os.path.basename(file_name)
+    return await _call(ring.node_for(file_name), "PUT", f"/files/{file_name}",
+                       params={"tags": tags}, content=request.stream())
+
+
+@app.post("/add-batch")
+async def add_batch(files: List[UploadFile] = File(...), tags: str = Form(...)):
+    """Reparte el lote por dueño y envía un /add-batch a cada nodo en paralelo."""
+    by_node = {}
+    for file in files:
+        by_node.setdefault(ring.node_for(os.path.basename(file.filename or "")), []).append(file)
+
+    async def send(node, group):
+        # httpx lee las partes multipart de forma síncrona: se leen antes con
+        # UploadFile.read (en un hilo si están en disco), como hace /add
+        parts = [("files", (f.filename, await f.read())) for f in group]
+        return await _call(node, "POST", "/add-batch", data={"tags": tags}, files=parts)
+
+    results = await asyncio.gather(*[send(node, group) for node, group in by_node.items()])
+    total = {key: 0 for key in ("added", "skipped", "bytes", "bytes_written", "deduplicated")}
+    for result in results:
+        for key in total:
+            total[key] += result.get(key, 0)
+    return {"success": total["added"] > 0, **total}
+
+
+# --- Consultas: a todos los nodos ---
+
+@app.get("/list")
+async def list_files(tags: Optional[List[str]] = Query(None), q: Optional[str] = None,
+                     cursor: str = "0", limit: int = Query(100, ge=1, le=1000),
+                     count: bool = False, fields: str = "id,name,tags"):
+    """
+    Como /list de un nodo. next_cursor es un cursor compuesto (último id de cada
+    nodo); las filas llevan además "shard" (índice del nodo) porque los ids sólo
+    son únicos dentro de cada nodo.
+    """
+    try:
+        cursors = sharding.decode_cursor(cursor, len(SHARDS))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {e}")
+    selected = [f.strip() for f in fields.split(",")]
+    node_fields = ",".join(dict.fromkeys(["id", *selected]))
+
+    async def page(node, after):
+        if after is None:
+            return None
+        params = _query_params(tags, q) + [("cursor", after), ("limit", limit), ("fields", node_fields),
+                                           ("count", str(count).lower())]
+        return await _call(node, "GET", "/list", params=params)
+
+    responses = await asyncio.gather(*[page(node, after) for node, after in zip(SHARDS, cursors)])
+    pages = [(r["files"], r["next_cursor"]) if r else None for r in responses]
+    rows, next_cursor = sharding.merge_pages(pages, cursors, limit)
+    response = {
+        "files": [{**{f: row[f] for f in selected}, "shard": shard} for shard, row in rows],
+        "next_cursor": next_cursor,
+    }
+    if count:
+        response["total"] = sum(r.get("total", 0) for r in responses if r)
+    return response
+
+
+@app.get("/list/export")
+async def export_files(tags: Optional[List[str]] = Query(None), q: Optional[str] = None,
+                       fields: str = "id,name,tags"):
+    """NDJSON de todos los nodos, uno detrás de otro."""
+    params = _query_params(tags, q) + [("fields", fields)]
+    # Validar la consulta (y los campos) antes de empezar a enviar
+    await _call(SHARDS[0], "GET", "/list", params=params + [("limit", 1)])
+
+    async def lines():
+        for node in SHARDS:
+            async with client().stream("GET", f"{node}/list/export", params=params) as response:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/tags")
+async def list_tags(prefix: Optional[str] = None, tags: Optional[List[str]] = Query(None),
+                    q: Optional[str] = None, limit: int = Query(50, ge=1, le=1000),
+                    top: int = Query(10, ge=1, le=1000)):
+    """
+    Suma los contadores de todos los nodos. Cada nodo sólo envía sus limit/top
+    primeras, así que en la cola del ranking los totales pueden quedarse cortos.
+    """
+    params = _query_params(tags, q) + [("limit", limit), ("top", top)]
+    if prefix:
+        params.append(("prefix", prefix))
+    responses = await _fan_out("GET", "/tags", params=params)
+
+    def merge(key, n):
+        counts = {}
+        for r in responses:
+            for item in r.get(key, []):
+                counts[item["tag"]] = counts.get(item["tag"], 0) + item["count"]
+        ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+        return [{"tag": t, "count": c} for t, c in ranked]
+
+    result = {"tags": merge("tags", limit)}
+    if q or tags:
+        result["cooccurring"] = merge("cooccurring", top)
+    return result
+
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return {"shards": dict(zip(SHARDS, await _fan_out("GET", "/stats/cache")))}
+
+
+@app.post("/admin/check-tags")
+async def check_tags(repair: bool = False):
+    responses = await _fan_out("POST", "/admin/check-tags", params={"repair": repair})
+    return {
+        "mismatched": sum(r["mismatched"] for r in responses),
+        "ids": [f"{shard}:{i}" for shard, r in enumerate(responses) for i in r["ids"]][:100],
+        "repaired": any(r["repaired"] for r in responses),
+    }
+
+
+# --- Escrituras por consulta: a todos los nodos ---
+
+@app.delete("/delete")
+async def delete_files(tags: str):
+    deleted = any(r["success"] for r in await _fan_out("DELETE", "/delete", params={"tags": tags}))
+    return {"success": deleted, "message": "Archivos eliminados" if deleted else "No se encontró coincidencia"}
+
+
+@app.post("/add-tags")
+async def add_tags(query: str, new_tags: str):
+    responses = await _fan_out("POST", "/add-tags", params={"query": query, "new_tags": new_tags})
+    return {"success": any(r["success"] for r in responses)}
+
+
+@app.post("/delete-tags")
+async def delete_tags(query: str, del_tags: str):
+    responses = await _fan_out("POST", "/delete-tags", params={"query": query, "del_tags": del_tags})
+    return {"success": any(r["success"] for r in responses)}
+
+
+# --- Descargas ---
+
+@app.get("/download-batch")
+async def download_batch(tags: Optional[List[str]] = Query(None), q: Optional[str] = None):
+    """Un único tar con los tar de todos los nodos (sin el bloque final de cada uno)."""
+    if not q and not tags:
+        raise HTTPException(status_code=400, detail="Debes indicar una consulta (tags o q)")
+    params = _query_params(tags, q)
+    await _call(SHARDS[0], "GET", "/list", params=params + [("limit", 1)])
+
+    async def body():
+        for node in SHARDS:
+            # Se retienen los últimos len(END) bytes de cada nodo: son su fin de archivo
+            tail = b""
+            async with client().stream("GET", f"{node}/download-batch", params=params) as response:
+                async for chunk in response.aiter_raw():
+                    tail += chunk
+                    if len(tail) > len(archive.END):
+                        yield tail[:-len(archive.END)]
+                        tail = tail[-len(archive.END):]
+        yield archive.END
+
+    return StreamingResponse(body(), media_type="application/x-tar",
+                             headers={"Content-Disposition": 'attachment; filename="tbfs.tar"'})
+
+
+async def _open_download(node: str, file_name: str, request: Request) -> httpx.Response:
+    headers = {k: v for k, v in request.headers.items() if k.lower() in FORWARD_HEADERS}
+    # Sin Accept-Encoding del cliente, que httpx no pida gzip por su cuenta
+    headers.setdefault("accept-encoding", "identity")
+    req = client().build_request(request.method, f"{node}/download/{file_name}", headers=headers)
+    try:
+        return await client().send(req, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Nodo {node} no disponible: {e}")
+
+
+@app.api_route("/download/{file_name}", methods=["GET", "HEAD"])
+async def download_file(file_name: str, request: Request):
+    """Reenvía la descarga (con Range y condicionales) al nodo que tiene el fichero."""
+    owner = ring.node_for(file_name)
+    response = await _open_download(owner, file_name, request)
+    if response.status_code == 404:
+        await response.aclose()
+        for node in SHARDS:
+            if node == owner:
+                continue
+            response = await _open_download(node, file_name, request)
+            if response.status_code != 404:
+                break
+            await response.aclose()
+        else:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    headers = {k: v for k, v in response.headers.items() if k.lower() in PROXY_HEADERS}
+    return StreamingResponse(response.aiter_raw(), status_code=response.status_code, headers=headers,
+                             background=BackgroundTask(response.aclose))
@@ -0,0 +1,259 @@
+# server/ranges.py
+"""
+Respuesta de descarga con soporte HTTP de rangos y peticiones condicionales.
+
+- Range: bytes=a-b / a- / -n  -> 206 Partial Content (varios rangos -> multipart/byteranges)
+- If-Range                    -> ignora Range si el validador no coincide
+- If-None-Match / If-Modified-Since -> 304 Not Modified
+- Rango imposible             -> 416 Range Not Satisfiable
+
+Blobs comprimidos (core/storage.py): con content_encoding se envían los bytes
+guardados tal cual, con Content-Encoding (los rangos se refieren a esos bytes y
+el ETag debe ser otro); con decode se descomprimen por trozos y se sirve
+siempre el contenido completo (sin rangos).
+
+Blobs dentro de un pack (core/packs.py): con offset/length se sirve ese trozo
+del pack, leído por posición sobre el descriptor compartido del pack.
+
+El cuerpo se envía con la extensión ASGI "http.response.zerocopysend"
+(sendfile en el servidor) cuando está disponible; si no, por bloques grandes
+leídos en un hilo aparte.
+"""
+import contextlib
+import mimetypes
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+
+from core import metrics, packs, storage
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """El rango pedido no se puede servir con el tamaño actual del fichero."""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Devuelve la lista de rangos (inicio, fin inclusive) o None si la cabecera no
+    se entiende (se ignora y se sirve el fichero completo).
+    Lanza RangeNotSatisfiable si ningún rango cae dentro del fichero.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    ranges = []
+    for spec in header[len("bytes="):].split(","):
+        spec = spec.strip()
+        if "-" not in spec:
+            return None
+        first, last = spec.split("-", 1)
+        try:
+            if first == "":
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def accepts_encoding(header: Optional[str], coding: str) -> bool:
+    """True si Accept-Encoding admite coding (por nombre o "*", con q > 0)."""
+    if not header:
+        return False
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [c.strip() for c in header.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(mtime) <= since
+
+
+class RangeFileResponse(Response):
+    """
+    Sirve un fichero teniendo en cuenta las cabeceras de la petición
+    (rangos y condicionales). Se crea con la ruta, el ETag y la petición.
+    """
+
+    def __init__(self, path: str, request_headers, etag: str, filename: Optional[str] = None,
+                 method: str = "GET", media_type: Optional[str] = None, content_encoding: Optional[str] = None,
+                 decode: Optional[str] = None, size: Optional[int] = None, offset: Optional[int] = None,
+                 length: Optional[int] = None):
+        self.path = path
+        self.method = method
+        self.decode = decode
+        self.offset = offset
+        self.length = length
+        if offset is None:
+            self._pack = None
+            stat = os.stat(path)
+            self.stored_size = stat.st_size
+        else:
+            # Se abre (o reutiliza) ya: si compact_packs lo borra después, se sigue leyendo bien
+            self._pack = packs.reader(path)
+            stat = os.fstat(self._pack.fileno())
+            self.stored_size = length
+        # Al descomprimir, el tamaño es el del contenido original (size)
+        self.size = size if decode else self.stored_size
+        self.etag = etag
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.media_type = media_type or mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+        self.background = None
+        self.body = b""
+        self.ranges: List[Tuple[int, int]] = []
+        self.boundary = None
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+        }
+        if filename:
+            headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+        if content_encoding or decode:
+            headers["vary"] = "accept-encoding"
+        if content_encoding:
+            headers["content-encoding"] = content_encoding
+        if decode:
+            headers["accept-ranges"] = "none"
+
+        if_none_match = request_headers.get("if-none-match")
+        if_modified_since = request_headers.get("if-modified-since")
+        if (if_none_match is not None and _etag_matches(if_none_match, etag)) or (
+                if_none_match is None and if_modified_since and _not_modified_since(if_modified_since, stat.st_mtime)):
+            self.status_code = 304
+            self.init_headers(headers)
+            return
+
+        range_header = None if decode else request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range.strip() not in (etag, last_modified):
+            range_header = None
+
+        try:
+            ranges = parse_range(range_header, self.size)
+        except RangeNotSatisfiable:
+            self.status_code = 416
+            headers["content-range"] = f"bytes */{self.size}"
+            headers["content-length"] = "0"
+            self.init_headers(headers)
+            return
+
+        if ranges is None:
+            self.status_code = 200
+            self.ranges = [(0, self.size - 1)] if self.size else []
+            headers["content-type"] = self.media_type
+            headers["content-length"] = str(self.size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self.ranges = ranges
+            headers["content-type"] = self.media_type
+            headers["content-range"] = f"bytes {start}-{end}/{self.size}"
+            headers["content-length"] = str(end - start + 1)
+        else:
+            self.status_code = 206
+            self.ranges = ranges
+            self.boundary = uuid.uuid4().hex
+            headers["content-type"] = f"multipart/byteranges; boundary={self.boundary}"
+            headers["content-length"] = str(sum(len(p) for p in self._part_headers()) + len(self._closing())
+                                             + sum(end - start + 1 for start, end in ranges))
+        self.init_headers(headers)
+
+    def _part_headers(self) -> List[bytes]:
+        return [
+            (f"\r\n--{self.boundary}\r\ncontent-type: {self.media_type}\r\n"
+             f"content-range: bytes {start}-{end}/{self.size}\r\n\r\n").encode("latin-1")
+            for start, end in self.ranges
+        ]
+
+    def _closing(self) -> bytes:
+        return f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.method == "HEAD" or self.status_code in (304, 416) or not self.ranges:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if self.decode:
+            await self._send_decoded(send)
+            return
+        zero_copy = "http.response.zerocopysend" in scope.get("extensions", {})
+        parts = self._part_headers() if self.boundary else [b""] * len(self.ranges)
+        base = self.offset or 0
+        with contextlib.nullcontext(self._pack) if self._pack else open(self.path, "rb") as f:
+            for prefix, (start, end) in zip(parts, self.ranges):
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                if zero_copy:
+                    await send({"type": "http.response.zerocopysend", "file": f.fileno(),
+                                "offset": base + start, "count": end - start + 1, "more_body": True})
+                else:
+                    await self._send_chunks(f, base + start, base + end, send)
+        metrics.STORAGE_READ_BYTES.inc(sum(end - start + 1 for start, end in self.ranges), "download")
+        tail = self._closing() if self.boundary else b""
+        await send({"type": "http.response.body", "body": tail, "more_body": False})
+
+    async def _send_decoded(self, send) -> None:
+        f = await anyio.to_thread.run_sync(storage.open_blob, self.path, self.decode, self.offset, self.length)
+        try:
+            while True:
+                chunk = await anyio.to_thread.run_sync(f.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            metrics.STORAGE_READ_BYTES.inc(self.stored_size, "download")
+        finally:
+            await anyio.to_thread.run_sync(f.close)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    async def _send_chunks(f, start: int, end: int, send) -> None:
+        remaining = end - start + 1
+        offset = start
+        while remaining > 0:
+            chunk = await anyio.to_thread.run_sync(os.pread, f.fileno(), min(CHUNK_SIZE, remaining), offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
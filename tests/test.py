@@ -1,8 +1,17 @@
+import contextlib
 import os
 import unittest
 import sqlite3
-from core.manager import add_files, query_files, delete_files, delete_tags, add_tags
-from core.database import init_db, get_connection, close_connection
+import shutil
+import tempfile
+import threading
+from core.manager import add_files, query_files, delete_files, delete_tags, add_tags, search_files
+from core import manager
+from core.database import init_db, get_connection, close_connection, close_pool
+from core import database
+from core import cache
+from core import index
+from core import query
 
 TEST_DB_PATH = "database/test_db.db"
 
@@ -19,6 +28,7 @@ class TestFileTagSystem(unittest.TestCase):
 
         # Inicializar nueva BD vacía
         init_db(TEST_DB_PATH)
+        cache.clear()
 
     def tearDown(self):
         """
@@ -125,5 +135,1201 @@ class TestFileTagSystem(unittest.TestCase):
         self.assertEqual(len(results), 1)
 
 
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        close_pool()
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+        init_db(TEST_DB_PATH)
+
+    def tearDown(self):
+        close_pool()
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+
+    def test_reuses_connection_per_thread(self):
+        """La misma conexión se reutiliza en un hilo y no se comparte entre hilos."""
+        conn1, _ = get_connection(TEST_DB_PATH)
+        close_connection(conn1)
+        conn2, _ = get_connection(TEST_DB_PATH)
+        close_connection(conn2)
+        self.assertIs(conn1, conn2)
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(get_connection(TEST_DB_PATH)[0]))
+        t.start()
+        t.join()
+        self.assertIsNot(other[0], conn1)
+
+    def test_connections_of_finished_threads_are_closed(self):
+        for _ in range(10):
+            t = threading.Thread(target=lambda: close_connection(get_connection(TEST_DB_PATH)[0]))
+            t.start()
+            t.join()
+        # Cada hilo nuevo cierra las de los que ya terminaron: quedan la del hilo
+        # principal (init_db) y la del último
+        self.assertEqual(database.pool_size(), 2)
+
+    def test_pragmas_applied(self):
+        conn, cursor = get_connection(TEST_DB_PATH)
+        mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+        close_connection(conn)
+        self.assertEqual(mode.lower(), "wal")
+
+    def test_release_discards_uncommitted_changes(self):
+        """Los préstamos anidados comparten transacción; liberar el último la descarta."""
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("INSERT INTO tags (tag) VALUES ('tmp')")
+        inner, _ = get_connection(TEST_DB_PATH)
+        close_connection(inner)
+        self.assertTrue(conn.in_transaction)
+        close_connection(conn)
+
+        conn, cursor = get_connection(TEST_DB_PATH)
+        count = cursor.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+        close_connection(conn)
+        self.assertEqual(count, 0)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        close_pool()
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+
+    def tearDown(self):
+        close_pool()
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+
+    def schema_sql(self, name):
+        conn, cursor = get_connection(TEST_DB_PATH)
+        row = cursor.execute("SELECT sql FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        close_connection(conn)
+        return row[0] if row else None
+
+    def test_fresh_database_reaches_latest_version(self):
+        init_db(TEST_DB_PATH)
+        self.assertEqual(database.schema_version(TEST_DB_PATH), database.MIGRATIONS[-1][0])
+        self.assertIn("WITHOUT ROWID", self.schema_sql("file_tags").upper())
+        self.assertIsNotNone(self.schema_sql("file_tags_by_tag"))
+        self.assertIsNotNone(self.schema_sql("file_tags_count_insert"))
+        # Volver a arrancar no aplica nada
+        self.assertEqual(database.migrate(TEST_DB_PATH), [])
+
+    def test_adopts_legacy_database(self):
+        """Una base de datos creada antes de las migraciones conserva sus datos."""
+        conn = sqlite3.connect(TEST_DB_PATH)
+        conn.executescript("""
+            CREATE TABLE files (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, path TEXT NOT NULL);
+            CREATE TABLE tags (id INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT UNIQUE);
+            CREATE TABLE file_tags (file_id INTEGER, tag_id INTEGER, PRIMARY KEY(file_id, tag_id));
+            INSERT INTO files (name, path) VALUES ('a', '/a'), ('b', '/b');
+            INSERT INTO tags (tag) VALUES ('x'), ('y');
+            INSERT INTO file_tags VALUES (1, 1), (2, 1), (2, 2);
+        """)
+        conn.close()
+
+        self.assertEqual(database.migrate(TEST_DB_PATH, target=2), [1, 2])
+        self.assertEqual(database.schema_version(TEST_DB_PATH), 2)
+        init_db(TEST_DB_PATH)
+        self.assertEqual(database.schema_version(TEST_DB_PATH), database.MIGRATIONS[-1][0])
+        conn, cursor = get_connection(TEST_DB_PATH)
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM file_tags").fetchone()[0], 3)
+        self.assertEqual(dict(cursor.execute("SELECT tag_id, count FROM tag_counts").fetchall()), {1: 2, 2: 1})
+        close_connection(conn)
+        self.assertEqual([r[1] for r in query_files(["x", "y"], db_path=TEST_DB_PATH)], ["b"])
+
+    def query_plans(self, fn):
+        """Ejecuta fn capturando sus SELECT y devuelve el EXPLAIN QUERY PLAN de cada uno."""
+        conn, cursor = get_connection(TEST_DB_PATH)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            fn()
+        finally:
+            conn.set_trace_callback(None)
+        plans = []
+        for sql in statements:
+            if sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                plans.append((sql, " | ".join(r[3] for r in cursor.execute("EXPLAIN QUERY PLAN " + sql))))
+        close_connection(conn)
+        return plans
+
+    def test_tag_queries_use_tag_index(self):
+        init_db(TEST_DB_PATH)
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.executemany("INSERT INTO files (name, path) VALUES (?, ?)", [(f"f{i}", f"/f{i}") for i in range(50)])
+        cursor.executemany("INSERT INTO tags (tag) VALUES (?)", [("a",), ("b",)])
+        cursor.executemany("INSERT INTO file_tags (file_id, tag_id) VALUES (?, ?)",
+                           [(i, 1) for i in range(1, 51)] + [(i, 2) for i in range(1, 51, 5)])
+        conn.commit()
+        close_connection(conn)
+
+        cache.clear()
+        for fn in (lambda: query_files(["a", "b"], db_path=TEST_DB_PATH, engine="sql"),
+                   lambda: manager.match_expression("a AND NOT b", TEST_DB_PATH, engine="sql")):
+            plans = [plan for sql, plan in self.query_plans(fn) if "file_tags" in sql]
+            self.assertTrue(plans)
+            for plan in plans:
+                self.assertIn("file_tags_by_tag", plan)
+                self.assertNotRegex(plan, r"SCAN (ft|file_tags)\b")
+
+
+class ManagerTestCase(unittest.TestCase):
+    """
+    Base para pruebas que necesitan ficheros reales: los crea en un directorio
+    temporal y usa otro directorio temporal como storage/.
+    """
+
+    def setUp(self):
+        close_pool()
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+        init_db(TEST_DB_PATH)
+        self.src_dir = tempfile.mkdtemp(prefix="tbfs_test_")
+        self.storage_dir = tempfile.mkdtemp(prefix="tbfs_storage_")
+        self._storage_dir = manager.STORAGE_DIR
+        manager.STORAGE_DIR = self.storage_dir
+
+    def tearDown(self):
+        close_pool()
+        index.drop_index()
+        cache.clear()
+        manager.STORAGE_DIR = self._storage_dir
+        shutil.rmtree(self.src_dir, ignore_errors=True)
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+        if os.path.exists(TEST_DB_PATH):
+            os.remove(TEST_DB_PATH)
+
+    def stored_files(self):
+        """Ficheros regulares presentes bajo storage/ (rutas relativas)."""
+        found = set()
+        for root, _, names in os.walk(self.storage_dir):
+            for name in names:
+                found.add(os.path.relpath(os.path.join(root, name), self.storage_dir))
+        return found
+
+    def make_file(self, name, content=b"contenido"):
+        path = os.path.join(self.src_dir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+
+class TestTagIndex(ManagerTestCase):
+
+    def test_index_engine_matches_sql(self):
+        """El índice invertido devuelve lo mismo que SQL y se mantiene tras cada escritura."""
+        add_files([self.make_file("a.txt")], ["x", "y"], db_path=TEST_DB_PATH)
+        index.get_index(TEST_DB_PATH)  # cargar antes de las escrituras siguientes
+        add_files([self.make_file("b.txt")], ["y"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("c.txt")], ["x", "y", "z"], db_path=TEST_DB_PATH)
+        add_tags(["z"], ["w"], db_path=TEST_DB_PATH)
+        delete_tags(["x"], ["y"], db_path=TEST_DB_PATH)
+        delete_files(["w"], db_path=TEST_DB_PATH)
+
+        for tags in (["x"], ["y"], ["x", "y"], ["w"], ["z"], ["nada"]):
+            sql = query_files(tags, db_path=TEST_DB_PATH, engine="sql")
+            idx = query_files(tags, db_path=TEST_DB_PATH, engine="index")
+            self.assertEqual(sql, idx, tags)
+        self.assertEqual([r[1] for r in query_files(["y"], db_path=TEST_DB_PATH, engine="index")], ["b.txt"])
+
+
+class TestBooleanQuery(ManagerTestCase):
+
+    def test_parse(self):
+        self.assertEqual(
+            query.parse("(photo OR video) AND 2024 AND NOT draft"),
+            ("and", [("or", [("tag", "photo"), ("tag", "video")]), ("tag", "2024"), ("not", ("tag", "draft"))]),
+        )
+        # Etiquetas seguidas o separadas por coma equivalen a AND
+        self.assertEqual(query.parse("a b,c"), ("and", [("tag", "a"), ("tag", "b"), ("tag", "c")]))
+        self.assertIsNone(query.parse("   "))
+        for bad in ("a AND", "(a", "a)", 'a "b'):
+            with self.assertRaises(query.QuerySyntaxError):
+                query.parse(bad)
+
+    def test_plan_orders_by_cardinality(self):
+        counts = {"photo": 500, "2024": 30, "draft": 400}
+        planned = query.plan(query.parse("photo AND NOT draft AND 2024"), counts.get, 1000)
+        self.assertEqual([c[0] for c in planned[1]], ["tag", "tag", "not"])
+        self.assertEqual(planned[1][0][1], "2024")
+
+    def test_search_files(self):
+        add_files([self.make_file("a.jpg")], ["photo", "2024"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("b.mp4")], ["video", "2024", "draft"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("c.mp4")], ["video", "2023"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("d.mp4")], ["video", "2024"], db_path=TEST_DB_PATH)
+
+        for engine in ("sql", "index"):
+            names = [r[1] for r in search_files("(photo OR video) AND 2024 AND NOT draft",
+                                                db_path=TEST_DB_PATH, engine=engine)]
+            self.assertEqual(names, ["a.jpg", "d.mp4"], engine)
+            names = [r[1] for r in search_files("NOT video", db_path=TEST_DB_PATH, engine=engine)]
+            self.assertEqual(names, ["a.jpg"], engine)
+            self.assertEqual(search_files("video AND inexistente", db_path=TEST_DB_PATH, engine=engine), [])
+
+
+class TestBulkIngest(ManagerTestCase):
+
+    def test_add_directory_in_batches(self):
+        for i in range(5):
+            self.make_file(f"f{i}.txt", b"x" * (i + 1))
+        os.makedirs(os.path.join(self.src_dir, "sub"))
+        with open(os.path.join(self.src_dir, "sub", "g.txt"), "wb") as f:
+            f.write(b"abc")
+
+        stats = manager.add_directory(self.src_dir, ["bulk", "2024"], db_path=TEST_DB_PATH, batch_size=2)
+        self.assertEqual(stats["added"], 6)
+        self.assertEqual(stats["bytes"], 1 + 2 + 3 + 4 + 5 + 3)
+        self.assertEqual(len(query_files(["bulk", "2024"], db_path=TEST_DB_PATH)), 6)
+        for _, _, _, path in query_files([], db_path=TEST_DB_PATH):
+            self.assertTrue(os.path.isfile(path))
+
+        # Repetir la ingesta no duplica nada
+        stats = manager.add_directory(self.src_dir, ["bulk"], db_path=TEST_DB_PATH, batch_size=4)
+        self.assertEqual(stats["added"], 0)
+        self.assertEqual(stats["skipped"], 6)
+
+    def test_parallel_copies_and_rollback(self):
+        paths = [self.make_file(f"p{i}.bin", os.urandom(2048)) for i in range(20)]
+        stats = manager.add_files_bulk(paths, ["p"], db_path=TEST_DB_PATH, batch_size=3, workers=4)
+        self.assertEqual(stats["added"], 20)
+        for _, name, _, path in query_files(["p"], db_path=TEST_DB_PATH):
+            with open(path, "rb") as f, open(os.path.join(self.src_dir, name), "rb") as g:
+                self.assertEqual(f.read(), g.read())
+
+        # Si la escritura en la BD falla, no quedan ficheros huérfanos en storage/
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("CREATE TRIGGER fail BEFORE INSERT ON file_tags BEGIN SELECT RAISE(ABORT, 'boom'); END")
+        conn.commit()
+        close_connection(conn)
+        before = self.stored_files()
+        with self.assertRaises(sqlite3.DatabaseError):
+            manager.add_files_bulk([self.make_file("q.bin")], ["q"], db_path=TEST_DB_PATH)
+        self.assertEqual(self.stored_files(), before)
+        self.assertEqual(query_files(["q"], db_path=TEST_DB_PATH), [])
+
+    def test_add_bulk_endpoint_stays_inside_ingest_root(self):
+        from starlette.testclient import TestClient
+        from server import api
+
+        client = TestClient(api.app)
+        root = api.INGEST_ROOT
+        outside = tempfile.mkdtemp(prefix="tbfs_outside_")
+        self.addCleanup(shutil.rmtree, outside, ignore_errors=True)
+        os.symlink(outside, os.path.join(self.src_dir, "enlace"))
+        try:
+            api.INGEST_ROOT = ""
+            r = client.post("/add-bulk", data={"directory": self.src_dir, "tags": "t"})
+            self.assertEqual(r.status_code, 403)
+            api.INGEST_ROOT = self.src_dir
+            for directory in (outside, os.path.join(self.src_dir, ".."), os.path.join(self.src_dir, "enlace")):
+                r = client.post("/add-bulk", data={"directory": directory, "tags": "t"})
+                self.assertEqual(r.status_code, 403, directory)
+            r = client.post("/add-bulk", data={"directory": os.path.join(self.src_dir, "no"), "tags": "t"})
+            self.assertEqual(r.status_code, 404)
+        finally:
+            api.INGEST_ROOT = root
+
+    def test_bulk_requires_tags(self):
+        stats = manager.add_files_bulk([self.make_file("a.txt")], [" "], db_path=TEST_DB_PATH)
+        self.assertEqual(stats["added"], 0)
+        self.assertEqual(query_files([], db_path=TEST_DB_PATH), [])
+
+
+class TestDedupStorage(ManagerTestCase):
+
+    def test_duplicates_share_one_blob(self):
+        a = self.make_file("a.txt", b"mismo contenido")
+        b = self.make_file("b.txt", b"mismo contenido")
+        c = self.make_file("c.txt", b"otro contenido")
+        stats = manager.add_files_bulk([a, b, c], ["dup"], db_path=TEST_DB_PATH)
+        self.assertEqual(stats["added"], 3)
+        self.assertEqual(stats["deduplicated"], 1)
+        self.assertEqual(len(self.stored_files()), 2)
+
+        paths = {name: path for _, name, _, path in query_files(["dup"], db_path=TEST_DB_PATH)}
+        self.assertEqual(paths["a.txt"], paths["b.txt"])
+        self.assertIn(os.sep.join(["", paths["a.txt"][-64:][:2], paths["a.txt"][-64:][2:4], ""]), paths["a.txt"])
+
+        # Borrar una de las copias no borra el blob compartido
+        add_tags(["dup"], ["x"], db_path=TEST_DB_PATH)
+        delete_tags(["dup"], ["x"], db_path=TEST_DB_PATH)
+        manager.add_files([self.make_file("d.txt", b"mismo contenido")], ["solo_d"], db_path=TEST_DB_PATH)
+        delete_files(["solo_d"], db_path=TEST_DB_PATH)
+        self.assertTrue(os.path.exists(paths["a.txt"]))
+        delete_files(["dup"], db_path=TEST_DB_PATH)
+        self.assertEqual(self.stored_files(), set())
+
+        conn, cursor = get_connection(TEST_DB_PATH)
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], 0)
+        close_connection(conn)
+
+    def test_concurrent_deletes_keep_shared_blob(self):
+        cache.set_enabled(True)
+        self.addCleanup(cache.set_enabled, cache.ENABLED, cache.MAX_ENTRIES, cache.MAX_ROWS)
+        for i in range(4):
+            manager.add_files([self.make_file(f"x{i}.txt", b"compartido")], ["x"], db_path=TEST_DB_PATH)
+        manager.add_files([self.make_file("y.txt", b"compartido")], ["y"], db_path=TEST_DB_PATH)
+        (_, _, _, path), = query_files(["y"], db_path=TEST_DB_PATH)
+
+        # Resultado en caché ya caducado: sus filas desaparecen sin invalidarla
+        query_files(["x"], db_path=TEST_DB_PATH)
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("DELETE FROM files WHERE name = 'x0.txt'")
+        conn.commit()
+        close_connection(conn)
+
+        barrier = threading.Barrier(2)
+
+        def delete():
+            barrier.wait()
+            delete_files(["x"], db_path=TEST_DB_PATH)
+
+        threads = [threading.Thread(target=delete) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(query_files(["x"], db_path=TEST_DB_PATH), [])
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"compartido")
+
+
+class TestStreamingUpload(ManagerTestCase):
+
+    def test_add_upload_streams_into_storage(self):
+        from core import storage
+        writer = storage.BlobWriter(self.storage_dir)
+        for _ in range(4):
+            writer.write(b"trozo" * 100)
+        self.assertTrue(manager.add_upload("subido.txt", writer, ["up"], db_path=TEST_DB_PATH))
+
+        (_, name, tags, path), = query_files(["up"], db_path=TEST_DB_PATH)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"trozo" * 400)
+        self.assertEqual(os.listdir(os.path.join(self.storage_dir, storage.INCOMING_DIR)), [])
+
+        # Nombre repetido: se descarta lo escrito
+        writer = storage.BlobWriter(self.storage_dir)
+        writer.write(b"otro")
+        self.assertFalse(manager.add_upload("subido.txt", writer, ["up"], db_path=TEST_DB_PATH))
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_batch_upload_and_tar(self):
+        import io
+        import tarfile
+        from core import storage
+        from server import archive
+
+        def writer_with(data):
+            writer = storage.BlobWriter(self.storage_dir)
+            writer.write(data)
+            return writer
+
+        uploads = [("a.txt", writer_with(b"a" * 700)), ("b.txt", writer_with(b"a" * 700)),
+                   ("a.txt", writer_with(b"repetido")), ("", writer_with(b"sin nombre"))]
+        stats = manager.add_uploads(uploads, ["lote"], db_path=TEST_DB_PATH)
+        self.assertEqual((stats["added"], stats["skipped"], stats["deduplicated"]), (2, 2, 1))
+        self.assertEqual(len(self.stored_files()), 1)
+
+        # Tar a partir de las cabeceras de server/archive.py
+        out = io.BytesIO()
+        for _, name, _, path in query_files(["lote"], db_path=TEST_DB_PATH):
+            with open(path, "rb") as f:
+                data = f.read()
+            out.write(archive.header(name, len(data), 0) + data + archive.padding(len(data)))
+        out.write(archive.END)
+        out.seek(0)
+        with tarfile.open(fileobj=out, mode="r|") as tar:
+            self.assertEqual([(m.name, tar.extractfile(m).read()) for m in tar],
+                             [("a.txt", b"a" * 700), ("b.txt", b"a" * 700)])
+
+
+class TestQueryCache(ManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.set_enabled(True)
+        add_files([self.make_file("a.txt", b"a")], ["rojo", "grande"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("b.txt", b"b")], ["azul"], db_path=TEST_DB_PATH)
+
+    def tearDown(self):
+        cache.set_enabled(cache.ENABLED, cache.MAX_ENTRIES, cache.MAX_ROWS)
+        super().tearDown()
+
+    def test_hits_and_normalized_key(self):
+        first = query_files(["rojo", "grande"], db_path=TEST_DB_PATH)
+        before = cache.stats()
+        self.assertEqual(query_files(["grande", "rojo", "rojo"], db_path=TEST_DB_PATH), first)
+        search_files("grande AND rojo", db_path=TEST_DB_PATH)
+        search_files("rojo grande", db_path=TEST_DB_PATH)
+        after = cache.stats()
+        # query_files y search_files comparten entrada: misma consulta, mismas filas
+        self.assertEqual(after["hits"] - before["hits"], 3)
+        self.assertEqual(after["misses"] - before["misses"], 0)
+
+    def test_duplicated_tags_on_cold_cache(self):
+        # La primera consulta llena la entrada compartida con "rojo AND grande"
+        self.assertEqual(len(query_files(["rojo", "grande", "grande"], db_path=TEST_DB_PATH)), 1)
+        self.assertEqual(len(query_files(["grande", "rojo"], db_path=TEST_DB_PATH)), 1)
+        self.assertEqual(len(search_files("rojo AND grande", db_path=TEST_DB_PATH)), 1)
+
+    def test_precise_invalidation(self):
+        query_files(["grande"], db_path=TEST_DB_PATH)
+        query_files(["azul"], db_path=TEST_DB_PATH)
+        add_tags(["rojo"], ["nuevo"], db_path=TEST_DB_PATH)
+        hits = cache.stats()["hits"]
+        # "azul" no comparte ficheros con "rojo": sigue en caché
+        self.assertEqual(len(query_files(["azul"], db_path=TEST_DB_PATH)), 1)
+        self.assertEqual(cache.stats()["hits"], hits + 1)
+        # "grande" comparte fichero con "rojo": caduca aunque no se consultara por él
+        self.assertEqual(len(query_files(["grande"], db_path=TEST_DB_PATH)), 1)
+        self.assertEqual(cache.stats()["hits"], hits + 1)
+        (_, _, tags, _), = search_files("grande", db_path=TEST_DB_PATH)
+        self.assertEqual(set(tags.split(",")), {"rojo", "grande", "nuevo"})
+
+    def test_unanchored_queries_follow_every_write(self):
+        self.assertEqual(len(search_files("NOT rojo", db_path=TEST_DB_PATH)), 1)
+        add_files([self.make_file("c.txt", b"c")], ["verde"], db_path=TEST_DB_PATH)
+        self.assertEqual(len(search_files("NOT rojo", db_path=TEST_DB_PATH)), 2)
+        delete_files(["verde"], db_path=TEST_DB_PATH)
+        self.assertEqual(len(query_files([], db_path=TEST_DB_PATH)), 2)
+        delete_tags(["rojo"], ["grande"], db_path=TEST_DB_PATH)
+        self.assertEqual(query_files(["grande"], db_path=TEST_DB_PATH), [])
+
+    def test_eviction(self):
+        cache.set_enabled(True, max_entries=2)
+        for tag in ("rojo", "grande", "azul"):
+            query_files([tag], db_path=TEST_DB_PATH)
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (2, 1))
+
+
+class TestRetagging(ManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_files([self.make_file("x.txt", b"x"), self.make_file("y.txt", b"y")], ["lote", "viejo"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("z.txt", b"z")], ["solo"], db_path=TEST_DB_PATH)
+        index.get_index(TEST_DB_PATH)
+
+    def tags_of(self, name):
+        rows = [r for r in search_files("", db_path=TEST_DB_PATH) if r[1] == name]
+        return set(rows[0][2].split(",")) if rows and rows[0][2] else set()
+
+    def test_add_tags_set_based(self):
+        self.assertTrue(add_tags(["lote", "viejo"], ["nuevo", "nuevo", "otro"], db_path=TEST_DB_PATH))
+        self.assertEqual(self.tags_of("x.txt"), {"lote", "viejo", "nuevo", "otro"})
+        self.assertEqual(self.tags_of("z.txt"), {"solo"})
+        self.assertEqual(len(query_files(["nuevo"], db_path=TEST_DB_PATH, engine="index")), 2)
+        self.assertFalse(add_tags(["no_existe"], ["nuevo"], db_path=TEST_DB_PATH))
+
+    def test_delete_tags_keeps_last_tag(self):
+        self.assertTrue(delete_tags(["lote"], ["viejo"], db_path=TEST_DB_PATH))
+        self.assertEqual(self.tags_of("y.txt"), {"lote"})
+        # Quitar todas: se conserva la última de la lista que tenga cada fichero
+        self.assertFalse(delete_tags([], ["solo"], db_path=TEST_DB_PATH))
+        self.assertEqual(self.tags_of("z.txt"), {"solo"})
+        add_tags(["lote"], ["b"], db_path=TEST_DB_PATH)
+        self.assertTrue(delete_tags(["lote"], ["lote", "b"], db_path=TEST_DB_PATH))
+        self.assertEqual(self.tags_of("x.txt"), {"b"})
+        self.assertEqual(query_files(["lote"], db_path=TEST_DB_PATH, engine="index"), [])
+        self.assertEqual(len(query_files(["b"], db_path=TEST_DB_PATH, engine="index")), 2)
+
+    def test_file_tags_column_and_checker(self):
+        """files.tags sigue a file_tags y el verificador detecta y repara desajustes."""
+        add_tags(["solo"], ["extra"], db_path=TEST_DB_PATH)
+        delete_tags(["lote"], ["viejo"], db_path=TEST_DB_PATH)
+        self.assertEqual(database.check_file_tags(TEST_DB_PATH), [])
+        rows = {r[1]: set(r[2].split(",")) for r in query_files(["lote"], db_path=TEST_DB_PATH, engine="sql")}
+        self.assertEqual(rows, {"x.txt": {"lote"}, "y.txt": {"lote"}})
+
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("UPDATE files SET tags = 'roto' WHERE name = 'z.txt'")
+        conn.commit()
+        close_connection(conn)
+        broken = database.check_file_tags(TEST_DB_PATH)
+        self.assertEqual(len(broken), 1)
+        self.assertEqual(database.check_file_tags(TEST_DB_PATH, repair=True), broken)
+        self.assertEqual(database.check_file_tags(TEST_DB_PATH), [])
+        cache.clear()
+        self.assertEqual(self.tags_of("z.txt"), {"solo", "extra"})
+
+
+class TestTagStats(ManagerTestCase):
+
+    def pairs_from_scratch(self):
+        conn, cursor = get_connection(TEST_DB_PATH)
+        expected = cursor.execute("""
+            SELECT a.tag_id, b.tag_id, COUNT(*) FROM file_tags a
+            JOIN file_tags b ON b.file_id = a.file_id AND b.tag_id <> a.tag_id
+            GROUP BY a.tag_id, b.tag_id
+        """).fetchall()
+        stored = cursor.execute("SELECT tag_a, tag_b, count FROM tag_pairs WHERE count > 0").fetchall()
+        close_connection(conn)
+        return sorted(expected), sorted(stored)
+
+    def test_counters_follow_writes(self):
+        add_files([self.make_file("a.jpg", b"a"), self.make_file("b.jpg", b"b")], ["foto", "2024"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("c.mp4", b"c")], ["video", "2024", "familia"], db_path=TEST_DB_PATH)
+        add_tags(["foto"], ["familia"], db_path=TEST_DB_PATH)
+        delete_tags(["video"], ["2024"], db_path=TEST_DB_PATH)
+        expected, stored = self.pairs_from_scratch()
+        self.assertEqual(stored, expected)
+
+        self.assertEqual(manager.tag_stats(db_path=TEST_DB_PATH)[0], ("familia", 3))
+        self.assertEqual(manager.tag_stats("fo", db_path=TEST_DB_PATH), [("foto", 2)])
+        self.assertEqual(set(manager.cooccurring_tags(query_tags=["familia"], db_path=TEST_DB_PATH)),
+                         {("foto", 2), ("2024", 2), ("video", 1)})
+        self.assertEqual(manager.cooccurring_tags("familia AND NOT video", db_path=TEST_DB_PATH),
+                         [("2024", 2), ("foto", 2)])
+
+        delete_files(["foto"], db_path=TEST_DB_PATH)
+        expected, stored = self.pairs_from_scratch()
+        self.assertEqual(stored, expected)
+        self.assertEqual(manager.tag_stats(db_path=TEST_DB_PATH), [("familia", 1), ("video", 1)])
+        self.assertEqual(manager.cooccurring_tags("familia AND NOT foto", db_path=TEST_DB_PATH), [("video", 1)])
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_ring_is_balanced_and_stable(self):
+        from core.sharding import HashRing
+        names = [f"fichero_{i}.bin" for i in range(6000)]
+        ring3 = HashRing(["n1", "n2", "n3"])
+        counts = {node: len(group) for node, group in ring3.group(names).items()}
+        self.assertEqual(set(counts), {"n1", "n2", "n3"})
+        self.assertTrue(all(1000 < c < 3000 for c in counts.values()), counts)
+        # Con un cuarto nodo sólo se mueven los nombres que pasan a ser suyos
+        ring4 = HashRing(["n1", "n2", "n3", "n4"])
+        moved = [n for n in names if ring3.node_for(n) != ring4.node_for(n)]
+        self.assertTrue(all(ring4.node_for(n) == "n4" for n in moved))
+        self.assertLess(len(moved), len(names) / 2)
+
+    def test_merge_pages_walks_every_shard_once(self):
+        from core import sharding
+        shards = [[{"id": i} for i in ids] for ids in ([1, 2, 5, 9], [], [1, 3, 4, 6, 7, 8])]
+
+        def page(rows, after, limit):
+            rest = [r for r in rows if r["id"] > after][:limit + 1]
+            return rest[:limit], (rest[limit - 1]["id"] if len(rest) > limit else None)
+
+        seen, token = [], "0"
+        while token is not None:
+            cursors = sharding.decode_cursor(token, len(shards))
+            pages = [None if c is None else page(rows, c, 3) for rows, c in zip(shards, cursors)]
+            rows, token = sharding.merge_pages(pages, cursors, 3)
+            self.assertLessEqual(len(rows), 3)
+            seen.extend((shard, row["id"]) for shard, row in rows)
+        expected = sorted(((r["id"], s) for s, rows in enumerate(shards) for r in rows))
+        self.assertEqual(seen, [(s, i) for i, s in expected])
+        with self.assertRaises(ValueError):
+            sharding.decode_cursor("1-2", 3)
+
+
+class TestReplication(ManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        database.enable_changelog(TEST_DB_PATH)
+        self.replica_dir = tempfile.mkdtemp(prefix="tbfs_replica_")
+        self.replica_db = os.path.join(self.replica_dir, "db.db")
+        self.replica_storage = os.path.join(self.replica_dir, "storage")
+        init_db(self.replica_db)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.replica_dir, ignore_errors=True)
+
+    def fetch_blob(self, digest, storage_dir):
+        """Como Follower.fetch_blob, pero leyendo directamente el storage del líder."""
+        from core import replication, storage
+        found = replication.blob_file(digest, TEST_DB_PATH)
+        if found is None:
+            return False
+        writer = storage.BlobWriter(storage_dir, codec=storage.IDENTITY, pack=False)
+        with storage.open_blob(*found) as f:
+            writer.write(f.read())
+        writer.commit()
+        return True
+
+    def sync(self):
+        from core import replication
+        page = replication.changes_after(replication.last_applied(self.replica_db), db_path=TEST_DB_PATH)
+        seq, _ = replication.apply_changes(page["changes"], self.replica_storage, self.fetch_blob,
+                                           db_path=self.replica_db)
+        self.assertEqual(seq, page["head"])
+        cache.clear()
+        leader = [(n, t) for _, n, t, _ in query_files([], db_path=TEST_DB_PATH)]
+        replica = query_files([], db_path=self.replica_db)
+        self.assertEqual([(n, t) for _, n, t, _ in replica], leader)
+        for _, _, _, path in replica:
+            self.assertTrue(path.startswith(self.replica_storage) and os.path.exists(path))
+        return replica
+
+    def test_follower_applies_changelog(self):
+        add_files([self.make_file("a.jpg", b"a"), self.make_file("b.jpg", b"a")], ["foto", "2024"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("c.mp4", b"c")], ["video"], db_path=TEST_DB_PATH)
+        self.assertEqual(len(self.sync()), 3)
+
+        add_tags(["foto"], ["familia"], db_path=TEST_DB_PATH)
+        add_tags(["video"], ["familia"], db_path=TEST_DB_PATH)
+        delete_tags(["video"], ["video"], db_path=TEST_DB_PATH)
+        delete_files(["foto"], db_path=TEST_DB_PATH)
+        self.assertEqual(len(self.sync()), 1)
+        # Blob sin referencias: borrado también en la réplica
+        blobs = [n for _, _, names in os.walk(self.replica_storage) for n in names]
+        self.assertEqual(len(blobs), 1)
+        conn, cursor = get_connection(self.replica_db)
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], 1)
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM changelog").fetchone()[0], 0)
+        close_connection(conn)
+        self.assertEqual(manager.tag_stats(db_path=self.replica_db), [("familia", 1)])
+
+
+class TestChangeLog(ManagerTestCase):
+
+    def setUp(self):
+        from core import wal
+        super().setUp()
+        self._wal_settings = (wal.ENABLED, wal.SEGMENT_BYTES, wal.COMPACT_SEGMENTS)
+        # Segmentos pequeños para que haya varios; compactación sólo a mano
+        wal.ENABLED, wal.SEGMENT_BYTES, wal.COMPACT_SEGMENTS = True, 256, 0
+
+    def tearDown(self):
+        from core import wal
+        wal.close_logs()
+        wal.ENABLED, wal.SEGMENT_BYTES, wal.COMPACT_SEGMENTS = self._wal_settings
+        shutil.rmtree(wal.log_dir(TEST_DB_PATH), ignore_errors=True)
+        super().tearDown()
+
+    def fresh_postings(self):
+        idx = index.TagIndex()
+        conn, cursor = get_connection(TEST_DB_PATH)
+        idx.load(cursor)
+        close_connection(conn)
+        return idx
+
+    def mutate(self, prefix):
+        add_files([self.make_file(f"{prefix}{i}.jpg", f"{prefix}{i}".encode()) for i in range(6)],
+                  ["foto", prefix], db_path=TEST_DB_PATH)
+        add_files([self.make_file(f"{prefix}.mp4", prefix.encode())], ["video", prefix], db_path=TEST_DB_PATH)
+        add_tags([prefix], ["familia"], db_path=TEST_DB_PATH)
+        delete_tags(["video"], ["familia"], db_path=TEST_DB_PATH)
+        delete_files(["video", prefix], db_path=TEST_DB_PATH)
+
+    def test_catch_up_matches_full_rebuild(self):
+        from core import wal
+        self.mutate("a")
+        idx = self.fresh_postings()
+        self.assertEqual(idx.seq, wal.committed_seq(TEST_DB_PATH))
+        self.mutate("b")
+        log = wal.get_log(TEST_DB_PATH)
+        self.assertGreater(len(log.segments), 2)
+        self.assertGreater(idx.catch_up(log), 0)
+        self.assertEqual(idx.postings, self.fresh_postings().postings)
+        self.assertEqual(idx.seq, log.head)
+
+        # Compactado: desde cero se obtiene el mismo estado; desde dentro, hay que reconstruir
+        base = log.compact()
+        self.assertGreater(base, 0)
+        self.mutate("c")
+        replay = index.TagIndex()
+        replay.catch_up(log)
+        self.assertEqual(replay.postings, self.fresh_postings().postings)
+        with self.assertRaises(wal.OffsetUnavailable):
+            list(log.read(1))
+
+        seqs = [change.seq for change in log.read(0)]
+        self.assertEqual(seqs, sorted(set(seqs)))
+
+        # Registros de una transacción no confirmada: no se leen, y se descartan al reabrir
+        head = log.head
+        log.append([(wal.ADD_FILE, (999, "fantasma", ("foto",)))])
+        self.assertEqual(list(log.read(head)), [])
+        wal.close_logs()
+        self.assertEqual(wal.get_log(TEST_DB_PATH).head, head)
+
+    def test_loaded_index_follows_log(self):
+        from core import wal
+        idx = index.get_index(TEST_DB_PATH)
+        self.mutate("a")
+        self.assertEqual(idx.seq, wal.get_log(TEST_DB_PATH).committed)
+        self.assertEqual(idx.postings, self.fresh_postings().postings)
+
+        # Escrituras que el índice no llegó a aplicar: get_index las lee del registro
+        index.drop_index(TEST_DB_PATH)
+        self.mutate("b")
+        index._indexes[os.path.abspath(TEST_DB_PATH)] = idx
+        self.assertIs(index.get_index(TEST_DB_PATH), idx)
+        self.assertEqual(idx.seq, wal.get_log(TEST_DB_PATH).committed)
+        self.assertEqual(idx.postings, self.fresh_postings().postings)
+
+    def test_log_starts_from_existing_catalogue(self):
+        from core import wal
+        wal.ENABLED = False
+        self.mutate("a")
+        wal.ENABLED = True
+        self.mutate("b")
+        replay = index.TagIndex()
+        replay.catch_up(wal.get_log(TEST_DB_PATH))
+        self.assertEqual(replay.postings, self.fresh_postings().postings)
+
+        # Escrituras con el registro desactivado: al reactivarlo se empieza de nuevo
+        wal.close_logs()
+        wal.ENABLED = False
+        self.mutate("c")
+        self.assertEqual(wal.committed_seq(TEST_DB_PATH), 0)
+        # wal_seq sólo se borra en la primera
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("INSERT INTO replication_state (key, value) VALUES ('wal_seq', 0)")
+        conn.commit()
+        close_connection(conn)
+        add_tags(["c"], ["otra"], db_path=TEST_DB_PATH)
+        conn, cursor = get_connection(TEST_DB_PATH)
+        self.assertEqual(cursor.execute("SELECT COUNT(*) FROM replication_state WHERE key = 'wal_seq'").fetchone()[0], 1)
+        close_connection(conn)
+        wal.ENABLED = True
+        self.mutate("d")
+        replay = index.TagIndex()
+        replay.catch_up(wal.get_log(TEST_DB_PATH))
+        self.assertEqual(replay.postings, self.fresh_postings().postings)
+
+
+class TestPagination(ManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        paths = [self.make_file(f"p{i:02d}.txt", f"pagina {i}".encode()) for i in range(12)]
+        add_files(paths[:7], ["todos", "pocos"], db_path=TEST_DB_PATH)
+        add_files(paths[7:], ["todos"], db_path=TEST_DB_PATH)
+
+    def collect(self, **kwargs):
+        names, after = [], 0
+        while True:
+            rows, after, _ = manager.page_files(after=after, limit=5, db_path=TEST_DB_PATH, **kwargs)
+            names.extend(r[1] for r in rows)
+            if after is None:
+                return names
+
+    def test_keyset_pages(self):
+        rows, next_cursor, total = manager.page_files(limit=5, count=True, db_path=TEST_DB_PATH)
+        self.assertEqual([r[1] for r in rows], [f"p{i:02d}.txt" for i in range(5)])
+        self.assertEqual(next_cursor, rows[-1][0])
+        self.assertEqual(total, 12)
+        self.assertEqual(self.collect(), [f"p{i:02d}.txt" for i in range(12)])
+
+    def test_filtered_pages(self):
+        self.assertEqual(self.collect(expression="pocos"), [f"p{i:02d}.txt" for i in range(7)])
+        self.assertEqual(self.collect(query_tags=["todos", "pocos"]), [f"p{i:02d}.txt" for i in range(7)])
+        rows, next_cursor, total = manager.page_files("todos AND NOT pocos", count=True, db_path=TEST_DB_PATH)
+        self.assertEqual((len(rows), next_cursor, total), (5, None, 5))
+
+    def test_iter_files(self):
+        self.assertEqual([r[1] for r in manager.iter_files(batch_size=5, db_path=TEST_DB_PATH)],
+                         [f"p{i:02d}.txt" for i in range(12)])
+        self.assertEqual(len(list(manager.iter_files("NOT pocos", batch_size=2, db_path=TEST_DB_PATH))), 5)
+
+
+class TestAsyncLayer(ManagerTestCase):
+
+    def tearDown(self):
+        from core import aio
+        aio.shutdown()
+        super().tearDown()
+
+    def test_writes_are_serialized_and_reads_concurrent(self):
+        import asyncio
+        from core import aio
+
+        async def chunks(i):
+            for _ in range(3):
+                yield f"subida {i};".encode()
+
+        async def upload(i):
+            writer = await aio.open_blob_writer(self.storage_dir)
+            await aio.write_chunks(writer, chunks(i))
+            return await aio.add_upload(f"async_{i}.txt", writer, ["async"], db_path=TEST_DB_PATH)
+
+        async def scenario():
+            writer_threads = await asyncio.gather(*[aio.run_write(lambda: threading.current_thread().name)
+                                                    for _ in range(5)])
+            results = await asyncio.gather(*[upload(i) for i in range(8)],
+                                           *[aio.page_files("async", db_path=TEST_DB_PATH) for _ in range(8)])
+            page, _, total = await aio.page_files("async", count=True, db_path=TEST_DB_PATH)
+            return writer_threads, results, total
+
+        writer_threads, results, total = asyncio.run(scenario())
+        self.assertEqual(len(set(writer_threads)), 1)
+        self.assertTrue(writer_threads[0].startswith("tbfs-db-write"))
+        self.assertTrue(all(results[:8]))
+        self.assertEqual(total, 8)
+        self.assertEqual(len(self.stored_files()), 8)
+
+
+class TestMetrics(ManagerTestCase):
+
+    def setUp(self):
+        from core import metrics
+        super().setUp()
+        metrics.reset()
+
+    def test_statement_label(self):
+        from core.metrics import statement_label
+        self.assertEqual(statement_label("SELECT id FROM files WHERE name = ?"), "SELECT files")
+        self.assertEqual(statement_label("  insert or ignore into file_tags (file_id, tag_id) VALUES (?, ?)"),
+                         "INSERT file_tags")
+        self.assertEqual(statement_label("CREATE TABLE IF NOT EXISTS tags (id INTEGER)"), "CREATE tags")
+        self.assertEqual(statement_label("BEGIN"), "BEGIN")
+
+    def test_render_after_operations(self):
+        from core import metrics
+        add_files([self.make_file("a.jpg", b"12345")], ["foto"], db_path=TEST_DB_PATH)
+        query_files(["foto"], db_path=TEST_DB_PATH)
+        text = metrics.render()
+        self.assertIn('tbfs_manager_operation_duration_seconds_count{operation="add_files"} 1', text)
+        self.assertIn('tbfs_manager_operation_duration_seconds_count{operation="query_files"} 1', text)
+        self.assertIn('tbfs_storage_written_bytes_total{path="ingest"} 5', text)
+        self.assertRegex(text, r'tbfs_sql_statement_duration_seconds_count\{statement="INSERT files"\} [1-9]')
+        self.assertIn('tbfs_manager_operation_duration_seconds_bucket{operation="add_files",le="+Inf"} 1', text)
+
+    def test_json_log(self):
+        import io
+        import json
+        import logging
+        from core import log
+        buffer = io.StringIO()
+        try:
+            log.configure(fmt="json")
+            with contextlib.redirect_stdout(buffer):
+                add_files([self.make_file("b.jpg")], ["foto"], db_path=TEST_DB_PATH)
+        finally:
+            log.configure()
+        entry = json.loads(buffer.getvalue().splitlines()[0])
+        self.assertEqual((entry["level"], entry["event"], entry["file"]), ("INFO", "add_file", "b.jpg"))
+        self.assertEqual(logging.getLogger("tbfs").level, logging.INFO)
+
+
+class TestQueryTrace(ManagerTestCase):
+
+    def setUp(self):
+        from core import trace
+        super().setUp()
+        self._trace_settings = (trace.ENABLED, trace.SLOW_QUERY_MS, trace.SLOW_LOG)
+        self.log_dir = tempfile.mkdtemp(prefix="tbfs_slowlog_")
+        add_files([self.make_file(f"{i}.jpg", str(i).encode()) for i in range(5)], ["foto"], db_path=TEST_DB_PATH)
+        add_tags(["foto"], ["2024"], db_path=TEST_DB_PATH)
+
+    def tearDown(self):
+        from core import trace
+        trace.close()
+        trace.ENABLED, trace.SLOW_QUERY_MS, trace.SLOW_LOG = self._trace_settings
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+        super().tearDown()
+
+    def test_explain(self):
+        for engine in ("sql", "index"):
+            entry = manager.explain_query(["foto", "2024"], db_path=TEST_DB_PATH, engine=engine)
+            self.assertEqual(entry["query"], "2024 AND foto")
+            self.assertEqual((entry["rows_scanned"], entry["rows_returned"]), (10, 5))
+            self.assertTrue(entry["plan"])
+            self.assertGreaterEqual(entry["total_ms"], entry["sql_ms"] + entry["serialization_ms"] - 0.01)
+        self.assertGreater(entry["aggregation_ms"], 0)
+
+    def test_slow_log(self):
+        import json
+        from core import trace
+        trace.ENABLED, trace.SLOW_QUERY_MS = True, 0
+        trace.SLOW_LOG = os.path.join(self.log_dir, "slow.log")
+        query_files(["foto"], db_path=TEST_DB_PATH)
+        query_files(["foto"], db_path=TEST_DB_PATH)  # de la caché: no se traza
+        trace.SLOW_QUERY_MS = 60_000
+        cache.clear()
+        query_files(["foto"], db_path=TEST_DB_PATH)
+        with open(trace.SLOW_LOG) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual((entries[0]["query"], entries[0]["rows_returned"]), ("foto", 5))
+        self.assertTrue(any("file_tags" in line for line in entries[0]["plan"]))
+
+
+class TestCompression(ManagerTestCase):
+
+    def setUp(self):
+        from core import storage
+        super().setUp()
+        self._codec = storage.COMPRESSION
+        storage.COMPRESSION = storage.GZIP
+        self.text = b"".join(b"2024-01-01 INFO peticion %d atendida\n" % i for i in range(5000))
+        self.noise = os.urandom(100_000)
+
+    def tearDown(self):
+        from core import storage
+        storage.COMPRESSION = self._codec
+        super().tearDown()
+
+    def codecs(self):
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("SELECT f.name, b.codec FROM files f JOIN blobs b ON b.hash = f.blob")
+        rows = dict(cursor.fetchall())
+        close_connection(conn)
+        return rows
+
+    def test_sampled_codec_and_roundtrip(self):
+        add_files([self.make_file("log.txt", self.text), self.make_file("foto.jpg", self.noise)], ["x"],
+                  db_path=TEST_DB_PATH)
+        self.assertEqual(self.codecs(), {"log.txt": "gzip", "foto.jpg": "identity"})
+        info = manager.get_file_info("log.txt", db_path=TEST_DB_PATH)
+        self.assertEqual(info["size"], len(self.text))
+        self.assertLess(os.path.getsize(info["path"]), len(self.text) // 5)
+
+        out = tempfile.mkdtemp(prefix="tbfs_out_")
+        try:
+            self.assertTrue(manager.download_file("log.txt", out, db_path=TEST_DB_PATH))
+            with open(os.path.join(out, "log.txt"), "rb") as f:
+                self.assertEqual(f.read(), self.text)
+        finally:
+            shutil.rmtree(out, ignore_errors=True)
+
+    def test_upload_matches_ingest(self):
+        # El mismo contenido por BlobWriter (en trozos) elige el mismo codec y el mismo blob
+        from core import storage
+        add_files([self.make_file("a.txt", self.text)], ["x"], db_path=TEST_DB_PATH)
+        writer = storage.BlobWriter(self.storage_dir)
+        for i in range(0, len(self.text), 1000):
+            writer.write(self.text[i:i + 1000])
+        self.assertTrue(manager.add_upload("b.txt", writer, ["x"], db_path=TEST_DB_PATH))
+        self.assertEqual(self.codecs(), {"a.txt": "gzip", "b.txt": "gzip"})
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_existing_blob_keeps_its_codec(self):
+        from core import storage
+        # Blob gzip huérfano (escritura que no llegó a registrarse) y otro registrado en gzip
+        storage.store_file(self.make_file("huerfano.txt", self.text), self.storage_dir)
+        log2 = self.text + b"fin\n"
+        add_files([self.make_file("a.txt", log2)], ["x"], db_path=TEST_DB_PATH)
+
+        storage.COMPRESSION = storage.IDENTITY
+        add_files([self.make_file("b.txt", self.text), self.make_file("c.txt", log2)], ["x"], db_path=TEST_DB_PATH)
+        writer = storage.BlobWriter(self.storage_dir)
+        writer.write(self.text)
+        self.assertTrue(manager.add_upload("d.txt", writer, ["x"], db_path=TEST_DB_PATH))
+        self.assertEqual(self.codecs(), {"a.txt": "gzip", "b.txt": "gzip", "c.txt": "gzip", "d.txt": "gzip"})
+        for name, content in (("b.txt", self.text), ("c.txt", log2), ("d.txt", self.text)):
+            info = manager.get_file_info(name, db_path=TEST_DB_PATH)
+            with storage.open_blob(info["path"], info["codec"]) as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_http_encodings(self):
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+        from starlette.testclient import TestClient
+        from server.ranges import RangeFileResponse, accepts_encoding
+        add_files([self.make_file("log.txt", self.text)], ["x"], db_path=TEST_DB_PATH)
+        info = manager.get_file_info("log.txt", db_path=TEST_DB_PATH)
+
+        def endpoint(request):
+            if accepts_encoding(request.headers.get("accept-encoding"), "gzip"):
+                return RangeFileResponse(info["path"], request.headers, etag='"x-gzip"', content_encoding="gzip")
+            return RangeFileResponse(info["path"], request.headers, etag='"x"', decode="gzip", size=info["size"])
+
+        client = TestClient(Starlette(routes=[Route("/d", endpoint)]))
+        r = client.get("/d", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual((r.headers["content-encoding"], r.content), ("gzip", self.text))
+        r = client.get("/d", headers={"Accept-Encoding": "identity", "Range": "bytes=0-9"})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotIn("content-encoding", r.headers)
+        self.assertEqual((int(r.headers["content-length"]), r.content), (len(self.text), self.text))
+        self.assertFalse(accepts_encoding("gzip;q=0, br", "gzip"))
+        self.assertTrue(accepts_encoding("*", "gzip"))
+
+
+class TestPacks(ManagerTestCase):
+
+    def setUp(self):
+        from core import packs
+        super().setUp()
+        self._pack_settings = (packs.THRESHOLD, packs.PACK_BYTES)
+        packs.THRESHOLD, packs.PACK_BYTES = 4096, 10_000
+
+    def tearDown(self):
+        from core import packs
+        packs.close()
+        packs.THRESHOLD, packs.PACK_BYTES = self._pack_settings
+        super().tearDown()
+
+    def read(self, name):
+        from core import storage
+        info = manager.get_file_info(name, db_path=TEST_DB_PATH)
+        with storage.open_blob(info["path"], info["codec"], info["offset"], info["length"]) as f:
+            return f.read()
+
+    def test_small_files_share_packs(self):
+        contents = {f"f{i}.txt": b"%04d" % i * 250 for i in range(30)}
+        paths = [self.make_file(name, data) for name, data in contents.items()]
+        paths.append(self.make_file("copia.txt", contents["f0.txt"]))
+        paths.append(self.make_file("grande.bin", os.urandom(5000)))
+        stats = manager.add_files_bulk(paths, ["t"], db_path=TEST_DB_PATH, batch_size=7)
+        self.assertEqual((stats["added"], stats["deduplicated"]), (32, 1))
+
+        stored = self.stored_files()
+        self.assertEqual(len([p for p in stored if p.startswith("packs" + os.sep)]), 3)
+        self.assertEqual(len(stored), 4)
+        for name, data in contents.items():
+            self.assertEqual(self.read(name), data)
+        self.assertEqual(self.read("copia.txt"), contents["f0.txt"])
+        self.assertIsNone(manager.get_file_info("grande.bin", db_path=TEST_DB_PATH)["offset"])
+
+        out = tempfile.mkdtemp(prefix="tbfs_out_")
+        try:
+            self.assertTrue(manager.download_file("f7.txt", out, db_path=TEST_DB_PATH))
+            with open(os.path.join(out, "f7.txt"), "rb") as f:
+                self.assertEqual(f.read(), contents["f7.txt"])
+        finally:
+            shutil.rmtree(out, ignore_errors=True)
+
+    def test_threshold_change_reuses_packed_blob(self):
+        from core import packs, storage
+        add_files([self.make_file("relleno.txt", b"r" * 500)], ["t"], db_path=TEST_DB_PATH)
+        add_files([self.make_file("uno.txt", b"contenido en pack")], ["t"], db_path=TEST_DB_PATH)
+        packs.THRESHOLD = 0
+        add_files([self.make_file("dos.txt", b"contenido en pack")], ["t"], db_path=TEST_DB_PATH)
+        writer = storage.BlobWriter(self.storage_dir)
+        writer.write(b"contenido en pack")
+        self.assertTrue(manager.add_upload("tres.txt", writer, ["t"], db_path=TEST_DB_PATH))
+
+        # Las copias usan el blob del pack, sin ficheros sueltos de más
+        info = manager.get_file_info("uno.txt", db_path=TEST_DB_PATH)
+        self.assertEqual(info["offset"], 500)
+        for name in ("dos.txt", "tres.txt"):
+            self.assertEqual(manager.get_file_info(name, db_path=TEST_DB_PATH)["path"], info["path"])
+            self.assertEqual(self.read(name), b"contenido en pack")
+        self.assertEqual(self.stored_files(), {os.path.join("packs", "000001.pack")})
+
+    def test_upload_and_ranges_from_pack(self):
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+        from starlette.testclient import TestClient
+        from core import storage
+        from server.ranges import RangeFileResponse
+        add_files([self.make_file("antes.txt", b"x" * 1000)], ["t"], db_path=TEST_DB_PATH)
+        payload = bytes(range(256)) * 8
+        writer = storage.BlobWriter(self.storage_dir)
+        for i in range(0, len(payload), 100):
+            writer.write(payload[i:i + 100])
+        self.assertTrue(manager.add_upload("subido.bin", writer, ["t"], db_path=TEST_DB_PATH))
+        # Ni fichero temporal: se retuvo en memoria hasta añadirlo al pack
+        self.assertFalse(os.path.isdir(os.path.join(self.storage_dir, storage.INCOMING_DIR)))
+        info = manager.get_file_info("subido.bin", db_path=TEST_DB_PATH)
+        self.assertEqual((info["offset"], info["length"]), (1000, len(payload)))
+
+        def endpoint(request):
+            return RangeFileResponse(info["path"], request.headers, etag=info["etag"],
+                                     offset=info["offset"], length=info["length"])
+
+        client = TestClient(Starlette(routes=[Route("/d", endpoint)]))
+        self.assertEqual(client.get("/d").content, payload)
+        r = client.get("/d", headers={"Range": "bytes=10-19"})
+        self.assertEqual((r.status_code, r.content), (206, payload[10:20]))
+        self.assertEqual(r.headers["content-range"], f"bytes 10-19/{len(payload)}")
+
+    def test_compaction_reclaims_deleted_entries(self):
+        from core import packs
+        for i in range(40):
+            add_files([self.make_file(f"f{i}.txt", b"%04d" % i * 250)], ["vivo" if i % 4 == 0 else "muerto"],
+                      db_path=TEST_DB_PATH)
+        before = packs.pack_files(self.storage_dir)
+        self.assertEqual(len(before), 4)
+        delete_files(["muerto"], db_path=TEST_DB_PATH)
+        self.assertEqual(packs.pack_files(self.storage_dir), before)
+
+        # 10 blobs de 1000 bytes por pack; sólo se compactan los cerrados (el último recibe los vivos)
+        stats = manager.compact_packs(db_path=TEST_DB_PATH)
+        self.assertEqual((stats["packs"], stats["moved"], stats["reclaimed"]), (3, 8, 22 * 1000))
+        after = packs.pack_files(self.storage_dir)
+        self.assertEqual(after[0], before[-1])
+        self.assertEqual(manager.compact_packs(db_path=TEST_DB_PATH)["packs"], 1)
+        self.assertEqual(len(packs.pack_files(self.storage_dir)), 1)
+        for i in range(0, 40, 4):
+            self.assertEqual(self.read(f"f{i}.txt"), b"%04d" % i * 250)
+        conn, cursor = get_connection(TEST_DB_PATH)
+        cursor.execute("SELECT COUNT(*) FROM files f JOIN blobs b ON b.hash = f.blob WHERE f.path != b.path")
+        self.assertEqual(cursor.fetchone()[0], 0)
+        close_connection(conn)
+        self.assertEqual(manager.compact_packs(db_path=TEST_DB_PATH)["packs"], 0)
+
+
+class TestRangeDownload(ManagerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+        from starlette.testclient import TestClient
+        from server.ranges import RangeFileResponse
+
+        self.payload = bytes(range(256)) * 40
+        add_files([self.make_file("datos.bin", self.payload)], ["bin"], db_path=TEST_DB_PATH)
+        self.info = manager.get_file_info("datos.bin", db_path=TEST_DB_PATH)
+
+        def endpoint(request):
+            return RangeFileResponse(self.info["path"], request.headers, etag=self.info["etag"],
+                                     filename="datos.bin", method=request.method)
+
+        self.client = TestClient(Starlette(routes=[Route("/d", endpoint, methods=["GET", "HEAD"])]))
+
+    def test_parse_range(self):
+        from server.ranges import parse_range, RangeNotSatisfiable
+        self.assertEqual(parse_range("bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parse_range("bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parse_range("bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parse_range("bytes=0-1,50-200", 100), [(0, 1), (50, 99)])
+        self.assertIsNone(parse_range("items=0-1", 100))
+        self.assertIsNone(parse_range("bytes=5-1", 100))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=100-", 100)
+
+    def test_full_and_partial(self):
+        r = self.client.get("/d")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, self.payload)
+        self.assertEqual(r.headers["etag"], self.info["etag"])
+        self.assertEqual(r.headers["accept-ranges"], "bytes")
+
+        r = self.client.get("/d", headers={"Range": "bytes=100-199"})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, self.payload[100:200])
+        self.assertEqual(r.headers["content-range"], f"bytes 100-199/{len(self.payload)}")
+
+        r = self.client.get("/d", headers={"Range": f"bytes={len(self.payload)}-"})
+        self.assertEqual(r.status_code, 416)
+
+    def test_multi_range(self):
+        r = self.client.get("/d", headers={"Range": "bytes=0-3,-4"})
+        self.assertEqual(r.status_code, 206)
+        self.assertTrue(r.headers["content-type"].startswith("multipart/byteranges"))
+        self.assertEqual(int(r.headers["content-length"]), len(r.content))
+        self.assertIn(self.payload[:4], r.content)
+        self.assertIn(self.payload[-4:], r.content)
+
+    def test_conditional(self):
+        r = self.client.get("/d", headers={"If-None-Match": self.info["etag"]})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.content, b"")
+        last_modified = self.client.head("/d").headers["last-modified"]
+        self.assertEqual(self.client.get("/d", headers={"If-Modified-Since": last_modified}).status_code, 304)
+
+        # If-Range con un validador viejo: se ignora el rango y se envía todo
+        r = self.client.get("/d", headers={"Range": "bytes=0-9", "If-Range": '"viejo"'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, self.payload)
+
+
 if __name__ == "__main__":
     unittest.main()